@@ -1,50 +1,93 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from flask_cors import CORS
-import subprocess
+import functools
 import json
 import os
+import random
 import re
+import threading
+import time
+
+import config
+from bank import ChallengeBank
+from challenge_pool import ChallengePool, objective_bucket
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from content_cache import ContentCache
+from dedup import NearDuplicateIndex
+from fallback_content import fallback_challenges, fallback_story
+from grader import Grader
+from hedging import HEDGE_OFF, Hedger, LatencyTracker
+from json_repair import LenientJSONError, ObjectEndScanner, find_json_start, parse_lenient
+from lookahead import LookaheadSessions
+from metrics import ProfileStore, SamplingProfiler, registry
+from providers import create_provider
+from q_executor import PRIORITY_INTERACTIVE, PRIORITY_PRELOAD, QExecutor, QueueFullError
+from shared_state import SharedState
+from singleflight import SingleFlight
 
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
-def fix_json_string_escaping(json_str):
-    # First, handle Python code templates with backslashes
-    # Replace all backslashes with double backslashes in template and answer fields
-    json_str = re.sub(r'"template":\s*"(.*?)"', 
-                     lambda m: '"template": "' + m.group(1).replace('\\', '\\\\').replace('\\\\"', '\\"') + '"', 
-                     json_str, flags=re.DOTALL)
-    
-    json_str = re.sub(r'"answer":\s*"(.*?)"', 
-                     lambda m: '"answer": "' + m.group(1).replace('\\', '\\\\').replace('\\\\"', '\\"') + '"', 
-                     json_str, flags=re.DOTALL)
-    
-    # Fix unescaped quotes in strings
-    json_str = re.sub(r'(?<!")(".*?[^\\]")(?!")', r'\\\1', json_str)
-    
-    # Handle unescaped quotes in strings
-    in_string = False
-    result = ""
-    i = 0
-    
-    while i < len(json_str):
-        char = json_str[i]
-        
-        if char == '"' and (i == 0 or json_str[i-1] != '\\'):
-            in_string = not in_string
-            result += char
-        elif char == '"' and json_str[i-1] == '\\':
-            # Already escaped quote
-            result += char
-        elif in_string and char == '\\' and i+1 < len(json_str) and json_str[i+1] != '"' and json_str[i+1] != '\\':
-            # Escape backslashes that aren't already escaping something
-            result += '\\\\'
-        else:
-            result += char
-            
-        i += 1
-    
-    return result
+# Every Amazon Q generation goes through this executor and provider
+llm_provider = create_provider(
+    config.LLM_PROVIDER,
+    binary=config.Q_BINARY,
+    latency=config.LOCAL_PROVIDER_LATENCY,
+    error_rate=config.LOCAL_PROVIDER_ERROR_RATE,
+    malformed_rate=config.LOCAL_PROVIDER_MALFORMED_RATE,
+    fixtures=config.LOCAL_PROVIDER_FIXTURES,
+    seed=config.LOCAL_PROVIDER_SEED,
+    workers=config.Q_MAX_CONCURRENCY,
+    max_prompts=config.WARM_Q_MAX_PROMPTS,
+    max_rss_growth_mb=config.WARM_Q_MAX_RSS_GROWTH_MB,
+    prewarm=config.WARM_Q_PREWARM,
+    startup_timeout_seconds=config.WARM_Q_STARTUP_TIMEOUT_SECONDS,
+    clear_command=config.WARM_Q_CLEAR_COMMAND,
+)
+# Stops sending work to Amazon Q while it is failing or too slow
+circuit_breaker = CircuitBreaker(
+    window_seconds=config.CIRCUIT_WINDOW_SECONDS,
+    min_calls=config.CIRCUIT_MIN_CALLS,
+    failure_rate=config.CIRCUIT_FAILURE_RATE,
+    slow_call_seconds=config.CIRCUIT_SLOW_CALL_SECONDS,
+    open_seconds=config.CIRCUIT_OPEN_SECONDS,
+    probes=config.CIRCUIT_PROBES,
+) if config.CIRCUIT_ENABLED else None
+q_executor = QExecutor(
+    llm_provider,
+    max_workers=config.Q_MAX_CONCURRENCY,
+    max_queue=config.Q_MAX_QUEUE,
+    preload_queue=config.Q_PRELOAD_QUEUE,
+    breaker=circuit_breaker,
+)
+
+hedger = Hedger(
+    q_executor,
+    mode=config.HEDGE_MODE,
+    fanout=config.HEDGE_FANOUT,
+    tracker=LatencyTracker(
+        percentile=config.HEDGE_PERCENTILE,
+        default_delay=config.HEDGE_DEFAULT_DELAY_SECONDS,
+        min_delay=config.HEDGE_MIN_DELAY_SECONDS,
+    ),
+)
+
+# Generation pipeline metrics, exported on /api/metrics
+PARSE_SECONDS = registry.histogram(
+    "parse_seconds", "Time spent parsing and repairing Amazon Q output", ("kind",))
+PARSE_RESULTS = registry.counter(
+    "parse_results_total", "Parsed Amazon Q responses by outcome", ("kind", "result"))
+JSON_REPAIRS = registry.counter(
+    "json_repairs_total", "Repairs applied to Amazon Q JSON", ("repair",))
+TRUNCATIONS = registry.counter(
+    "truncations_total", "Amazon Q responses that were cut short", ("reason",))
+GENERATION_ATTEMPTS = registry.histogram(
+    "generation_attempts", "Amazon Q attempts used per generation", ("kind", "outcome"), buckets=(1, 2, 3, 4, 5))
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_seconds", "Time to produce an API response (headers only for streams)", ("endpoint", "status"))
+
+# Recent per-request profiles, see /api/profiles
+profiles = ProfileStore()
 
 def clean_javascript_code(code):
     if not code:
@@ -85,375 +128,1217 @@ def clean_javascript_code(code):
     
     return code
 
-def generate_with_amazon_q(prompt, max_tokens=500):
+def limit_prompt(prompt, max_tokens):
     # Add length limitation to the prompt
-    limited_prompt = f"{prompt}\n\nIMPORTANT: Keep your response concise and under {max_tokens} tokens. Focus on essential information only. ENSURE ALL JSON IS VALID AND PROPERLY FORMATTED."
+    return f"{prompt}\n\nIMPORTANT: Keep your response concise and under {max_tokens} tokens. Focus on essential information only. ENSURE ALL JSON IS VALID AND PROPERLY FORMATTED."
+
+def attempt_timeout(deadline):
+    # Never let a single attempt outlive the request deadline
+    timeout = config.Q_TIMEOUT_SECONDS
+    if deadline is not None:
+        timeout = min(timeout, deadline - time.time())
+    return timeout
+
+def process_q_result(result, max_tokens):
+    # Turns executor output into {"content": ...} or {"error": ...}
+    if "error" in result:
+        return result
+    
+    if result["returncode"] != 0:
+        return {"error": "Amazon Q failed to generate content", "details": result["stderr"]}
+    
+    content = result["stdout"].strip()
+    
+    # Additional length check - truncate if still too long
+    if len(content.split()) > max_tokens * 1.5:  # Using word count as rough approximation
+        # Truncate to avoid excessively long responses
+        content_parts = content.split()
+        content = " ".join(content_parts[:max_tokens]) + "..."
+        TRUNCATIONS.inc(reason="word_limit")
+    
+    return {"content": content}
+
+def generate_with_amazon_q(prompt, max_tokens=500, priority=PRIORITY_INTERACTIVE, deadline=None):
+    timeout = attempt_timeout(deadline)
+    if timeout <= 0:
+        return {"error": "Request to Amazon Q timed out"}
     
     try:
-        # Prepare the command to run Amazon Q CLI
-        command = ["q", "chat", "--no-interactive", limited_prompt]
-        
-        # Execute the command and capture output
-        result = subprocess.run(command, capture_output=True, text=True, timeout=30)
-        
-        if result.returncode != 0:
-            return {"error": "Amazon Q failed to generate content", "details": result.stderr}
-        
-        content = result.stdout.strip()
+        # Queue the prompt on the shared executor and wait for the provider's output
+        result = q_executor.run(limit_prompt(prompt, max_tokens), priority=priority, timeout=timeout)
         
-        # Additional length check - truncate if still too long
-        if len(content.split()) > max_tokens * 1.5:  # Using word count as rough approximation
-            # Truncate to avoid excessively long responses
-            content_parts = content.split()
-            content = " ".join(content_parts[:max_tokens]) + "..."
-        
-        # Pre-process content to improve JSON formatting
-        # Find JSON content between curly braces
-        json_start = content.find('{')
-        json_end = content.rfind('}') + 1
-        if json_start >= 0 and json_end > json_start:
-            json_part = content[json_start:json_end]
-            # Ensure property names are quoted
-            json_part = re.sub(r'([{,])\s*([a-zA-Z0-9_]+)\s*:', r'\1"\2":', json_part)
-            # Replace the JSON part in the content
-            content = content[:json_start] + json_part + content[json_end:]
-        
-        return {"content": content}
-    except subprocess.TimeoutExpired:
-        return {"error": "Request to Amazon Q timed out"}
+        return process_q_result(result, max_tokens)
+    except QueueFullError:
+        raise
     except Exception as e:
         return {"error": f"Error generating content: {str(e)}"}
 
-def create_story_json(content):
+def generate_validated(prompt, parse_fn, max_tokens=500, priority=PRIORITY_INTERACTIVE, deadline=None):
+    # One generation attempt that only counts if parse_fn accepts the output.
+    # Interactive requests may be hedged across several Amazon Q processes.
+    if hedger.mode == HEDGE_OFF or priority != PRIORITY_INTERACTIVE:
+        result = generate_with_amazon_q(prompt, max_tokens=max_tokens, priority=priority, deadline=deadline)
+        if "error" in result:
+            return None, result["error"]
+        return parse_fn(result["content"])
+    
+    timeout = attempt_timeout(deadline)
+    if timeout <= 0:
+        return None, "Request to Amazon Q timed out"
+    
+    def validate(result):
+        result = process_q_result(result, max_tokens)
+        if "error" in result:
+            return None, result["error"]
+        return parse_fn(result["content"])
+    
+    return hedger.run(limit_prompt(prompt, max_tokens), validate, priority, timeout)
+
+def stream_with_amazon_q(prompt, parse_fn, max_tokens=500, priority=PRIORITY_INTERACTIVE, deadline=None):
+    # Generator version of generate_with_amazon_q. Yields ("progress", info)
+    # while Amazon Q is writing, then ("result", parsed) or ("error", message).
+    # The child is killed as soon as parse_fn accepts the first complete object.
+    timeout = attempt_timeout(deadline)
+    if timeout <= 0:
+        yield "error", "Request to Amazon Q timed out"
+        return
+    
+    job = q_executor.submit(limit_prompt(prompt, max_tokens), priority=priority, timeout=timeout, stream=True)
     try:
-        # Find JSON content between curly braces
-        json_start = content.find('{')
-        json_end = content.rfind('}') + 1
-        if json_start >= 0 and json_end > json_start:
-            json_content = content[json_start:json_end]
-            parsed_content = json.loads(json_content)
-            
-            # Additional length checks on individual fields
-            if "story" in parsed_content and len(parsed_content["story"]) > 800:
-                parsed_content["story"] = parsed_content["story"][:800] + "..."
-            if "objective" in parsed_content and len(parsed_content["objective"]) > 250:
-                parsed_content["objective"] = parsed_content["objective"][:250] + "..."
-                
-            return parsed_content, None
+        buffer = []
+        received = 0
+        last_progress = 0
+        scanner = ObjectEndScanner()
+        # Where the object the scanner is looking at starts in the output
+        start = 0
+        for chunk in job.iter_output():
+            buffer.append(chunk)
+            received += len(chunk)
+            end = scanner.feed(chunk)
+            while end >= 0:
+                text = "".join(buffer)
+                parsed_content, error = parse_fn(text[start:end])
+                if parsed_content is not None:
+                    job.accepted = True
+                    yield "result", parsed_content
+                    return
+                # Try the next object, which may already be in the buffer;
+                # the full output gets one more try at the end
+                start = end
+                scanner = ObjectEndScanner()
+                scanner.offset = end
+                end = scanner.feed(text[end:])
+            if time.time() - last_progress >= 0.25:
+                last_progress = time.time()
+                yield "progress", {"bytes": received}
+    finally:
+        # Stop the child if we're done with it or the client went away
+        job.cancel()
+    
+    result = job.wait(1) or {"error": "Request to Amazon Q timed out"}
+    if "error" in result:
+        yield "error", result["error"]
+        return
+    if result["returncode"] != 0:
+        yield "error", "Amazon Q failed to generate content"
+        return
+    parsed_content, error = parse_fn(result["stdout"].strip())
+    if parsed_content is None:
+        yield "error", error
+    else:
+        yield "result", parsed_content
+
+def record_repairs(repairs):
+    if repairs:
+        print(f"Repaired Amazon Q JSON: {', '.join(repairs)}")
+    for repair in repairs:
+        JSON_REPAIRS.inc(repair=repair)
+        if repair == "truncated":
+            TRUNCATIONS.inc(reason="incomplete_json")
+
+def parse_q_json(content):
+    # Repairs happen in a single pass, see json_repair.py
+    json_start = content.find('{')
+    if json_start < 0:
+        return None, "Could not parse JSON from Amazon Q response"
+    try:
+        parsed_content, repairs = parse_lenient(content, json_start)
+    except LenientJSONError as e:
+        return None, f"Invalid JSON format: {str(e)}"
+    if not isinstance(parsed_content, dict):
+        return None, "Could not parse JSON from Amazon Q response"
+    record_repairs(repairs)
+    # A cut-off object is missing whatever came after the cut; retry instead
+    if "truncated" in repairs:
+        return None, "Amazon Q response ended before the JSON was complete"
+    return parsed_content, None
+
+def parse_q_json_list(content):
+    # Batch responses should be a JSON array, but accept a wrapped or single object too.
+    # Prose before the payload can contain brackets of its own ("[note: ...]"),
+    # so a bracketed value without any objects in it is skipped.
+    error = "Could not parse JSON from Amazon Q response"
+    json_start = find_json_start(content)
+    while json_start >= 0:
+        try:
+            parsed_content, repairs = parse_lenient(content, json_start)
+        except LenientJSONError as e:
+            error = f"Invalid JSON format: {str(e)}"
         else:
-            return None, "Could not parse JSON from Amazon Q response"
-    except json.JSONDecodeError:
-        return None, "Invalid JSON response from Amazon Q"
+            if isinstance(parsed_content, dict):
+                parsed_content = unwrap_json_list(parsed_content)
+            if isinstance(parsed_content, list) and any(isinstance(item, dict) for item in parsed_content):
+                break
+        json_start = find_json_start(content, json_start + 1)
+    else:
+        return None, error
+    record_repairs(repairs)
+    if "truncated" in repairs:
+        # Only the last item, the one the output was cut off in, is incomplete
+        if len(parsed_content) < 2:
+            return None, "Amazon Q response ended before the JSON was complete"
+        parsed_content = parsed_content[:-1]
+    return parsed_content, None
+
+def unwrap_json_list(parsed_content):
+    # {"challenges": [...]} is a wrapped batch; any other object is a single
+    # challenge, whose own list fields (options) must not be mistaken for one
+    for key in ("challenges", "items"):
+        if isinstance(parsed_content.get(key), list):
+            return parsed_content[key]
+    nested = next((value for value in parsed_content.values()
+                   if isinstance(value, list) and value and all(isinstance(item, dict) for item in value)), None)
+    return nested if nested is not None else [parsed_content]
+
+def create_story_json(content):
+    with PARSE_SECONDS.time(kind="story"):
+        parsed_content, error = parse_q_json(content)
+    PARSE_RESULTS.inc(kind="story", result="failed" if error else "ok")
+    if error:
+        return None, error
+    
+    missing_fields = [field for field in ("title", "story", "objective") if not parsed_content.get(field)]
+    if missing_fields:
+        return None, f"Story missing required fields: {', '.join(missing_fields)}"
+    
+    # Additional length checks on individual fields
+    if "story" in parsed_content and len(parsed_content["story"]) > 800:
+        parsed_content["story"] = parsed_content["story"][:800] + "..."
+    if "objective" in parsed_content and len(parsed_content["objective"]) > 250:
+        parsed_content["objective"] = parsed_content["objective"][:250] + "..."
+        
+    return parsed_content, None
 
 def create_challenge_json(content, language):
+    with PARSE_SECONDS.time(kind="challenge"):
+        parsed_content, error = parse_q_json(content)
+    PARSE_RESULTS.inc(kind="challenge", result="failed" if error else "ok")
+    if error:
+        return None, error
+    return normalize_challenge(parsed_content, language)
+
+def normalize_challenge(parsed_content, language):
     try:
-        # Find JSON content between curly braces
-        json_start = content.find('{')
-        json_end = content.rfind('}') + 1
-        if json_start >= 0 and json_end > json_start:
-            json_content = content[json_start:json_end]
-            
-            # Fix common JSON formatting issues
-            json_content = json_content.replace('\n', ' ')
-            
-            # Clean up the JSON content before parsing
-            # Remove any markdown code block markers
-            json_content = re.sub(r'```json|```', '', json_content)
-            # Ensure property names are quoted
-            json_content = re.sub(r'([{,])\s*([a-zA-Z0-9_]+)\s*:', r'\1"\2":', json_content)
-            # Fix missing commas between properties
-            json_content = re.sub(r'"\s*}\s*"', '", "', json_content)
-            # Fix unescaped quotes in strings
-            json_content = re.sub(r'(?<!")(".*?[^\\]")(?!")', r'\1', json_content)
+        if not isinstance(parsed_content, dict):
+            return None, "Challenge is not a JSON object"
+        
+        # Clean code based on language
+        if "template" in parsed_content:
+            # Convert \n sequences to actual newlines for all languages
+            parsed_content["template"] = parsed_content["template"].replace('\\n', '\n')
             
-            # Try multiple parsing approaches to handle different JSON issues
-            for attempt_num, parsing_attempt in enumerate([
-                # Attempt 1: Try parsing the JSON as is
-                lambda c: json.loads(c),
-                
-                # Attempt 2: Fix escaping and try again
-                lambda c: json.loads(c.replace('\\', '\\\\').replace('\\\\"', '\\"')),
-                
-                # Attempt 3: Use regex to ensure property names are properly quoted
-                lambda c: json.loads(re.sub(r'([{,])\s*([a-zA-Z0-9_]+)\s*:', r'\1"\2":', c)),
-                
-                # Attempt 4: Combine approaches 2 and 3
-                lambda c: json.loads(re.sub(r'([{,])\s*([a-zA-Z0-9_]+)\s*:', r'\1"\2":', 
-                                           c.replace('\\', '\\\\').replace('\\\\"', '\\"'))),
-                
-                # Attempt 5: Fix missing commas between properties
-                lambda c: json.loads(re.sub(r'"\s*}\s*"', '", "', 
-                                           re.sub(r'"\s*{\s*"', '", "', 
-                                                 re.sub(r'([{,])\s*([a-zA-Z0-9_]+)\s*:', r'\1"\2":', 
-                                                       c.replace('\\', '\\\\').replace('\\\\"', '\\"'))))),
-                
-                # Attempt 6: Use a more aggressive approach to fix JSON
-                lambda c: json.loads(re.sub(r'([{,])\s*([a-zA-Z0-9_]+)\s*:', r'\1"\2":', 
-                                           c.replace('\\', '\\\\').replace('\\\\"', '\\"')
-                                            .replace("'", '"')))
-            ]):
-                try:
-                    parsed_content = parsing_attempt(json_content)
-                    print(f"Challenge parsing succeeded on attempt {attempt_num + 1}")
-                    break
-                except json.JSONDecodeError as e:
-                    if attempt_num == 5:  # Last attempt failed
-                        return None, f"Invalid JSON format: {str(e)}"
-                    continue
-                except Exception as e:
-                    if attempt_num == 5:  # Last attempt failed
-                        return None, f"Error parsing JSON: {str(e)}"
-                    continue
+            if language.lower() == "javascript":
+                parsed_content["template"] = clean_javascript_code(parsed_content["template"])
+        
+        if "answer" in parsed_content:
+            # Also handle newlines in answers if needed
+            parsed_content["answer"] = parsed_content["answer"].replace('\\n', '\n')
             
-            # Clean code based on language
-            if "template" in parsed_content:
-                # Convert \n sequences to actual newlines for all languages
-                parsed_content["template"] = parsed_content["template"].replace('\\n', '\n')
-                
-                if language.lower() == "javascript":
-                    parsed_content["template"] = clean_javascript_code(parsed_content["template"])
+            # Don't apply underscore-to-comma conversion for Python answers
+            if language.lower() == "javascript":
+                parsed_content["answer"] = clean_javascript_code(parsed_content["answer"])
+        
+        # Ensure fill-in-blank challenges have at least 2 blanks
+        if parsed_content.get("type") == "fill-in-blank":
+            template = parsed_content.get("template", "")
+            blank_count = template.count("_____")
             
-            if "answer" in parsed_content:
-                # Also handle newlines in answers if needed
-                parsed_content["answer"] = parsed_content["answer"].replace('\\n', '\n')
-                
-                # Don't apply underscore-to-comma conversion for Python answers
-                if language.lower() == "javascript":
-                    parsed_content["answer"] = clean_javascript_code(parsed_content["answer"])
+            if blank_count < 2:
+                # If there's only one blank, reject and generate a new challenge
+                return None, "Generated challenge doesn't meet requirements. Please try again."
             
-            # Ensure fill-in-blank challenges have at least 2 blanks
-            if parsed_content.get("type") == "fill-in-blank":
-                template = parsed_content.get("template", "")
-                blank_count = template.count("_____")
-                
-                if blank_count < 2:
-                    # If there's only one blank, reject and generate a new challenge
-                    return None, "Generated challenge doesn't meet requirements. Please try again."
-                
-                # Ensure answer has commas for multiple blanks
-                answer = parsed_content.get("answer", "")
-                if blank_count > 1 and "," not in answer:
-                    # Try to split the answer into parts
-                    parts = answer.split()
-                    if len(parts) >= blank_count:
-                        parsed_content["answer"] = ", ".join(parts[:blank_count])
+            # Ensure answer has commas for multiple blanks
+            answer = parsed_content.get("answer", "")
+            if blank_count > 1 and "," not in answer:
+                # Try to split the answer into parts
+                parts = answer.split()
+                if len(parts) >= blank_count:
+                    parsed_content["answer"] = ", ".join(parts[:blank_count])
+        
+        # Additional length checks on individual fields
+        if "question" in parsed_content and len(parsed_content["question"]) > 500:
+            parsed_content["question"] = parsed_content["question"][:500] + "..."
+        if "answer" in parsed_content and len(parsed_content["answer"]) > 800:
+            parsed_content["answer"] = parsed_content["answer"][:800] + "..."
+        if "hint" in parsed_content and len(parsed_content["hint"]) > 250:
+            parsed_content["hint"] = parsed_content["hint"][:250] + "..."
+        if "explanation" in parsed_content and len(parsed_content["explanation"]) > 500:
+            parsed_content["explanation"] = parsed_content["explanation"][:500] + "..."
             
-            # Additional length checks on individual fields
-            if "question" in parsed_content and len(parsed_content["question"]) > 500:
-                parsed_content["question"] = parsed_content["question"][:500] + "..."
-            if "answer" in parsed_content and len(parsed_content["answer"]) > 800:
-                parsed_content["answer"] = parsed_content["answer"][:800] + "..."
-            if "hint" in parsed_content and len(parsed_content["hint"]) > 250:
-                parsed_content["hint"] = parsed_content["hint"][:250] + "..."
-            if "explanation" in parsed_content and len(parsed_content["explanation"]) > 500:
-                parsed_content["explanation"] = parsed_content["explanation"][:500] + "..."
-                
-            return parsed_content, None
-        else:
-            return None, "Could not parse JSON from Amazon Q response"
-    except json.JSONDecodeError as e:
-        return None, f"Invalid JSON response from Amazon Q: {str(e)}"
+        return parsed_content, None
     except Exception as e:
         return None, f"Error processing challenge: {str(e)}"
 
+@app.errorhandler(QueueFullError)
+def handle_queue_full(e):
+    response = jsonify({"error": "Server is busy generating content, please retry", "retry_after": e.retry_after})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+@app.errorhandler(CircuitOpenError)
+def handle_circuit_open(e):
+    # Amazon Q is failing: answer from stored content right away instead of
+    # queueing more attempts
+    payload = degraded_response()
+    if payload is not None:
+        return jsonify(payload)
+    response = jsonify({"error": "Amazon Q is unavailable, please retry", "retry_after": e.retry_after})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.profiler = None
+    # Opt-in sampling profile of this request: ?profile=1 or X-Profile: 1
+    if config.PROFILER_ENABLED and '1' in (request.args.get('profile'), request.headers.get('X-Profile')):
+        g.profiler = SamplingProfiler(threading.get_ident(), interval=config.PROFILER_INTERVAL_SECONDS).start()
+
+@app.after_request
+def finish_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    started = g.get("request_started")
+    if started is not None:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, status=response.status_code)
+    if g.get("profiler") is not None:
+        response.headers["X-Profile-Id"] = profiles.add(request.path, g.profiler.stop())
+    return response
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
+    # Not healthy until the startup warmup has filled the cache
+    start_warmup()
+    if not warmed.is_set():
+        return jsonify({"status": "warming", "message": "Code Quest Adventure backend is preparing content"}), 503
     return jsonify({"status": "ok", "message": "Code Quest Adventure backend is running"})
 
-@app.route('/api/story', methods=['GET'])
-def get_story():
-    level = request.args.get('level', '1')
-    
+def build_story_prompt(level):
+    return f"""Generate a randomized short adventure story introduction for a coding game called "Code Quest Adventure" for level {level}.
+    The story should be exciting and set up a scenario where the player needs to solve coding challenges.
+    Always generate new and unique story and objective. The title should be 3 random cheesy words. You must include the level on the title.
+    You must randomize the starting word.
+    Format the response as JSON with the following structure:
+    {{
+        "title": "Level {level} title",
+        "story": "Story text here (keep under 70 words)",
+        "objective": "What the player needs to accomplish (under 30 words)"
+    }}
+    """
+
+def generate_story(level, priority=PRIORITY_INTERACTIVE):
+    deadline = time.time() + config.REQUEST_DEADLINE_SECONDS
     # Try up to 3 times to generate a valid story
     max_attempts = 3
+    error = "Could not generate a story"
+    attempts = 0
     for attempt in range(max_attempts):
+        if time.time() >= deadline:
+            break
+        attempts += 1
         try:
-            prompt = f"""Generate a randomized short adventure story introduction for a coding game called "Code Quest Adventure" for level {level}.
-            The story should be exciting and set up a scenario where the player needs to solve coding challenges.
-            Always generate new and unique story and objective. The title should be 3 random cheesy words. You must include the level on the title.
-            You must randomize the starting word.
-            Format the response as JSON with the following structure:
-            {{
-                "title": "Level {level} title",
-                "story": "Story text here (keep under 70 words)",
-                "objective": "What the player needs to accomplish (under 30 words)"
-            }}
-            """
-            
-            result = generate_with_amazon_q(prompt, max_tokens=300)
-            
-            if "error" in result:
-                print(f"Story generation attempt {attempt+1} failed: {result['error']}")
-                continue
+            prompt = build_story_prompt(level)
             
-            parsed_content, error = create_story_json(result["content"])
+            parsed_content, error = generate_validated(prompt, create_story_json, max_tokens=300,
+                                                       priority=priority, deadline=deadline)
             if error:
-                print(f"Story parsing attempt {attempt+1} failed: {error}")
+                print(f"Story generation attempt {attempt+1} failed: {error}")
                 continue
             
             # If we got here, we have a valid story
-            return jsonify(parsed_content)
+            GENERATION_ATTEMPTS.observe(attempts, kind="story", outcome="ok")
+            return parsed_content, None
             
+        except QueueFullError:
+            raise
         except Exception as e:
-            print(f"Unexpected error in story generation attempt {attempt+1}: {str(e)}")
+            error = str(e)
+            print(f"Unexpected error in story generation attempt {attempt+1}: {error}")
             continue
+    
+    GENERATION_ATTEMPTS.observe(attempts, kind="story", outcome="failed")
+    return None, error
 
-@app.route('/api/challenge', methods=['GET'])
-def get_challenge():
-    level = request.args.get('level', '1')
-    language = request.args.get('language', 'python')
-    objective = request.args.get('objective')
+def pick_question_type(level):
+    # Level 1: Always multiple-choice
+    if level == '1':
+        return "multiple-choice"
+    # Level 2: Always fill-in-blank
+    if level == '2':
+        return "fill-in-blank"
+    # Level 3: Randomized (50% multiple-choice, 50% fill-in-blank)
+    if level == '3':
+        return random.choice(["multiple-choice", "fill-in-blank"])
+    return "multiple-choice"  # Default
+
+def language_instructions(language):
+    # Adjust prompt based on language to ensure proper formatting
+    if language.lower() == "javascript":
+        return """
+        For JavaScript challenges:
+        1. Make sure all code is valid JavaScript syntax.
+        2. Use semicolons at the end of statements.
+        3. For fill-in-blank challenges, ensure the template and answer are valid JavaScript.
+        4. DO NOT include any comments in the code (no // or /* */ comments).
+        5. Avoid using ES6+ features that might not be widely supported.
+        6. Test your code solution to ensure it works correctly.
+        7. Provide clean code without escape characters.
+        8. Do not use backslashes at the end of lines.
+        9. For fill-in-blank challenges, ALWAYS include at least 2 blanks in the template.
+        10. For fill-in-blank challenges with multiple blanks, separate the answers with commas and space (", ").
+        """
+    else:
+        return """
+        For Python challenges:
+        1. Make sure all code is valid Python syntax.
+        2. For fill-in-blank challenges, ensure the template and answer are valid Python.
+        3. DO NOT include any comments in the code (no # comments).
+        4. Provide clean code without escape characters.
+        5. For fill-in-blank challenges, ALWAYS include at least 2 blanks in the template.
+        6. For fill-in-blank challenges with multiple blanks, separate the answers with commas and space (", ").
+        7. DO NOT include any comments in the code (no // or /* */ comments).
+        8. NO COMMENTS AT ALL.
+        """
+
+def challenge_json_format(question_type):
+    return f"""{{
+        "question": "The question text (keep under 100 words and PLEASE MAKE A VERY CLEAR INSTRUCTION)",
+        "type": "{question_type}",
+        "code": "Source code that the question is about (ONLY required for multiple-choice questions)",
+        "options": ["Option 1", "Option 2", "Option 3", "Option 4"] (for multiple-choice only, EXACTLY 4 options),
+        "template": "Code template with _____ for blanks (ONLY for fill-in-blank questions)",
+        "answer": "The correct answer or solution (keep code solutions under 15 lines). For fill-in-blank with multiple blanks, separate the answers with commas and space (", ")",
+        "hint": "A helpful hint (under 50 words)",
+        "explanation": "Explanation of the solution (under 100 words)"
+    }}"""
+
+CHALLENGE_JSON_RULES = """
+    ENSURE ALL JSON PROPERTY NAMES ARE IN DOUBLE QUOTES.
+    ENSURE ALL STRING VALUES ARE IN DOUBLE QUOTES.
+    ENSURE PROPER COMMA USAGE BETWEEN PROPERTIES.
+    DO NOT USE SINGLE QUOTES FOR JSON PROPERTIES OR VALUES.
+    VERIFY YOUR JSON IS VALID BEFORE RETURNING IT.
+    """
+
+def build_challenge_prompt(level, language, objective, question_type):
+    return f"""Generate a coding challenge for level {level} in {language} for a game called "Code Quest Adventure".
+    Make it appropriate for beginners but challenging.
+    Always generate new and unique fresh question.
+    Randomize the first word of the challenge.
+    Generate ONLY EXACTLY 4 answer options for multiple choice question.
+    The question type MUST be {question_type}.
+    DO NOT include any comments in the code (no # comments).
+    DO NOT include any comments in the code (no // or /* */ comments).
+    NO COMMENTS AT ALL.
+    The challenge should relate to this objective: "{objective}".
+    {language_instructions(language)}.
+    
+    IMPORTANT: Format the response as VALID JSON with the following structure:
+    {challenge_json_format(question_type)}
+    {CHALLENGE_JSON_RULES}"""
+
+def build_challenge_batch_prompt(level, language, objective, question_types):
+    count = len(question_types)
+    return f"""Generate {count} different coding challenges for level {level} in {language} for a game called "Code Quest Adventure".
+    Make them appropriate for beginners but challenging.
+    Every challenge must be new, unique and different from the others in this list.
+    Randomize the first word of each challenge.
+    Generate ONLY EXACTLY 4 answer options for each multiple choice question.
+    The question types, in order, MUST be: {", ".join(question_types)}.
+    DO NOT include any comments in the code (no # comments).
+    DO NOT include any comments in the code (no // or /* */ comments).
+    NO COMMENTS AT ALL.
+    The challenges should relate to this objective: "{objective}".
+    {language_instructions(language)}.
+    
+    IMPORTANT: Format the response as a VALID JSON array of exactly {count} objects, each with the following structure:
+    [
+    {challenge_json_format("multiple-choice or fill-in-blank")}
+    ]
+    {CHALLENGE_JSON_RULES}"""
+
+def finalize_challenge(parsed_content, level):
+    # Ensure there are exactly 4 options for multiple-choice questions
+    if parsed_content.get("type") == "multiple-choice" and "options" in parsed_content:
+        options = parsed_content["options"]
+        if len(options) != 4:
+            if len(options) < 4:
+                # Add dummy options if less than 4
+                while len(options) < 4:
+                    options.append(f"Additional option {len(options) + 1}")
+            else:
+                # Truncate if more than 4
+                options = options[:4]
+            parsed_content["options"] = options
+    
+    # Ensure code field exists for multiple-choice questions only
+    if parsed_content.get("type") == "multiple-choice" and "code" not in parsed_content:
+        parsed_content["code"] = "// Code example will be shown here"
+        
+    # For fill-in-blank questions, ensure template exists
+    if parsed_content.get("type") == "fill-in-blank" and "template" not in parsed_content:
+        parsed_content["template"] = "// Template example will be shown here"
+        
+    if "difficulty" not in parsed_content:
+        level_int = int(level)
+        if level_int == 1:
+            parsed_content["difficulty"] = "easy"
+        elif level_int == 2:
+            parsed_content["difficulty"] = "medium"
+        elif level_int == 3:
+            parsed_content["difficulty"] = "hard"
+    
+    # Set XP reward based on level if not present
+    if "xp_reward" not in parsed_content:
+        level_int = int(level)
+        if level_int == 1:
+            parsed_content["xp_reward"] = 10
+        elif level_int == 2:
+            parsed_content["xp_reward"] = 20
+        elif level_int == 3:
+            parsed_content["xp_reward"] = 30
     
+    # Validate required fields based on question type
+    required_fields = ["question", "type", "answer", "hint"]
+    
+    # Add type-specific required fields
+    if parsed_content.get("type") == "multiple-choice":
+        required_fields.append("code")
+        required_fields.append("options")
+    elif parsed_content.get("type") == "fill-in-blank":
+        required_fields.append("template")
+        
+    missing_fields = [field for field in required_fields if field not in parsed_content]
+    if missing_fields:
+        return None, f"Challenge missing required fields: {', '.join(missing_fields)}"
+    
+    return parsed_content, None
+
+def validate_challenge_content(content, language, level):
+    # Full validation of one Amazon Q response: parse, clean up, required fields
+    parsed_content, error = create_challenge_json(content, language)
+    if error:
+        return None, error
+    return finalize_challenge(parsed_content, level)
+
+def reject_near_duplicate(parsed_content, allow_duplicate=False):
+    # Turns a near-copy of a recently generated challenge into a failed attempt
+    if dedup_index is None:
+        return parsed_content, None
+    duplicate, similarity = dedup_index.check(parsed_content)
+    if duplicate and not allow_duplicate:
+        return None, f"Near-duplicate of a recent challenge (similarity {similarity:.2f})"
+    return parsed_content, None
+
+def validate_unique_challenge(content, language, level, allow_duplicate=False):
+    parsed_content, error = validate_challenge_content(content, language, level)
+    if parsed_content is None:
+        return None, error
+    return reject_near_duplicate(parsed_content, allow_duplicate)
+
+def generate_challenge(level, language, objective, priority=PRIORITY_INTERACTIVE):
+    deadline = time.time() + config.REQUEST_DEADLINE_SECONDS
     # Try up to 5 times to generate a valid challenge
     max_attempts = 5
+    error = "Could not generate a challenge"
+    attempts = 0
     for attempt in range(max_attempts):
+        if time.time() >= deadline:
+            break
+        attempts += 1
         try:
-            # Determine question type based on level
-            question_type = "multiple-choice"  # Default
+            question_type = pick_question_type(level)
+            prompt = build_challenge_prompt(level, language, objective, question_type)
             
-            # Level 1: Always multiple-choice
-            if level == '1':
-                question_type = "multiple-choice"
-            # Level 2: Always fill-in-blank
-            elif level == '2':
-                question_type = "fill-in-blank"
-            # Level 3: Randomized (50% multiple-choice, 50% fill-in-blank)
-            elif level == '3':
-                import random
-                question_type = random.choice(["multiple-choice", "fill-in-blank"])
-            
-            # Adjust prompt based on language to ensure proper formatting
-            language_specific_instructions = ""
-            if language.lower() == "javascript":
-                language_specific_instructions = """
-                For JavaScript challenges:
-                1. Make sure all code is valid JavaScript syntax.
-                2. Use semicolons at the end of statements.
-                3. For fill-in-blank challenges, ensure the template and answer are valid JavaScript.
-                4. DO NOT include any comments in the code (no // or /* */ comments).
-                5. Avoid using ES6+ features that might not be widely supported.
-                6. Test your code solution to ensure it works correctly.
-                7. Provide clean code without escape characters.
-                8. Do not use backslashes at the end of lines.
-                9. For fill-in-blank challenges, ALWAYS include at least 2 blanks in the template.
-                10. For fill-in-blank challenges with multiple blanks, separate the answers with commas and space (", ").
-                """
-            else:
-                language_specific_instructions = """
-                For Python challenges:
-                1. Make sure all code is valid Python syntax.
-                2. For fill-in-blank challenges, ensure the template and answer are valid Python.
-                3. DO NOT include any comments in the code (no # comments).
-                4. Provide clean code without escape characters.
-                5. For fill-in-blank challenges, ALWAYS include at least 2 blanks in the template.
-                6. For fill-in-blank challenges with multiple blanks, separate the answers with commas and space (", ").
-                7. DO NOT include any comments in the code (no // or /* */ comments).
-                8. NO COMMENTS AT ALL.
-                """
-            
-            prompt = f"""Generate a coding challenge for level {level} in {language} for a game called "Code Quest Adventure".
-            Make it appropriate for beginners but challenging.
-            Always generate new and unique fresh question.
-            Randomize the first word of the challenge.
-            Generate ONLY EXACTLY 4 answer options for multiple choice question.
-            The question type MUST be {question_type}.
-            DO NOT include any comments in the code (no # comments).
-            DO NOT include any comments in the code (no // or /* */ comments).
-            NO COMMENTS AT ALL.
-            The challenge should relate to this objective: "{objective}".
-            {language_specific_instructions}.
-            
-            IMPORTANT: Format the response as VALID JSON with the following structure:
-            {{
-                "question": "The question text (keep under 100 words and PLEASE MAKE A VERY CLEAR INSTRUCTION)",
-                "type": "{question_type}",
-                "code": "Source code that the question is about (ONLY required for multiple-choice questions)",
-                "options": ["Option 1", "Option 2", "Option 3", "Option 4"] (for multiple-choice only, EXACTLY 4 options),
-                "template": "Code template with _____ for blanks (ONLY for fill-in-blank questions)",
-                "answer": "The correct answer or solution (keep code solutions under 15 lines). For fill-in-blank with multiple blanks, separate the answers with commas and space (", ")",
-                "hint": "A helpful hint (under 50 words)",
-                "explanation": "Explanation of the solution (under 100 words)"
-            }}
+            # A repeat is better than no challenge at all on the last attempt
+            last_attempt = attempt == max_attempts - 1
+            parsed_content, error = generate_validated(prompt, lambda content: validate_unique_challenge(content, language, level, last_attempt), max_tokens=400,
+                                                       priority=priority, deadline=deadline)
+            if error:
+                print(f"Challenge generation attempt {attempt+1} failed: {error}")
+                continue
+                
+            # If we got here, we have a valid challenge
+            GENERATION_ATTEMPTS.observe(attempts, kind="challenge", outcome="ok")
+            return parsed_content, None
             
-            ENSURE ALL JSON PROPERTY NAMES ARE IN DOUBLE QUOTES.
-            ENSURE ALL STRING VALUES ARE IN DOUBLE QUOTES.
-            ENSURE PROPER COMMA USAGE BETWEEN PROPERTIES.
-            DO NOT USE SINGLE QUOTES FOR JSON PROPERTIES OR VALUES.
-            VERIFY YOUR JSON IS VALID BEFORE RETURNING IT.
-            """
+        except QueueFullError:
+            raise
+        except Exception as e:
+            error = str(e)
+            print(f"Unexpected error in challenge generation attempt {attempt+1}: {error}")
+            continue
+    
+    GENERATION_ATTEMPTS.observe(attempts, kind="challenge", outcome="failed")
+    return None, error
+
+def generate_challenge_batch(level, language, objective, count, priority=PRIORITY_INTERACTIVE):
+    # Ask for several challenges per Amazon Q call and validate each one on its own
+    deadline = time.time() + config.REQUEST_DEADLINE_SECONDS
+    challenges = []
+    error = "Could not generate challenges"
+    max_rounds = 3
+    attempts = 0
+    for attempt in range(max_rounds):
+        # Only re-request the shortfall
+        missing = count - len(challenges)
+        if missing <= 0 or time.time() >= deadline:
+            break
+        attempts += 1
+        try:
+            question_types = [pick_question_type(level) for _ in range(missing)]
+            prompt = build_challenge_batch_prompt(level, language, objective, question_types)
             
-            result = generate_with_amazon_q(prompt, max_tokens=400)
+            result = generate_with_amazon_q(prompt, max_tokens=400 * missing, priority=priority, deadline=deadline)
             
             if "error" in result:
-                print(f"Challenge generation attempt {attempt+1} failed: {result['error']}")
+                error = result["error"]
+                print(f"Challenge batch attempt {attempt+1} failed: {error}")
                 continue
             
-            parsed_content, error = create_challenge_json(result["content"], language)
+            with PARSE_SECONDS.time(kind="challenge_batch"):
+                items, error = parse_q_json_list(result["content"])
+            PARSE_RESULTS.inc(kind="challenge_batch", result="failed" if error else "ok")
             if error:
-                print(f"Challenge parsing attempt {attempt+1} failed: {error}")
+                print(f"Challenge batch parsing attempt {attempt+1} failed: {error}")
                 continue
             
-            # Ensure there are exactly 4 options for multiple-choice questions
-            if parsed_content.get("type") == "multiple-choice" and "options" in parsed_content:
-                options = parsed_content["options"]
-                if len(options) != 4:
-                    if len(options) < 4:
-                        # Add dummy options if less than 4
-                        while len(options) < 4:
-                            options.append(f"Additional option {len(options) + 1}")
-                    else:
-                        # Truncate if more than 4
-                        options = options[:4]
-                    parsed_content["options"] = options
-            
-            # Ensure code field exists for multiple-choice questions only
-            if parsed_content.get("type") == "multiple-choice" and "code" not in parsed_content:
-                parsed_content["code"] = "// Code example will be shown here"
-                
-            # For fill-in-blank questions, ensure template exists
-            if parsed_content.get("type") == "fill-in-blank" and "template" not in parsed_content:
-                parsed_content["template"] = "// Template example will be shown here"
-                
-            if "difficulty" not in parsed_content:
-                level_int = int(level)
-                if level_int == 1:
-                    parsed_content["difficulty"] = "easy"
-                elif level_int == 2:
-                    parsed_content["difficulty"] = "medium"
-                elif level_int == 3:
-                    parsed_content["difficulty"] = "hard"
-            
-            # Set XP reward based on level if not present
-            if "xp_reward" not in parsed_content:
-                level_int = int(level)
-                if level_int == 1:
-                    parsed_content["xp_reward"] = 10
-                elif level_int == 2:
-                    parsed_content["xp_reward"] = 20
-                elif level_int == 3:
-                    parsed_content["xp_reward"] = 30
-            
-            # Validate required fields based on question type
-            required_fields = ["question", "type", "answer", "hint"]
-            
-            # Add type-specific required fields
-            if parsed_content.get("type") == "multiple-choice":
-                required_fields.append("code")
-                required_fields.append("options")
-            elif parsed_content.get("type") == "fill-in-blank":
-                required_fields.append("template")
-                
-            missing_fields = [field for field in required_fields if field not in parsed_content]
-            if missing_fields:
-                print(f"Challenge missing required fields: {', '.join(missing_fields)}")
-                continue
-                
-            # If we got here, we have a valid challenge
-            return jsonify(parsed_content)
+            valid = 0
+            for item in items:
+                parsed_content, item_error = normalize_challenge(item, language)
+                if parsed_content is not None:
+                    parsed_content, item_error = finalize_challenge(parsed_content, level)
+                if parsed_content is not None:
+                    parsed_content, item_error = reject_near_duplicate(parsed_content, attempt == max_rounds - 1)
+                if parsed_content is None:
+                    print(f"Rejected challenge from batch: {item_error}")
+                    continue
+                challenges.append(parsed_content)
+                valid += 1
+            print(f"Challenge batch attempt {attempt+1}: {valid}/{len(items)} valid")
             
+        except QueueFullError:
+            if challenges:
+                break
+            raise
         except Exception as e:
-            print(f"Unexpected error in challenge generation attempt {attempt+1}: {str(e)}")
+            error = str(e)
+            print(f"Unexpected error in challenge batch attempt {attempt+1}: {error}")
             continue
+    
+    GENERATION_ATTEMPTS.observe(attempts, kind="challenge_batch", outcome="ok" if challenges else "failed")
+    if not challenges:
+        return None, error
+    return challenges, None
+
+# Fingerprints of recent challenges, to reject near-copies and to avoid
+# showing a player something close to what they already saw
+dedup_index = NearDuplicateIndex(
+    capacity=config.DEDUP_CAPACITY,
+    threshold=config.DEDUP_THRESHOLD,
+    session_items=config.DEDUP_SESSION_ITEMS,
+    max_sessions=config.DEDUP_MAX_SESSIONS,
+) if config.DEDUP_ENABLED else None
+
+# Coordination between server processes: in-flight generations, rate
+# limits, lookahead slots and the challenge pool's inventory
+shared_state = SharedState(config.SHARED_STATE_PATH) if config.SHARED_STATE_ENABLED else None
+
+challenge_pool = ChallengePool(
+    functools.partial(generate_challenge, priority=PRIORITY_PRELOAD),
+    watermark=config.POOL_WATERMARK,
+    workers=config.POOL_WORKERS,
+    idle_seconds=config.POOL_KEY_IDLE_SECONDS,
+    max_keys=config.POOL_MAX_KEYS,
+    shared=shared_state,
+)
+
+content_cache = ContentCache(
+    config.CACHE_PATH,
+    policy=config.CACHE_SERVE_POLICY,
+    max_age_seconds=config.CACHE_MAX_AGE_SECONDS,
+    ttl_seconds=config.CACHE_TTL_SECONDS,
+    max_bytes=config.CACHE_MAX_BYTES,
+    seen_ttl_seconds=config.CACHE_SEEN_TTL_SECONDS,
+) if config.CACHE_ENABLED else None
+
+# Pre-built bank for serving without Amazon Q (see bank.py)
+challenge_bank = ChallengeBank(config.CHALLENGE_BANK) if config.CHALLENGE_BANK else None
+
+# Identical concurrent requests share one Amazon Q generation
+single_flight = SingleFlight(window=config.COALESCE_WINDOW_SECONDS, max_batch=config.BATCH_MAX_COUNT)
+
+def generate_story_shared(level):
+    if not config.COALESCE_ENABLED:
+        return generate_story(level)
+    generate = lambda: generate_story(level)
+    if shared_state is not None:
+        # Other server processes wait for a story already being generated
+        local_generate = generate
+        generate = lambda: tuple(shared_state.run(f"story:{level}", local_generate,
+                                                  lease_seconds=config.REQUEST_DEADLINE_SECONDS + 10))
+    return single_flight.run(("story", str(level)), generate)
+
+def generate_challenge_shared(level, language, objective):
+    # Concurrent waiters get distinct challenges from one batch
+    if not config.COALESCE_ENABLED:
+        return generate_challenge(level, language, objective)
+    key = ("challenge", str(level), (language or "").lower(), objective_bucket(objective))
+    return single_flight.run_batch(
+        key,
+        lambda: generate_challenge(level, language, objective),
+        lambda count: generate_challenge_batch(level, language, objective, count),
+    )
+
+# Answers are graded locally, without asking Amazon Q
+grader = Grader()
+
+# Component stats become gauges on /api/metrics
+registry.register_stats("executor", q_executor.stats)
+registry.register_stats("provider", llm_provider.stats)
+registry.register_stats("hedging", hedger.stats)
+registry.register_stats("pool", challenge_pool.stats)
+registry.register_stats("coalescing", single_flight.stats)
+registry.register_stats("grader", grader.stats)
+if circuit_breaker is not None:
+    registry.register_stats("circuit", circuit_breaker.stats)
+if shared_state is not None:
+    registry.register_stats("shared", shared_state.stats)
+if dedup_index is not None:
+    registry.register_stats("dedup", dedup_index.stats)
+if content_cache is not None:
+    registry.register_stats("cache", content_cache.stats)
+if challenge_bank is not None:
+    registry.register_stats("bank", challenge_bank.stats)
+
+def get_session_id():
+    # Sessions let the cache avoid serving the same item to a player twice
+    return request.headers.get('X-Session-Id') or request.args.get('session')
+
+# Endpoints that may start Amazon Q work, limited per client across processes
+RATE_LIMITED_ENDPOINTS = {'get_story', 'stream_story', 'get_challenge', 'stream_challenge',
+                          'get_challenge_batch', 'start_session'}
+
+@app.before_request
+def check_rate_limit():
+    if shared_state is None or config.RATE_LIMIT_PER_MINUTE <= 0 or request.endpoint not in RATE_LIMITED_ENDPOINTS:
+        return None
+    client = get_session_id() or request.remote_addr or "unknown"
+    allowed, retry_after = shared_state.allow(client, config.RATE_LIMIT_PER_MINUTE, config.RATE_LIMIT_BURST)
+    if allowed:
+        return None
+    response = jsonify({"error": "Too many requests, please slow down", "retry_after": retry_after})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+# Set once the startup warmup is done (right away when it is disabled)
+warmed = threading.Event()
+if not config.WARMUP_ENABLED:
+    warmed.set()
+warmup_lock = threading.Lock()
+warmup_started = False
+
+def warm_up_level(level):
+    # Stories for the level, then challenges for each story's objective, so
+    # the first players are served from the cache
+    missing = config.WARMUP_STORIES - content_cache.count("story", level, "")
+    for _ in range(missing):
+        story, error = generate_story(level, priority=PRIORITY_PRELOAD)
+        if story is None:
+            print(f"Warmup story for level {level} failed: {error}")
+            continue
+        content_cache.put("story", level, "", None, story)
+    for story in content_cache.fallback("story", level, "", limit=config.WARMUP_STORIES):
+        objective = story.get("objective")
+        for language in config.WARMUP_LANGUAGES:
+            missing = config.WARMUP_CHALLENGES - content_cache.count("challenge", level, language, objective)
+            if missing <= 0:
+                continue
+            challenges, error = generate_challenge_batch(level, language, objective, missing, priority=PRIORITY_PRELOAD)
+            if challenges is None:
+                print(f"Warmup challenges for level {level} ({language}) failed: {error}")
+                continue
+            for challenge in challenges:
+                content_cache.put("challenge", level, language, objective, challenge,
+                                  question_type=challenge.get("type", ""))
+
+def warm_up():
+    started = time.time()
+    threads = [threading.Thread(target=warm_up_level, args=(str(level),), name=f"warmup-{level}")
+               for level in range(1, config.MAX_LEVEL + 1)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"Warmup finished in {time.time() - started:.1f}s")
+
+def run_warmup():
+    try:
+        if content_cache is None:
+            print("Warmup skipped: it fills the content cache, which is disabled")
+        elif shared_state is not None:
+            # One process warms up, the others wait for it
+            shared_state.run("warmup", warm_up, lease_seconds=config.WARMUP_TIMEOUT_SECONDS)
+        else:
+            warm_up()
+    except Exception as e:
+        print(f"Warmup failed: {str(e)}")
+    finally:
+        warmed.set()
+
+def start_warmup():
+    # Called by the server entry points at startup; safe to call again
+    global warmup_started
+    if not config.WARMUP_ENABLED:
+        return
+    with warmup_lock:
+        if warmup_started:
+            return
+        warmup_started = True
+    threading.Thread(target=run_warmup, name="warmup", daemon=True).start()
+
+def seen_similar(session_id, challenge):
+    return dedup_index is not None and dedup_index.seen_by(session_id, challenge)
+
+def note_seen(session_id, challenge):
+    if dedup_index is not None:
+        dedup_index.mark_seen(session_id, challenge)
+
+def take_ready_challenge(level, language, objective, session_id, served=()):
+    # A banked, cached or pooled challenge unlike anything this player has
+    # seen and not among the ids already served in this response
+    if challenge_bank is not None:
+        challenge = challenge_bank.pick(
+            "challenge", level, language,
+            skip=lambda item: item.get("id") in served or seen_similar(session_id, item))
+        if challenge is not None:
+            note_seen(session_id, challenge)
+            return challenge
+    if content_cache is not None:
+        cached = content_cache.get("challenge", level, language, objective, session_id=session_id)
+        if cached is not None and cached.get("id") not in served and not seen_similar(session_id, cached):
+            note_seen(session_id, cached)
+            return cached
+    if config.POOL_ENABLED:
+        challenge = challenge_pool.take(level, language, objective)
+        if challenge is not None:
+            if not seen_similar(session_id, challenge):
+                remember_served("challenge", level, language, objective, challenge, session_id)
+                return challenge
+            # Leave it for another player
+            challenge_pool.put(level, language, objective, challenge)
+    return None
+
+def take_ready_story(level, session_id):
+    if challenge_bank is not None:
+        story = challenge_bank.pick("story", level)
+        if story is not None:
+            return story
+    # Reuse a cached story this player hasn't seen yet
+    if content_cache is not None:
+        return content_cache.get("story", level, "", None, session_id=session_id)
+    return None
+
+def degraded_story(level):
+    # Stored content for when Amazon Q is unavailable: the bank, any cached
+    # story for the level, then a built-in one
+    story = challenge_bank.pick("story", level) if challenge_bank is not None else None
+    if story is None and content_cache is not None:
+        stored = content_cache.fallback("story", level, "")
+        story = stored[0] if stored else None
+    if story is None:
+        story = fallback_story(level)
+    return dict(story, degraded=True)
+
+def degraded_challenges(level, language, count):
+    challenges = []
+    while config.POOL_ENABLED and len(challenges) < count:
+        challenge = challenge_pool.take_any(level, language)
+        if challenge is None:
+            break
+        challenges.append(challenge)
+    while challenge_bank is not None and len(challenges) < count:
+        served = {challenge.get("id") for challenge in challenges}
+        challenge = challenge_bank.pick("challenge", level, language, skip=lambda item: item.get("id") in served)
+        if challenge is None:
+            break
+        challenges.append(challenge)
+    if content_cache is not None and len(challenges) < count:
+        challenges.extend(content_cache.fallback("challenge", level, language, limit=count - len(challenges)))
+    if len(challenges) < count:
+        # Built-in challenges go through the same checks as generated ones
+        for challenge in fallback_challenges(level, language, pick_question_type, count - len(challenges)):
+            challenge, error = normalize_challenge(challenge, language)
+            if challenge is not None:
+                challenge, error = finalize_challenge(challenge, level)
+            if challenge is None:
+                print(f"Skipping built-in challenge: {error}")
+                continue
+            challenges.append(challenge)
+    return [dict(challenge, degraded=True) for challenge in challenges]
+
+def degraded_response():
+    # What the current endpoint answers when it can't generate, or None
+    endpoint = request.endpoint
+    level = request.args.get('level', '1')
+    language = request.args.get('language', 'python')
+    if endpoint in ('get_story', 'stream_story'):
+        return degraded_story(level)
+    if endpoint in ('get_challenge', 'stream_challenge'):
+        challenges = degraded_challenges(level, language, 1)
+        return challenges[0] if challenges else None
+    if endpoint == 'get_challenge_batch':
+        try:
+            count = max(1, min(int(request.args.get('count', 3)), config.BATCH_MAX_COUNT))
+        except ValueError:
+            return None
+        challenges = degraded_challenges(level, language, count)
+        return {"challenges": challenges, "count": len(challenges), "requested": count, "degraded": True}
+    if endpoint == 'start_session':
+        language = (request.get_json(silent=True) or {}).get('language') or language
+        return {
+            "level": 1,
+            "story": degraded_story('1'),
+            "challenges": degraded_challenges('1', language, config.SESSION_CHALLENGES),
+            "token": None,
+            "lookahead_levels": [],
+            "degraded": True,
+        }
+    return None
+
+def generation_failed(message, error):
+    # Stored content beats an error once every attempt has failed
+    payload = degraded_response()
+    if payload is not None:
+        return jsonify(payload)
+    return jsonify({"error": message, "details": error}), 500
+
+def remember_served(kind, level, language, objective, payload, session_id):
+    # Store freshly generated content so other sessions can reuse it
+    if kind == "challenge":
+        note_seen(session_id, payload)
+    if content_cache is None:
+        return
+    try:
+        item_id = content_cache.put(kind, level, language, objective, payload,
+                                    question_type=payload.get("type", ""))
+        content_cache.mark_seen(session_id, item_id)
+    except Exception as e:
+        print(f"Could not cache {kind}: {str(e)}")
+
+def collect_challenges(level, language, objective, count, session_id, priority=PRIORITY_INTERACTIVE):
+    # Use cached and pooled challenges first, then generate the rest in one call
+    challenges = []
+    error = None
+    while len(challenges) < count:
+        challenge = take_ready_challenge(level, language, objective, session_id,
+                                         served={challenge.get("id") for challenge in challenges})
+        if challenge is None:
+            break
+        challenges.append(challenge)
+    
+    if len(challenges) < count:
+        generated, error = generate_challenge_batch(level, language, objective, count - len(challenges), priority=priority)
+        for challenge in generated or []:
+            if len(challenges) < count:
+                remember_served("challenge", level, language, objective, challenge, session_id)
+                challenges.append(challenge)
+            elif config.POOL_ENABLED:
+                # Extra challenges from an over-eager batch go to the pool
+                challenge_pool.put(level, language, objective, challenge)
+    return challenges, error
+
+def generate_level(level, language, session_id, priority=PRIORITY_INTERACTIVE):
+    # Story plus the first challenges of one level, as returned by /api/session
+    story = take_ready_story(level, session_id)
+    if story is None:
+        if priority == PRIORITY_INTERACTIVE:
+            story, error = generate_story_shared(level)
+        else:
+            story, error = generate_story(level, priority=priority)
+        if story is None:
+            return None, error
+        remember_served("story", level, "", None, story, session_id)
+    challenges, error = collect_challenges(level, language, story.get("objective"), config.SESSION_CHALLENGES,
+                                           session_id, priority=priority)
+    if not challenges:
+        return None, error
+    return {"level": int(level), "story": story, "challenges": challenges}, None
+
+# Later levels of a session are generated while the player is still on level 1
+lookahead = LookaheadSessions(
+    lambda level, language, session_id: generate_level(level, language, session_id, priority=PRIORITY_PRELOAD),
+    workers=config.LOOKAHEAD_WORKERS,
+    ttl_seconds=config.LOOKAHEAD_TTL_SECONDS,
+    max_sessions=config.LOOKAHEAD_MAX_SESSIONS,
+    slots=shared_state,
+)
+registry.register_stats("lookahead", lookahead.stats)
+
+@app.route('/api/session', methods=['POST'])
+def start_session():
+    data = request.get_json(silent=True) or {}
+    language = data.get('language') or request.args.get('language', 'python')
+    session_id = get_session_id()
+    
+    # Queue the later levels first so they generate alongside level 1
+    later_levels = list(range(2, config.MAX_LEVEL + 1)) if config.LOOKAHEAD_ENABLED else []
+    token = lookahead.open(language, later_levels, session_id) if later_levels else None
+    
+    bundle, error = generate_level('1', language, session_id)
+    if bundle is None:
+        return generation_failed("Failed to start session", error)
+    return jsonify(dict(bundle, token=token, lookahead_levels=later_levels))
+
+@app.route('/api/session/<token>/level/<level>', methods=['GET'])
+def claim_level(token, level):
+    bundle, status = lookahead.claim(token, level, wait=config.LOOKAHEAD_CLAIM_WAIT_SECONDS)
+    if status == "pending":
+        return jsonify({"status": status, "error": "Level is still being generated"}), 202
+    if bundle is None:
+        return jsonify({"status": status, "error": "No prepared content for this level"}), 404
+    return jsonify(bundle)
+
+@app.route('/api/story', methods=['GET'])
+def get_story():
+    level = request.args.get('level', '1')
+    session_id = get_session_id()
+    
+    story = take_ready_story(level, session_id)
+    if story is not None:
+        return jsonify(story)
+    
+    parsed_content, error = generate_story_shared(level)
+    if parsed_content is None:
+        return generation_failed("Failed to generate story", error)
+    remember_served("story", level, "", None, parsed_content, session_id)
+    return jsonify(parsed_content)
+
+@app.route('/api/challenge', methods=['GET'])
+def get_challenge():
+    level = request.args.get('level', '1')
+    language = request.args.get('language', 'python')
+    objective = request.args.get('objective')
+    session_id = get_session_id()
+    
+    # Reuse a cached or pre-generated challenge this player hasn't seen yet
+    challenge = take_ready_challenge(level, language, objective, session_id)
+    if challenge is not None:
+        return jsonify(challenge)
+    
+    # Pool miss: generate live while the pool refills in the background
+    parsed_content, error = generate_challenge_shared(level, language, objective)
+    if parsed_content is None:
+        return generation_failed("Failed to generate challenge", error)
+    remember_served("challenge", level, language, objective, parsed_content, session_id)
+    return jsonify(parsed_content)
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_generation(make_prompt, parse_fn, max_attempts, max_tokens, on_result):
+    # Server-Sent Events for one generation: status and progress while Amazon Q
+    # runs, a retry notice per failed attempt, then the result or an error
+    yield sse_event("status", {"stage": "started"})
+    deadline = time.time() + config.REQUEST_DEADLINE_SECONDS
+    error = "Could not generate content"
+    for attempt in range(max_attempts):
+        if time.time() >= deadline:
+            break
+        yield sse_event("status", {"stage": "generating", "attempt": attempt + 1})
+        try:
+            for event, data in stream_with_amazon_q(make_prompt(), parse_fn, max_tokens=max_tokens, deadline=deadline):
+                if event == "progress":
+                    yield sse_event("progress", dict(data, attempt=attempt + 1))
+                elif event == "result":
+                    on_result(data)
+                    yield sse_event("result", data)
+                    return
+                else:
+                    error = data
+        except CircuitOpenError:
+            break
+        except QueueFullError as e:
+            yield sse_event("error", {"error": "Server is busy generating content, please retry", "retry_after": e.retry_after})
+            return
+        print(f"Streaming attempt {attempt+1} failed: {error}")
+        yield sse_event("retry", {"attempt": attempt + 1, "error": error})
+    payload = degraded_response()
+    if payload is not None:
+        yield sse_event("result", payload)
+        return
+    yield sse_event("error", {"error": "Failed to generate content", "details": error})
+
+def sse_response(events):
+    response = Response(stream_with_context(events), mimetype='text/event-stream')
+    response.headers["Cache-Control"] = "no-cache"
+    # Stop reverse proxies from buffering the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+@app.route('/api/story/stream', methods=['GET'])
+def stream_story():
+    level = request.args.get('level', '1')
+    session_id = get_session_id()
+    
+    story = take_ready_story(level, session_id)
+    if story is not None:
+        return sse_response(iter([sse_event("result", story)]))
+    
+    return sse_response(stream_generation(
+        lambda: build_story_prompt(level),
+        create_story_json,
+        max_attempts=3,
+        max_tokens=300,
+        on_result=lambda story: remember_served("story", level, "", None, story, session_id),
+    ))
+
+@app.route('/api/challenge/stream', methods=['GET'])
+def stream_challenge():
+    level = request.args.get('level', '1')
+    language = request.args.get('language', 'python')
+    objective = request.args.get('objective')
+    session_id = get_session_id()
+    
+    challenge = take_ready_challenge(level, language, objective, session_id)
+    if challenge is not None:
+        return sse_response(iter([sse_event("result", challenge)]))
+    
+    return sse_response(stream_generation(
+        lambda: build_challenge_prompt(level, language, objective, pick_question_type(level)),
+        lambda content: validate_unique_challenge(content, language, level),
+        max_attempts=5,
+        max_tokens=400,
+        on_result=lambda challenge: remember_served("challenge", level, language, objective, challenge, session_id),
+    ))
+
+@app.route('/api/challenges/batch', methods=['GET'])
+def get_challenge_batch():
+    level = request.args.get('level', '1')
+    language = request.args.get('language', 'python')
+    objective = request.args.get('objective')
+    session_id = get_session_id()
+    try:
+        count = int(request.args.get('count', 3))
+    except ValueError:
+        return jsonify({"error": "count must be a number"}), 400
+    count = max(1, min(count, config.BATCH_MAX_COUNT))
+    
+    challenges, error = collect_challenges(level, language, objective, count, session_id)
+    if not challenges:
+        return generation_failed("Failed to generate challenges", error)
+    return jsonify({"challenges": challenges, "count": len(challenges), "requested": count})
+
+@app.route('/api/feedback', methods=['POST'])
+def post_feedback():
+    data = request.get_json(silent=True) or {}
+    answer = data.get('answer')
+    correct_answer = data.get('correct_answer')
+    if answer is None or correct_answer is None:
+        return jsonify({"error": "Both answer and correct_answer are required"}), 400
+    for field in ('answer', 'correct_answer', 'type', 'language', 'template', 'challenge_id'):
+        if data.get(field) is not None and not isinstance(data[field], str):
+            return jsonify({"error": f"{field} must be a string"}), 400
+    
+    is_correct = grader.grade(
+        answer,
+        correct_answer,
+        question_type=data.get('type') or "fill-in-blank",
+        language=data.get('language') or "python",
+        template=data.get('template'),
+        challenge_id=data.get('challenge_id'),
+    )
+    return jsonify({
+        "is_correct": is_correct,
+        "feedback": "Correct! Great job!" if is_correct else f"Incorrect. The correct answer is: {correct_answer}",
+        "next_hint": None if is_correct else data.get('hint'),
+    })
+
+@app.route('/api/pool/stats', methods=['GET'])
+def get_pool_stats():
+    return jsonify(challenge_pool.stats())
+
+@app.route('/api/executor/stats', methods=['GET'])
+def get_executor_stats():
+    return jsonify(q_executor.stats())
+
+@app.route('/api/hedging/stats', methods=['GET'])
+def get_hedging_stats():
+    return jsonify(hedger.stats())
+
+@app.route('/api/circuit/stats', methods=['GET'])
+def get_circuit_stats():
+    if circuit_breaker is None:
+        return jsonify({"enabled": False})
+    return jsonify(circuit_breaker.stats())
+
+@app.route('/api/lookahead/stats', methods=['GET'])
+def get_lookahead_stats():
+    return jsonify(lookahead.stats())
+
+@app.route('/api/coalescing/stats', methods=['GET'])
+def get_coalescing_stats():
+    return jsonify(dict(single_flight.stats(), enabled=config.COALESCE_ENABLED))
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/profiles', methods=['GET'])
+def list_profiles():
+    return jsonify({"enabled": config.PROFILER_ENABLED, "profiles": profiles.list()})
+
+@app.route('/api/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    # Collapsed stacks, ready for flamegraph.pl or speedscope
+    profile = profiles.get(profile_id)
+    if profile is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return Response(profile["collapsed"], mimetype='text/plain')
+
+@app.route('/api/bank/stats', methods=['GET'])
+def get_bank_stats():
+    if challenge_bank is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(challenge_bank.stats(), groups=challenge_bank.groups()))
+
+@app.route('/api/shared/stats', methods=['GET'])
+def get_shared_stats():
+    if shared_state is None:
+        return jsonify({"enabled": False})
+    return jsonify(shared_state.stats())
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    if content_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify(content_cache.stats())
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Development server; use gunicorn for production (see wsgi.py). With the
+    # debug reloader only the child process that serves requests warms up.
+    if not config.DEBUG or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_warmup()
+    app.run(debug=config.DEBUG, host=config.HOST, port=config.PORT, threaded=True)
\ No newline at end of file
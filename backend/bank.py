@@ -0,0 +1,261 @@
+# Offline challenge bank: pre-generated stories and challenges in one file.
+#
+# `python bank.py build bank.cqb` generates a bank with the same prompts and
+# validation the live endpoints use (generate_story / generate_challenge in
+# app.py), spread over one worker process per core. Near-duplicate
+# challenges are dropped and regenerated. `python bank.py info bank.cqb`
+# prints what a bank contains.
+#
+# With CHALLENGE_BANK pointing at the file, the server memory-maps it and
+# answers story and challenge requests from it without calling Amazon Q.
+# The file is laid out so a lookup is a couple of struct reads and one
+# json.loads:
+#
+#   header   magic, group count, item count
+#   groups   (kind, language, level, first item, item count), one per
+#            kind/level/language, items of a group are contiguous
+#   offsets  item count + 1 little-endian u64, relative to the data section
+#   data     compact UTF-8 JSON of each item
+#
+# Opening a bank only reads the group table, and the pages are shared
+# between every worker process that maps the same file.
+import argparse
+import json
+import mmap
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import threading
+import time
+
+MAGIC = b"CQBANK01"
+_HEADER = struct.Struct("<8sII")
+_GROUP = struct.Struct("<12s12sHxxII")
+_OFFSET = struct.Struct("<Q")
+# Items pick() looks at before leaving the request to other sources
+_PICK_ATTEMPTS = 16
+
+
+def _group_key(kind, level, language):
+    return kind, str(level), (language or "").lower()
+
+
+class ChallengeBank:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, group_count, item_count = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a challenge bank")
+        self.item_count = item_count
+        self._groups = {}
+        position = _HEADER.size
+        for _ in range(group_count):
+            kind, language, level, first, count = _GROUP.unpack_from(self._map, position)
+            key = _group_key(kind.rstrip(b"\0").decode(), level, language.rstrip(b"\0").decode())
+            self._groups[key] = (first, count)
+            position += _GROUP.size
+        self._offsets = position
+        self._data = position + (item_count + 1) * _OFFSET.size
+        self._lock = threading.Lock()
+        self.served = 0
+        self.misses = 0
+
+    def item(self, index):
+        start, end = struct.unpack_from("<QQ", self._map, self._offsets + index * _OFFSET.size)
+        return json.loads(self._map[self._data + start:self._data + end])
+
+    def pick(self, kind, level, language="", skip=None):
+        # A random item for this kind, level and language, or None. Items
+        # for which skip(item) is true (already served, say) are passed
+        # over; a few are tried, without replacement, before giving up.
+        group = self._groups.get(_group_key(kind, level, language))
+        if group is not None:
+            first, count = group
+            for index in random.sample(range(count), min(count, _PICK_ATTEMPTS)):
+                item = self.item(first + index)
+                if skip is None or not skip(item):
+                    with self._lock:
+                        self.served += 1
+                    return item
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def groups(self):
+        return {"/".join(part for part in key if part): count for key, (_, count) in sorted(self._groups.items())}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "items": self.item_count,
+                "bytes": len(self._map),
+                "served": self.served,
+                "misses": self.misses,
+            }
+
+
+def write_bank(path, items):
+    # items: iterable of (kind, level, language, payload)
+    grouped = {}
+    for kind, level, language, payload in items:
+        grouped.setdefault(_group_key(kind, level, language), []).append(payload)
+
+    groups = []
+    offsets = [0]
+    data = []
+    for (kind, level, language), payloads in sorted(grouped.items()):
+        groups.append(_GROUP.pack(kind.encode(), language.encode(), int(level), len(offsets) - 1, len(payloads)))
+        for payload in payloads:
+            encoded = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            data.append(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+
+    # Write next to the target and rename, so a serving process never maps
+    # a half-written bank
+    temporary = f"{path}.tmp{os.getpid()}"
+    with open(temporary, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, len(groups), len(offsets) - 1))
+        f.write(b"".join(groups))
+        f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        f.write(b"".join(data))
+    os.replace(temporary, path)
+    return len(offsets) - 1
+
+
+# Worker processes import the app themselves, with background work turned
+# off, and each runs one Amazon Q generation at a time
+_WORKER_ENV = {
+    "POOL_ENABLED": "0",
+    "CACHE_ENABLED": "0",
+    "COALESCE_ENABLED": "0",
+    "DEDUP_ENABLED": "0",
+    "PROFILER_ENABLED": "0",
+    "Q_MAX_CONCURRENCY": "1",
+}
+_app = None
+
+
+def _init_worker():
+    global _app
+    os.environ.update(_WORKER_ENV)
+    # Each process needs its own random stream for question types
+    random.seed()
+    import app
+    _app = app
+
+
+def _generate(task):
+    kind, level, language, objective = task
+    try:
+        if kind == "story":
+            payload, error = _app.generate_story(level)
+        else:
+            payload, error = _app.generate_challenge(level, language, objective)
+    except Exception as e:
+        payload, error = None, str(e)
+    return task, payload, error
+
+
+def build(args):
+    from content_cache import content_id
+    from dedup import NearDuplicateIndex
+
+    started = time.time()
+    dedup = NearDuplicateIndex(capacity=max(1024, 2 * len(args.levels) * len(args.languages) * args.challenges),
+                               threshold=args.threshold)
+    items = []
+    objectives = {}
+    failures = 0
+
+    def run(pool, tasks, on_result):
+        nonlocal failures
+        for done, (task, payload, error) in enumerate(pool.imap_unordered(_generate, tasks), 1):
+            if payload is None:
+                failures += 1
+                print(f"Failed {task[0]} for level {task[1]} {task[2] or ''}: {error}", file=sys.stderr)
+            else:
+                on_result(task, payload)
+            if done % 50 == 0:
+                print(f"  {done}/{len(tasks)} generated", file=sys.stderr)
+
+    def add_story(task, story):
+        story["id"] = content_id(story)
+        items.append(("story", task[1], "", story))
+        objectives.setdefault(task[1], []).append(story.get("objective"))
+
+    wanted = {}
+
+    def add_challenge(task, challenge):
+        key = (task[1], task[2])
+        if wanted[key] <= 0:
+            return
+        duplicate, _ = dedup.check(challenge)
+        if duplicate:
+            return
+        wanted[key] -= 1
+        challenge["id"] = content_id(challenge)
+        items.append(("challenge", task[1], task[2], challenge))
+
+    with multiprocessing.Pool(args.workers, initializer=_init_worker) as pool:
+        print(f"Generating {args.stories} stories per level with {args.workers} workers", file=sys.stderr)
+        run(pool, [("story", level, "", None) for level in args.levels for _ in range(args.stories)], add_story)
+
+        for level in args.levels:
+            for language in args.languages:
+                wanted[(level, language)] = args.challenges
+        # Later rounds only regenerate what duplicates and failures left short
+        for round_number in range(args.rounds):
+            tasks = []
+            for (level, language), missing in wanted.items():
+                level_objectives = objectives.get(level) or [None]
+                tasks.extend(("challenge", level, language, level_objectives[i % len(level_objectives)])
+                             for i in range(missing))
+            if not tasks:
+                break
+            print(f"Round {round_number + 1}: generating {len(tasks)} challenges", file=sys.stderr)
+            run(pool, tasks, add_challenge)
+
+    count = write_bank(args.output, items)
+    stats = dedup.stats()
+    print(f"Wrote {count} items to {args.output} in {time.time() - started:.1f}s "
+          f"({stats['duplicates']} near-duplicates dropped, {failures} failed generations)", file=sys.stderr)
+    return 0
+
+
+def info(args):
+    bank = ChallengeBank(args.bank)
+    print(json.dumps({"path": args.bank, **bank.stats(), "groups": bank.groups()}, indent=2))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or inspect an offline challenge bank")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="Generate a bank with Amazon Q")
+    build_parser.add_argument("output", help="Bank file to write")
+    build_parser.add_argument("--levels", nargs="+", default=["1", "2", "3"])
+    build_parser.add_argument("--languages", nargs="+", default=["python", "javascript"])
+    build_parser.add_argument("--stories", type=int, default=20, help="Stories per level")
+    build_parser.add_argument("--challenges", type=int, default=200, help="Challenges per level and language")
+    build_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                              help="Generation processes (default: one per core)")
+    build_parser.add_argument("--rounds", type=int, default=3,
+                              help="Generation rounds to make up for duplicates and failures")
+    build_parser.add_argument("--threshold", type=float, default=0.7, help="Near-duplicate similarity threshold")
+    build_parser.set_defaults(handler=build)
+
+    info_parser = commands.add_parser("info", help="Show what a bank contains")
+    info_parser.add_argument("bank")
+    info_parser.set_defaults(handler=info)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
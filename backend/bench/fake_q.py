@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# Stand-in for the Amazon Q CLI used by the load benchmark.
+#
+# Accepts the same arguments as `q chat --no-interactive PROMPT` and answers
+# with the local provider's synthetic stories and challenges. Without
+# --no-interactive it behaves like an interactive `q chat` session: one
+# prompt per stdin line, each answer followed by the @@END-...@@ marker the
+# prompt asks for (see WarmCLIProvider), and /clear as a command. Behaviour
+# is tuned with environment variables:
+#
+#   FAKE_Q_LATENCY         fixed:S, uniform:LOW,HIGH or lognormal:MU,SIGMA
+#   FAKE_Q_ERROR_RATE      fraction of invocations that exit non-zero
+#   FAKE_Q_MALFORMED_RATE  fraction of invocations that print unusable output
+#   FAKE_Q_LOG             append one JSON line per invocation to this file
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from providers import LocalProvider  # noqa: E402
+from q_executor import Job  # noqa: E402
+
+
+def prompt_kind(prompt):
+    if "JSON array of exactly" in prompt:
+        return "batch"
+    if "story introduction" in prompt:
+        return "story"
+    return "challenge"
+
+
+def log_invocation(kind, started, returncode, mode):
+    log_path = os.environ.get("FAKE_Q_LOG")
+    if not log_path:
+        return
+    record = {
+        "pid": os.getpid(),
+        "kind": kind,
+        "mode": mode,
+        "start": started,
+        "end": time.time(),
+        "returncode": returncode,
+    }
+    # One short write per line on an O_APPEND file keeps concurrent writers apart
+    fd = os.open(log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (json.dumps(record) + "\n").encode("utf-8"))
+    finally:
+        os.close(fd)
+
+
+def make_provider():
+    provider = LocalProvider(
+        latency=os.environ.get("FAKE_Q_LATENCY", "fixed:0.2"),
+        error_rate=float(os.environ.get("FAKE_Q_ERROR_RATE", "0")),
+        malformed_rate=float(os.environ.get("FAKE_Q_MALFORMED_RATE", "0")),
+    )
+    # Every process starts its serial somewhere random so generated content
+    # differs between calls
+    provider._counter = random.randrange(1, 10 ** 6)
+    return provider
+
+
+def run_once(prompt):
+    started = time.time()
+    result = make_provider().generate(prompt, Job(prompt, 0, started + 3600))
+    sys.stdout.write(result.get("stdout", ""))
+    sys.stderr.write(result.get("stderr", ""))
+    returncode = result.get("returncode", 1)
+    log_invocation(prompt_kind(prompt), started, returncode, "once")
+    return returncode
+
+
+def run_interactive():
+    provider = make_provider()
+    sys.stdout.write("Welcome to Amazon Q (fake)\n> ")
+    sys.stdout.flush()
+    for line in sys.stdin:
+        if line.strip() == "/clear":
+            # Handled by the CLI itself, no generation
+            sys.stdout.write("Conversation history cleared\n> ")
+            sys.stdout.flush()
+            continue
+        started = time.time()
+        marker = re.search(r"@@END-[0-9a-f]+@@", line)
+        result = provider.generate(line, Job(line, 0, started + 3600))
+        text = result.get("stdout") or result.get("stderr", "")
+        sys.stdout.write(text + "\n" + (marker.group(0) if marker else "") + "\n> ")
+        sys.stdout.flush()
+        log_invocation(prompt_kind(line), started, result.get("returncode", 1), "interactive")
+    return 0
+
+
+def main():
+    if "--no-interactive" in sys.argv:
+        return run_once(sys.argv[-1])
+    return run_interactive()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
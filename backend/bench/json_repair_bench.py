@@ -0,0 +1,113 @@
+# Micro-benchmark: lenient single-pass parser vs. the old regex repair cascade.
+#
+# Runs every sample in corpus/malformed_q_outputs.jsonl through both parsers
+# and reports whether each one recovered an object and how long it took.
+#
+#   python bench/json_repair_bench.py [--repeat 2000] [--json results.json]
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_repair import LenientJSONError, parse_lenient  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus", "malformed_q_outputs.jsonl")
+
+
+def legacy_cascade(content):
+    # The parsing half of create_challenge_json before the single-pass parser
+    json_start = content.find('{')
+    json_end = content.rfind('}') + 1
+    if not (json_start >= 0 and json_end > json_start):
+        return None
+    json_content = content[json_start:json_end]
+    json_content = json_content.replace('\n', ' ')
+    json_content = re.sub(r'```json|```', '', json_content)
+    json_content = re.sub(r'([{,])\s*([a-zA-Z0-9_]+)\s*:', r'\1"\2":', json_content)
+    json_content = re.sub(r'"\s*}\s*"', '", "', json_content)
+    json_content = re.sub(r'(?<!")(".*?[^\\]")(?!")', r'\1', json_content)
+
+    for parsing_attempt in [
+        lambda c: json.loads(c),
+        lambda c: json.loads(c.replace('\\', '\\\\').replace('\\\\"', '\\"')),
+        lambda c: json.loads(re.sub(r'([{,])\s*([a-zA-Z0-9_]+)\s*:', r'\1"\2":', c)),
+        lambda c: json.loads(re.sub(r'([{,])\s*([a-zA-Z0-9_]+)\s*:', r'\1"\2":',
+                                   c.replace('\\', '\\\\').replace('\\\\"', '\\"'))),
+        lambda c: json.loads(re.sub(r'"\s*}\s*"', '", "',
+                                   re.sub(r'"\s*{\s*"', '", "',
+                                         re.sub(r'([{,])\s*([a-zA-Z0-9_]+)\s*:', r'\1"\2":',
+                                               c.replace('\\', '\\\\').replace('\\\\"', '\\"'))))),
+        lambda c: json.loads(re.sub(r'([{,])\s*([a-zA-Z0-9_]+)\s*:', r'\1"\2":',
+                                   c.replace('\\', '\\\\').replace('\\\\"', '\\"')
+                                    .replace("'", '"'))),
+    ]:
+        try:
+            return parsing_attempt(json_content)
+        except Exception:
+            continue
+    return None
+
+
+def lenient(content):
+    try:
+        return parse_lenient(content)[0]
+    except LenientJSONError:
+        return None
+
+
+def load_corpus(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--json", help="Write machine-readable results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for sample in load_corpus(args.corpus):
+        text = sample["output"]
+        row = {"name": sample["name"], "bytes": len(text)}
+        for label, fn in (("legacy", legacy_cascade), ("lenient", lenient)):
+            value = fn(text)
+            seconds = timeit.timeit(lambda: fn(text), number=args.repeat)
+            row[f"{label}_ok"] = isinstance(value, dict) and "question" in value
+            row[f"{label}_us"] = round(seconds / args.repeat * 1e6, 2)
+        try:
+            row["repairs"] = parse_lenient(text)[1]
+        except LenientJSONError:
+            row["repairs"] = None
+        results.append(row)
+
+    print(f"{'sample':28} {'legacy':>14} {'lenient':>14}  repairs")
+    for row in results:
+        legacy = f"{'ok' if row['legacy_ok'] else 'FAIL'} {row['legacy_us']:7.1f}us"
+        fast = f"{'ok' if row['lenient_ok'] else 'FAIL'} {row['lenient_us']:7.1f}us"
+        print(f"{row['name']:28} {legacy:>14} {fast:>14}  {', '.join(row['repairs'] or [])}")
+
+    summary = {
+        "samples": len(results),
+        "legacy_ok": sum(r["legacy_ok"] for r in results),
+        "lenient_ok": sum(r["lenient_ok"] for r in results),
+        "legacy_total_us": round(sum(r["legacy_us"] for r in results), 1),
+        "lenient_total_us": round(sum(r["lenient_us"] for r in results), 1),
+    }
+    print(f"\nrecovered: legacy {summary['legacy_ok']}/{summary['samples']}, "
+          f"lenient {summary['lenient_ok']}/{summary['samples']}")
+    print(f"total time per pass: legacy {summary['legacy_total_us']}us, "
+          f"lenient {summary['lenient_total_us']}us")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"summary": summary, "samples": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
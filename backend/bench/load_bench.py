@@ -0,0 +1,340 @@
+# Load benchmark for the backend API.
+#
+# Starts the Flask app with a fake `q` (bench/fake_q.py) first on PATH, then
+# drives /api/story and /api/challenge from concurrent clients using a mix of
+# levels and languages. Reports throughput, latency percentiles, client
+# retries (429 answers) and Amazon Q prompts per endpoint, process spawns
+# and the server's peak RSS. Use --url to benchmark a server that is already
+# running (spawn counts and RSS are then only reported if --q-log/--pid are
+# given).
+#
+#   python bench/load_bench.py --requests 200 --concurrency 16 --json run.json
+#   python bench/load_bench.py --latency uniform:0.1,1 --error-rate 0.1 --compare run.json
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_Q = os.path.join(BACKEND, "bench", "fake_q.py")
+
+OBJECTIVES = [
+    "Defeat the goblin with loops",
+    "Unlock the vault using conditionals",
+    "Repair the bridge with functions",
+    "Sort the treasure with lists",
+]
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def peak_rss_kb(pid):
+    # VmHWM is the peak resident set size of the process
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class Server:
+    def __init__(self, args, workdir):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.q_log = os.path.join(workdir, "q.log")
+
+        bin_dir = os.path.join(workdir, "bin")
+        os.makedirs(bin_dir)
+        with open(os.path.join(bin_dir, "q"), "w") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_Q}" "$@"\n')
+        os.chmod(os.path.join(bin_dir, "q"), 0o755)
+
+        env = dict(os.environ)
+        env.update({
+            "PATH": bin_dir + os.pathsep + env.get("PATH", ""),
+            "FAKE_Q_LATENCY": args.latency,
+            "FAKE_Q_ERROR_RATE": str(args.error_rate),
+            "FAKE_Q_MALFORMED_RATE": str(args.malformed_rate),
+            "FAKE_Q_LOG": self.q_log,
+            # Measure the generation path unless asked otherwise
+            "POOL_ENABLED": "0",
+            "CACHE_ENABLED": "0",
+            "CACHE_PATH": os.path.join(workdir, "content.db"),
+            "SHARED_STATE_PATH": os.path.join(workdir, "shared.db"),
+        })
+        for item in args.env:
+            key, _, value = item.partition("=")
+            env[key] = value
+
+        code = f"import app; app.app.run(host='127.0.0.1', port={self.port}, threaded=True)"
+        self.log = open(os.path.join(workdir, "server.log"), "w")
+        self.process = subprocess.Popen([sys.executable, "-c", code], cwd=BACKEND, env=env,
+                                        stdout=self.log, stderr=subprocess.STDOUT)
+
+    def wait_ready(self, timeout=30):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {self.process.returncode}, see {self.log.name}")
+            try:
+                with urllib.request.urlopen(self.url + "/api/health", timeout=1):
+                    return
+            except (urllib.error.URLError, OSError):
+                time.sleep(0.1)
+        raise RuntimeError("Server did not become healthy in time")
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+
+def fetch(url, max_retries, timeout):
+    # Returns (status, retries); retries follow 429 Retry-After like the frontend does
+    retries = 0
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                response.read()
+                return response.status, retries
+        except urllib.error.HTTPError as e:
+            e.read()
+            if e.code == 429 and retries < max_retries:
+                retries += 1
+                time.sleep(min(float(e.headers.get("Retry-After") or 1), 5))
+                continue
+            return e.code, retries
+        except (urllib.error.URLError, OSError):
+            return 0, retries
+
+
+def pick_request(rng, args):
+    level = rng.choice(args.levels)
+    if rng.random() < args.story_ratio:
+        return "story", "/api/story?" + urllib.parse.urlencode({"level": level})
+    query = {"level": level, "language": rng.choice(args.languages), "objective": rng.choice(OBJECTIVES)}
+    return "challenge", "/api/challenge?" + urllib.parse.urlencode(query)
+
+
+def run_load(base_url, args):
+    results = {"story": [], "challenge": []}
+    lock = threading.Lock()
+    remaining = [args.requests]
+    stop_at = time.time() + args.duration if args.duration else None
+
+    def worker(seed):
+        rng = random.Random(seed)
+        while True:
+            with lock:
+                if stop_at is None and remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            if stop_at is not None and time.time() >= stop_at:
+                return
+            endpoint, path = pick_request(rng, args)
+            started = time.time()
+            status, retries = fetch(base_url + path, args.max_retries, args.timeout)
+            with lock:
+                results[endpoint].append((time.time() - started, status, retries))
+
+    threads = [threading.Thread(target=worker, args=(args.seed + i,)) for i in range(args.concurrency)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.time() - started
+
+
+def read_q_log(path):
+    records = []
+    if path and os.path.exists(path):
+        with open(path) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    return records
+
+
+def max_concurrency(records):
+    events = sorted([(r["start"], 1) for r in records] + [(r["end"], -1) for r in records])
+    running = peak = 0
+    for _, delta in events:
+        running += delta
+        peak = max(peak, running)
+    return peak
+
+
+def summarize(results, elapsed, records, rss_kb, args):
+    # Prompts per endpoint; with warm workers one process answers many prompts
+    prompts = {"story": 0, "challenge": 0}
+    for record in records:
+        prompts["story" if record["kind"] == "story" else "challenge"] += 1
+
+    endpoints = {}
+    for endpoint, rows in results.items():
+        ok = [latency for latency, status, _ in rows if status == 200]
+        latencies = [latency for latency, _, _ in rows]
+        endpoints[endpoint] = {
+            "requests": len(rows),
+            "ok": len(ok),
+            "errors": len(rows) - len(ok),
+            "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+            "p50_ms": _ms(percentile(latencies, 0.50)),
+            "p95_ms": _ms(percentile(latencies, 0.95)),
+            "p99_ms": _ms(percentile(latencies, 0.99)),
+            "client_retries": sum(retries for _, _, retries in rows),
+            "q_prompts": prompts[endpoint] if records else None,
+            "q_prompts_per_ok": round(prompts[endpoint] / len(ok), 3) if records and ok else None,
+        }
+
+    total_ok = sum(e["ok"] for e in endpoints.values())
+    all_latencies = [latency for rows in results.values() for latency, _, _ in rows]
+    return {
+        "config": {
+            "requests": args.requests,
+            "duration": args.duration,
+            "concurrency": args.concurrency,
+            "levels": args.levels,
+            "languages": args.languages,
+            "story_ratio": args.story_ratio,
+            "latency": args.latency,
+            "error_rate": args.error_rate,
+            "malformed_rate": args.malformed_rate,
+            "env": args.env,
+        },
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime()),
+        "git_revision": _git_revision(),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(total_ok / elapsed, 3) if elapsed else 0.0,
+        "p50_ms": _ms(percentile(all_latencies, 0.50)),
+        "p95_ms": _ms(percentile(all_latencies, 0.95)),
+        "p99_ms": _ms(percentile(all_latencies, 0.99)),
+        "endpoints": endpoints,
+        "q_processes": {
+            "spawned": len({r["pid"] for r in records}) if records else None,
+            "prompts": len(records) if records else None,
+            "failed": sum(1 for r in records if r["returncode"] != 0) if records else None,
+            "max_concurrent": max_concurrency(records) if records else None,
+        },
+        "server_peak_rss_kb": rss_kb,
+    }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_report(summary, baseline=None):
+    print(f"{'endpoint':10} {'reqs':>6} {'ok':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+          f" {'retries':>8} {'prompts':>7}")
+    for name, e in summary["endpoints"].items():
+        print(f"{name:10} {e['requests']:>6} {e['ok']:>6} {e['throughput_rps']:>8} {_fmt(e['p50_ms']):>9}"
+              f" {_fmt(e['p95_ms']):>9} {_fmt(e['p99_ms']):>9} {e['client_retries']:>8} {_fmt(e['q_prompts']):>7}")
+    q = summary["q_processes"]
+    print(f"\ntotal: {summary['throughput_rps']} req/s over {summary['elapsed_seconds']}s, "
+          f"p50 {_fmt(summary['p50_ms'])}ms p95 {_fmt(summary['p95_ms'])}ms p99 {_fmt(summary['p99_ms'])}ms")
+    print(f"q processes: {_fmt(q['spawned'])} spawned for {_fmt(q['prompts'])} prompts, {_fmt(q['failed'])} failed, "
+          f"{_fmt(q['max_concurrent'])} max concurrent")
+    print(f"server peak RSS: {_fmt(summary['server_peak_rss_kb'])} kB")
+
+    if baseline:
+        print(f"\nchange vs baseline ({baseline.get('git_revision')}, {baseline.get('started_at')}):")
+        for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "server_peak_rss_kb"):
+            before, after = baseline.get(key), summary.get(key)
+            if before and after is not None:
+                print(f"  {key:20} {before:>10} -> {after:<10} ({(after - before) / before * 100:+.1f}%)")
+
+
+def _fmt(value):
+    return "-" if value is None else value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load benchmark for /api/story and /api/challenge")
+    parser.add_argument("--requests", type=int, default=200, help="Total requests (ignored with --duration)")
+    parser.add_argument("--duration", type=float, default=0, help="Run for this many seconds instead")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--levels", type=lambda s: [int(v) for v in s.split(",")], default=[1, 2, 3])
+    parser.add_argument("--languages", type=lambda s: s.split(","), default=["python", "javascript"])
+    parser.add_argument("--story-ratio", type=float, default=0.2, help="Fraction of requests to /api/story")
+    parser.add_argument("--latency", default="lognormal:-1.0,0.5", help="Fake q latency distribution")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake q runs that fail")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of fake q runs with bad output")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra server environment, e.g. --env POOL_ENABLED=1")
+    parser.add_argument("--max-retries", type=int, default=3, help="Client retries after a 429")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--url", help="Benchmark an already running server instead of starting one")
+    parser.add_argument("--q-log", help="With --url: fake q invocation log to count spawns")
+    parser.add_argument("--pid", type=int, help="With --url: server pid for peak RSS")
+    parser.add_argument("--json", help="Write machine-readable results to this file")
+    parser.add_argument("--compare", help="Previous --json results to compare against")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="load-bench-")
+    server = None
+    try:
+        if args.url:
+            base_url, q_log, pid = args.url.rstrip("/"), args.q_log, args.pid
+        else:
+            server = Server(args, workdir)
+            server.wait_ready()
+            base_url, q_log, pid = server.url, server.q_log, server.process.pid
+
+        results, elapsed = run_load(base_url, args)
+        rss_kb = peak_rss_kb(pid) if pid else None
+        summary = summarize(results, elapsed, read_q_log(q_log), rss_kb, args)
+    finally:
+        if server:
+            server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(summary, baseline)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+# Pool of pre-generated challenges kept topped up by background workers.
+#
+# Challenges are grouped by (level, language). Objectives come from freshly
+# generated stories and almost never repeat between sessions, so keying on
+# them left most pre-generated challenges unused. The objective is a soft
+# filter instead: a request takes a challenge generated for its objective if
+# one is ready, otherwise the oldest one for its level and language, and
+# refills are generated for the objective most recently asked for. If the
+# bucket is empty the caller falls back to live generation and the bucket is
+# scheduled for refill so the next request is served from memory.
+#
+# Given the shared state (shared_state.py), the ready challenges and the
+# refills in flight are kept in its SQLite file instead, so every server
+# process takes from and tops up the same pool. Each process still runs its
+# own refill workers, but a key is only refilled up to the watermark once,
+# whichever processes do the work.
+import hashlib
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+def objective_bucket(objective):
+    # Objectives come from generated stories, so normalize case and
+    # whitespace before hashing to keep trivially different copies together
+    if not objective:
+        return "any"
+    normalized = " ".join(objective.lower().split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:12]
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return round(sorted_values[index], 3)
+
+
+def pool_key(level, language):
+    return (str(level), (language or "python").lower())
+
+
+def _shared_key(key):
+    # Key of a bucket in the shared state
+    return "|".join(key)
+
+
+class _Bucket:
+    def __init__(self, level, language, objective):
+        self.level = level
+        self.language = language
+        # Refills are generated for the objective most recently asked for
+        self.objective = objective
+        # (objective bucket, challenge)
+        self.items = deque()
+        self.inflight = 0
+        self.hits = 0
+        self.misses = 0
+        self.last_requested = time.time()
+        # Time the bucket dropped below the watermark, used for refill lag
+        self.below_since = None
+
+
+class ChallengePool:
+    def __init__(self, generate_fn, watermark=3, workers=2, idle_seconds=900, max_keys=256, shared=None,
+                 refill_lease_seconds=300):
+        # generate_fn(level, language, objective) -> (challenge, error)
+        self._generate = generate_fn
+        self.watermark = watermark
+        self.worker_count = workers
+        self.idle_seconds = idle_seconds
+        self.max_keys = max_keys
+        self.shared = shared
+        # A process that dies mid-refill holds its share of the watermark
+        # this long
+        self.refill_lease_seconds = refill_lease_seconds
+
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self._refill_queue = queue.Queue()
+        self._workers = []
+        self._started = False
+
+        self.hits = 0
+        self.misses = 0
+        # Hits whose challenge was generated for the requested objective
+        self.objective_hits = 0
+        self.generated = 0
+        self.failed = 0
+        self._refill_lags = deque(maxlen=200)
+
+    def start(self):
+        # Workers are started lazily so the Flask reloader parent process
+        # does not spawn generation threads of its own
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for i in range(self.worker_count):
+            worker = threading.Thread(target=self._worker_loop, name=f"pool-refill-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def take(self, level, language, objective):
+        self.start()
+        key = pool_key(level, language)
+        wanted = objective_bucket(objective)
+        with self._lock:
+            bucket = self._bucket(key, level, objective)
+            bucket.last_requested = time.time()
+            if self.shared is None:
+                challenge, matched = self._pop(bucket, wanted)
+                self._count_take(bucket, challenge, matched)
+                self._schedule_refill(key, bucket)
+                return challenge
+
+        challenge, matched = self.shared.pool_take(_shared_key(key), wanted)
+        reservations = self.shared.pool_reserve(_shared_key(key), self.watermark, self.refill_lease_seconds)
+        with self._lock:
+            self._count_take(bucket, challenge, matched)
+            if reservations and bucket.below_since is None:
+                bucket.below_since = time.time()
+        for reservation in reservations:
+            self._refill_queue.put((key, reservation))
+        return challenge
+
+    def take_any(self, level, language):
+        # A ready challenge for the level and language, without scheduling
+        # refills. Used when Amazon Q is unavailable.
+        key = pool_key(level, language)
+        if self.shared is not None:
+            challenge, _ = self.shared.pool_take(_shared_key(key), None)
+            with self._lock:
+                self.hits += challenge is not None
+            return challenge
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None or not bucket.items:
+                return None
+            self.hits += 1
+            return bucket.items.popleft()[1]
+
+    def put(self, level, language, objective, challenge):
+        # Lets callers donate surplus challenges (e.g. from batch generation)
+        key = pool_key(level, language)
+        if self.shared is not None:
+            return self.shared.pool_put(_shared_key(key), objective_bucket(objective), challenge, self.watermark)
+        with self._lock:
+            bucket = self._bucket(key, level, objective)
+            if len(bucket.items) >= self.watermark:
+                return False
+            bucket.items.append((objective_bucket(objective), challenge))
+            if len(bucket.items) >= self.watermark:
+                bucket.below_since = None
+        return True
+
+    def stats(self):
+        shared_depths = self.shared.pool_depths() if self.shared is not None else None
+        with self._lock:
+            total = self.hits + self.misses
+            lags = sorted(self._refill_lags)
+            if shared_depths is None:
+                depths = {key: (len(bucket.items), bucket.inflight) for key, bucket in self._buckets.items()}
+            else:
+                depths = {key: shared_depths.get(_shared_key(key), (0, 0)) for key in self._buckets}
+            buckets = [
+                {
+                    "level": bucket.level,
+                    "language": bucket.language,
+                    "depth": depths[key][0],
+                    "inflight": depths[key][1],
+                    "hits": bucket.hits,
+                    "misses": bucket.misses,
+                    "hit_rate": (round(bucket.hits / (bucket.hits + bucket.misses), 4)
+                                 if bucket.hits + bucket.misses else 0.0),
+                    "idle_seconds": round(time.time() - bucket.last_requested, 1),
+                }
+                for key, bucket in self._buckets.items()
+            ]
+            return {
+                "watermark": self.watermark,
+                "workers": self.worker_count,
+                "shared": self.shared is not None,
+                "keys": len(self._buckets),
+                "depth": (sum(b["depth"] for b in buckets) if shared_depths is None
+                          else sum(depth for depth, _ in shared_depths.values())),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "objective_hits": self.objective_hits,
+                "generated": self.generated,
+                "failed": self.failed,
+                "pending_refills": self._refill_queue.qsize(),
+                "refill_lag_seconds": {
+                    "last": round(self._refill_lags[-1], 3) if lags else None,
+                    "avg": round(sum(lags) / len(lags), 3) if lags else None,
+                    "p95": _percentile(lags, 0.95),
+                    "max": _percentile(lags, 1.0),
+                },
+                "buckets": buckets,
+            }
+
+    def _bucket(self, key, level, objective):
+        # Caller holds the lock
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = _Bucket(str(level), key[1], objective)
+            self._buckets[key] = bucket
+            # Drop the least recently used buckets once over the key limit
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            if objective:
+                bucket.objective = objective
+        return bucket
+
+    def _pop(self, bucket, wanted):
+        # Caller holds the lock. The bucket holds at most a watermark's worth
+        # of challenges, so looking for a matching objective is cheap.
+        for index, (item_objective, challenge) in enumerate(bucket.items):
+            if item_objective == wanted:
+                del bucket.items[index]
+                return challenge, True
+        if bucket.items:
+            return bucket.items.popleft()[1], False
+        return None, False
+
+    def _count_take(self, bucket, challenge, matched):
+        # Caller holds the lock
+        if challenge is not None:
+            self.hits += 1
+            bucket.hits += 1
+            self.objective_hits += matched
+        else:
+            self.misses += 1
+            bucket.misses += 1
+
+    def _schedule_refill(self, key, bucket):
+        # Caller holds the lock
+        missing = self.watermark - len(bucket.items) - bucket.inflight
+        if missing <= 0:
+            return
+        if bucket.below_since is None:
+            bucket.below_since = time.time()
+        for _ in range(missing):
+            bucket.inflight += 1
+            self._refill_queue.put((key, None))
+
+    def _worker_loop(self):
+        while True:
+            key, reservation = self._refill_queue.get()
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is not None and time.time() - bucket.last_requested > self.idle_seconds:
+                    # Nobody is playing this level and language any more
+                    bucket.inflight = max(0, bucket.inflight - 1)
+                    bucket = None
+                objective = bucket.objective if bucket is not None else None
+            if bucket is None:
+                if reservation is not None:
+                    self.shared.pool_fill(reservation, _shared_key(key), None, None, 0)
+                continue
+
+            try:
+                challenge, error = self._generate(bucket.level, bucket.language, objective)
+            except Exception as e:
+                challenge, error = None, str(e)
+
+            depth = None
+            if reservation is not None:
+                depth = self.shared.pool_fill(reservation, _shared_key(key), objective_bucket(objective), challenge,
+                                              self.max_keys * self.watermark)
+            with self._lock:
+                bucket.inflight = max(0, bucket.inflight - 1)
+                if challenge is None:
+                    self.failed += 1
+                    print(f"Pool refill for level {bucket.level} ({bucket.language}) failed: {error}")
+                    continue
+                self.generated += 1
+                if depth is None:
+                    bucket.items.append((objective_bucket(objective), challenge))
+                    depth = len(bucket.items)
+                if bucket.below_since is not None:
+                    self._refill_lags.append(time.time() - bucket.below_since)
+                    if depth >= self.watermark:
+                        bucket.below_since = None
+                    else:
+                        bucket.below_since = time.time()
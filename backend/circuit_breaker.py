@@ -0,0 +1,138 @@
+# Circuit breaker for Amazon Q generations.
+#
+# The executor reports the outcome and duration of every generation. Within
+# a rolling time window, errors, timeouts and runs slower than
+# slow_call_seconds all count as failures. Once the window holds at least
+# min_calls generations and the failure share reaches failure_rate, the
+# breaker opens: new generations are refused straight away, so requests can
+# be answered from stored content instead of waiting on work that is likely
+# to fail. After open_seconds the breaker goes half-open and lets a few
+# probe generations through. It closes again once they all succeed; any
+# failed probe opens it for another period.
+import math
+import threading
+import time
+from collections import deque
+
+from q_executor import QueueFullError
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(QueueFullError):
+    # A QueueFullError, so the retry paths that give up on a full queue give
+    # up on an open circuit too
+    def __init__(self, retry_after):
+        Exception.__init__(self, f"Amazon Q circuit is open, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, window_seconds=60, min_calls=10, failure_rate=0.5, slow_call_seconds=20,
+                 open_seconds=30, probes=2):
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.probes = probes
+
+        self.state = CLOSED
+        self._opened_at = 0.0
+        # (finished_at, failed, duration) of recent generations
+        self._window = deque()
+        self._failures = 0
+        self._probes_running = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+
+        self.opened = 0
+        self.rejected = 0
+
+    def admit(self):
+        # Called before a generation is queued. Raises CircuitOpenError when
+        # it should not run; returns True if it runs as a half-open probe.
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self._opened_at + self.open_seconds - time.time()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(max(1, math.ceil(remaining)))
+                self.state = HALF_OPEN
+                self._probes_running = 0
+                self._probe_successes = 0
+                print("Amazon Q circuit half-open, probing")
+            if self.state == HALF_OPEN:
+                if self._probes_running >= self.probes:
+                    self.rejected += 1
+                    raise CircuitOpenError(1)
+                self._probes_running += 1
+                return True
+            return False
+
+    def record(self, outcome, duration, probe=False):
+        # outcome is the executor's "ok", "failed" or "timeout", or None for
+        # generations that were cancelled or never started
+        failed = outcome in ("failed", "timeout") or (outcome == "ok" and duration >= self.slow_call_seconds)
+        now = time.time()
+        with self._lock:
+            if probe:
+                self._probes_running -= 1
+            if outcome is None:
+                return
+            if self.state == HALF_OPEN:
+                # Only probes decide; stragglers from before the trip don't
+                if not probe:
+                    return
+                if failed:
+                    self._open(now)
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.probes:
+                        self.state = CLOSED
+                        self._window.clear()
+                        self._failures = 0
+                        print("Amazon Q circuit closed")
+                return
+            if self.state == OPEN:
+                return
+
+            self._window.append((now, failed, duration))
+            self._failures += failed
+            self._prune(now)
+            calls = len(self._window)
+            if calls >= self.min_calls and self._failures / calls >= self.failure_rate:
+                self._open(now)
+
+    def _open(self, now):
+        # Caller holds the lock
+        self.state = OPEN
+        self._opened_at = now
+        self.opened += 1
+        self._window.clear()
+        self._failures = 0
+        print(f"Amazon Q circuit opened for {self.open_seconds}s")
+
+    def _prune(self, now):
+        # Caller holds the lock
+        cutoff = now - self.window_seconds
+        while self._window and self._window[0][0] < cutoff:
+            _, failed, _ = self._window.popleft()
+            self._failures -= failed
+
+    def stats(self):
+        with self._lock:
+            self._prune(time.time())
+            calls = len(self._window)
+            durations = sorted(duration for _, _, duration in self._window)
+            return {
+                "state": self.state,
+                "open": self.state != CLOSED,
+                "window_calls": calls,
+                "window_failure_rate": round(self._failures / calls, 4) if calls else 0.0,
+                "window_p95_seconds": round(durations[min(calls - 1, int(calls * 0.95))], 3) if calls else None,
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,155 @@
+# Runtime settings for the backend, read from environment variables so the
+# same code can run as a dev server on a laptop or behind a production host.
+import os
+
+
+def env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Development server settings for `python app.py`; production runs under
+# gunicorn (see gunicorn.conf.py)
+DEBUG = env_bool("FLASK_DEBUG", False)
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = env_int("PORT", 5000)
+
+# Challenge pool: number of ready challenges kept per (level, language)
+POOL_ENABLED = env_bool("POOL_ENABLED", True)
+POOL_WATERMARK = env_int("POOL_WATERMARK", 3)
+POOL_WORKERS = env_int("POOL_WORKERS", 2)
+# Keys that nobody asked for in this many seconds stop being refilled
+POOL_KEY_IDLE_SECONDS = env_int("POOL_KEY_IDLE_SECONDS", 900)
+POOL_MAX_KEYS = env_int("POOL_MAX_KEYS", 256)
+
+# LLM provider: "cli" runs the Amazon Q CLI per prompt, "cli-warm" keeps
+# interactive q chat processes running, "local" replays recorded or synthetic
+# outputs for load testing without Amazon Q
+LLM_PROVIDER = os.environ.get("LLM_PROVIDER", "cli")
+Q_BINARY = os.environ.get("Q_BINARY", "q")
+# Warm q chat workers are recycled after this many prompts or this much memory growth
+WARM_Q_MAX_PROMPTS = env_int("WARM_Q_MAX_PROMPTS", 50)
+WARM_Q_MAX_RSS_GROWTH_MB = env_int("WARM_Q_MAX_RSS_GROWTH_MB", 200)
+# Start the warm workers with the server instead of on first use
+WARM_Q_PREWARM = env_bool("WARM_Q_PREWARM", True)
+# How long a new warm worker may take to answer its readiness check
+WARM_Q_STARTUP_TIMEOUT_SECONDS = env_float("WARM_Q_STARTUP_TIMEOUT_SECONDS", 60)
+# Sent to a warm worker after each prompt to clear its chat history; empty keeps it
+WARM_Q_CLEAR_COMMAND = os.environ.get("WARM_Q_CLEAR_COMMAND", "/clear")
+# Latency distribution for the local provider: fixed:S, uniform:LOW,HIGH or lognormal:MU,SIGMA
+LOCAL_PROVIDER_LATENCY = os.environ.get("LOCAL_PROVIDER_LATENCY", "fixed:0.5")
+LOCAL_PROVIDER_ERROR_RATE = env_float("LOCAL_PROVIDER_ERROR_RATE", 0.0)
+LOCAL_PROVIDER_MALFORMED_RATE = env_float("LOCAL_PROVIDER_MALFORMED_RATE", 0.0)
+# JSONL file of recorded outputs: {"kind": "story" | "challenge" | "malformed", "output": "..."}
+LOCAL_PROVIDER_FIXTURES = os.environ.get("LOCAL_PROVIDER_FIXTURES") or None
+LOCAL_PROVIDER_SEED = env_int("LOCAL_PROVIDER_SEED", 0)
+
+# Amazon Q executor: global cap on concurrent `q` processes and queue sizes
+Q_MAX_CONCURRENCY = env_int("Q_MAX_CONCURRENCY", os.cpu_count() or 4)
+Q_MAX_QUEUE = env_int("Q_MAX_QUEUE", 64)
+Q_PRELOAD_QUEUE = env_int("Q_PRELOAD_QUEUE", 16)
+Q_TIMEOUT_SECONDS = env_float("Q_TIMEOUT_SECONDS", 30)
+# Largest number of challenges returned by /api/challenges/batch
+BATCH_MAX_COUNT = env_int("BATCH_MAX_COUNT", 10)
+# Upper bound on the total time spent (all retries) serving one request
+REQUEST_DEADLINE_SECONDS = env_float("REQUEST_DEADLINE_SECONDS", 90)
+
+# Single-flight coalescing: identical concurrent requests share one generation.
+# Challenge requests arriving within the window are served from one batch.
+COALESCE_ENABLED = env_bool("COALESCE_ENABLED", True)
+COALESCE_WINDOW_SECONDS = env_float("COALESCE_WINDOW_SECONDS", 0.05)
+
+# State shared between server processes (in-flight generations, rate limits,
+# lookahead levels, challenge pool)
+SHARED_STATE_ENABLED = env_bool("SHARED_STATE_ENABLED", True)
+SHARED_STATE_PATH = os.environ.get("SHARED_STATE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "shared.db"))
+# Requests per minute each client may make to generating endpoints (0 = no limit)
+RATE_LIMIT_PER_MINUTE = env_int("RATE_LIMIT_PER_MINUTE", 0)
+RATE_LIMIT_BURST = env_int("RATE_LIMIT_BURST", 20)
+
+# Startup warmup: fill the content cache for every level before /api/health
+# reports healthy
+WARMUP_ENABLED = env_bool("WARMUP_ENABLED", False)
+WARMUP_STORIES = env_int("WARMUP_STORIES", 2)
+WARMUP_CHALLENGES = env_int("WARMUP_CHALLENGES", 3)
+WARMUP_LANGUAGES = [language.strip() for language in os.environ.get("WARMUP_LANGUAGES", "python,javascript").split(",")
+                    if language.strip()]
+WARMUP_TIMEOUT_SECONDS = env_int("WARMUP_TIMEOUT_SECONDS", 600)
+
+# Circuit breaker around Amazon Q. Errors, timeouts and generations slower
+# than CIRCUIT_SLOW_CALL_SECONDS count as failures; past CIRCUIT_FAILURE_RATE
+# of the calls in the window, requests get stored content for
+# CIRCUIT_OPEN_SECONDS before a few probe generations are let through.
+CIRCUIT_ENABLED = env_bool("CIRCUIT_ENABLED", True)
+CIRCUIT_WINDOW_SECONDS = env_float("CIRCUIT_WINDOW_SECONDS", 60)
+CIRCUIT_MIN_CALLS = env_int("CIRCUIT_MIN_CALLS", 10)
+CIRCUIT_FAILURE_RATE = env_float("CIRCUIT_FAILURE_RATE", 0.5)
+CIRCUIT_SLOW_CALL_SECONDS = env_float("CIRCUIT_SLOW_CALL_SECONDS", 20)
+CIRCUIT_OPEN_SECONDS = env_float("CIRCUIT_OPEN_SECONDS", 30)
+CIRCUIT_PROBES = env_int("CIRCUIT_PROBES", 2)
+
+# Game sessions: /api/session returns level 1 and prepares the later levels
+MAX_LEVEL = env_int("MAX_LEVEL", 3)
+SESSION_CHALLENGES = env_int("SESSION_CHALLENGES", 3)
+LOOKAHEAD_ENABLED = env_bool("LOOKAHEAD_ENABLED", True)
+LOOKAHEAD_WORKERS = env_int("LOOKAHEAD_WORKERS", 2)
+# Unclaimed lookahead content is dropped after this long
+LOOKAHEAD_TTL_SECONDS = env_int("LOOKAHEAD_TTL_SECONDS", 3600)
+LOOKAHEAD_MAX_SESSIONS = env_int("LOOKAHEAD_MAX_SESSIONS", 1000)
+# How long a claim waits for a level that is still being generated
+LOOKAHEAD_CLAIM_WAIT_SECONDS = env_float("LOOKAHEAD_CLAIM_WAIT_SECONDS", 15)
+
+# Challenge bank built with `python bank.py build`; when set, stories and
+# challenges are served from it without calling Amazon Q
+CHALLENGE_BANK = os.environ.get("CHALLENGE_BANK", "")
+
+# Near-duplicate challenge detection. Memory is fixed by the capacity
+# (about 170 bytes per entry).
+DEDUP_ENABLED = env_bool("DEDUP_ENABLED", True)
+DEDUP_CAPACITY = env_int("DEDUP_CAPACITY", 200000)
+# Estimated shingle similarity at which two challenges count as the same
+DEDUP_THRESHOLD = env_float("DEDUP_THRESHOLD", 0.7)
+DEDUP_SESSION_ITEMS = env_int("DEDUP_SESSION_ITEMS", 500)
+DEDUP_MAX_SESSIONS = env_int("DEDUP_MAX_SESSIONS", 10000)
+
+# Sampling profiler for single requests (?profile=1 or an X-Profile: 1 header)
+PROFILER_ENABLED = env_bool("PROFILER_ENABLED", False)
+PROFILER_INTERVAL_SECONDS = env_float("PROFILER_INTERVAL_SECONDS", 0.005)
+
+# Persistent content cache shared by all server processes
+CACHE_ENABLED = env_bool("CACHE_ENABLED", True)
+CACHE_PATH = os.environ.get("CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "content.db"))
+# never: store only, unseen: serve items the session has not seen, any: serve any cached item
+CACHE_SERVE_POLICY = os.environ.get("CACHE_SERVE_POLICY", "unseen")
+# Only serve cached items younger than this
+CACHE_MAX_AGE_SECONDS = env_int("CACHE_MAX_AGE_SECONDS", 7 * 86400)
+CACHE_TTL_SECONDS = env_int("CACHE_TTL_SECONDS", 30 * 86400)
+CACHE_MAX_BYTES = env_int("CACHE_MAX_BYTES", 64 * 1024 * 1024)
+# How long to remember which items a session has already seen
+CACHE_SEEN_TTL_SECONDS = env_int("CACHE_SEEN_TTL_SECONDS", 86400)
+
+# Hedged generation for interactive requests: off, parallel (start HEDGE_FANOUT
+# generations at once) or delayed (start a backup when the first is slower
+# than the HEDGE_PERCENTILE of recent latencies)
+HEDGE_MODE = os.environ.get("HEDGE_MODE", "off")
+HEDGE_FANOUT = env_int("HEDGE_FANOUT", 2)
+HEDGE_PERCENTILE = env_float("HEDGE_PERCENTILE", 0.9)
+# Hedge delay used until enough latencies have been observed
+HEDGE_DEFAULT_DELAY_SECONDS = env_float("HEDGE_DEFAULT_DELAY_SECONDS", 8)
+HEDGE_MIN_DELAY_SECONDS = env_float("HEDGE_MIN_DELAY_SECONDS", 0.5)
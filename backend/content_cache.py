@@ -0,0 +1,244 @@
+# Persistent cache of validated stories and challenges.
+#
+# Served content is stored in SQLite, content-addressed by a hash of its
+# payload and indexed by kind, level, language, question type and objective.
+# A player session can then be given a cached item it has not seen yet
+# instead of paying for another Amazon Q call. SQLite in WAL mode lets
+# several server processes share the same file safely, and the data
+# survives restarts. Old entries are removed by TTL, then least recently
+# used first once the cache grows past its size cap.
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from challenge_pool import objective_bucket
+
+# Freshness policies for serving cached content
+POLICY_NEVER = "never"    # store only, always generate new content
+POLICY_UNSEEN = "unseen"  # serve items the requesting session has not seen
+POLICY_ANY = "any"        # serve any cached item, even without a session
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS content (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    level TEXT NOT NULL,
+    language TEXT NOT NULL,
+    question_type TEXT NOT NULL,
+    objective_hash TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS content_lookup
+    ON content (kind, level, language, objective_hash, question_type);
+CREATE INDEX IF NOT EXISTS content_lru ON content (last_used);
+CREATE TABLE IF NOT EXISTS seen (
+    session_id TEXT NOT NULL,
+    content_id TEXT NOT NULL,
+    seen_at REAL NOT NULL,
+    PRIMARY KEY (session_id, content_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS seen_age ON seen (seen_at);
+"""
+
+
+def content_id(payload):
+    # Content address: hash of the canonical JSON without any previous id
+    body = {key: value for key, value in payload.items() if key != "id"}
+    canonical = json.dumps(body, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+
+class ContentCache:
+    def __init__(self, path, policy=POLICY_UNSEEN, max_age_seconds=7 * 86400,
+                 ttl_seconds=30 * 86400, max_bytes=64 * 1024 * 1024, seen_ttl_seconds=86400):
+        self.path = path
+        self.policy = policy
+        self.max_age_seconds = max_age_seconds
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.seen_ttl_seconds = seen_ttl_seconds
+
+        self._local = threading.local()
+        self._puts_since_maintenance = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db().executescript(_SCHEMA)
+        self.maintain()
+
+    def _db(self):
+        # One connection per thread; SQLite connections are not thread safe
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("PRAGMA busy_timeout=10000")
+            self._local.db = db
+        return db
+
+    def _connect(self):
+        return _Transaction(self._db())
+
+    def put(self, kind, level, language, objective, payload, question_type=""):
+        payload["id"] = content_id(payload)
+        data = json.dumps(payload, separators=(",", ":"))
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR IGNORE INTO content (id, kind, level, language, question_type, objective_hash,"
+                " payload, size, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (payload["id"], kind, str(level), (language or "").lower(), question_type or "",
+                 objective_bucket(objective), data, len(data), now, now),
+            )
+
+        with self._lock:
+            self._puts_since_maintenance += 1
+            run_maintenance = self._puts_since_maintenance >= 50
+            if run_maintenance:
+                self._puts_since_maintenance = 0
+        if run_maintenance:
+            self.maintain()
+        return payload["id"]
+
+    def get(self, kind, level, language, objective, session_id=None, question_type=None):
+        # Returns a cached payload allowed by the freshness policy, or None
+        if self.policy == POLICY_NEVER or (self.policy == POLICY_UNSEEN and not session_id):
+            return None
+
+        query = ("SELECT id, payload FROM content WHERE kind = ? AND level = ? AND language = ?"
+                 " AND objective_hash = ? AND created_at >= ?")
+        params = [kind, str(level), (language or "").lower(), objective_bucket(objective),
+                  time.time() - self.max_age_seconds]
+        if question_type:
+            query += " AND question_type = ?"
+            params.append(question_type)
+        if session_id:
+            query += " AND NOT EXISTS (SELECT 1 FROM seen WHERE session_id = ? AND content_id = content.id)"
+            params.append(session_id)
+        # Spread reuse across items instead of always serving the same one
+        query += " ORDER BY hits, RANDOM() LIMIT 1"
+
+        # The lookup is a plain read, so misses and concurrent lookups from
+        # every process don't queue on SQLite's write lock; only a hit writes
+        db = self._db()
+        for _ in range(3):
+            row = db.execute(query, params).fetchone()
+            if row is None:
+                break
+            now = time.time()
+            with self._connect() as db:
+                db.execute("UPDATE content SET hits = hits + 1, last_used = ? WHERE id = ?", (now, row[0]))
+                if not session_id:
+                    break
+                claimed = db.execute(
+                    "INSERT OR IGNORE INTO seen (session_id, content_id, seen_at) VALUES (?, ?, ?)",
+                    (session_id, row[0], now)).rowcount
+            if claimed:
+                break
+            # A concurrent request served this item to the same session first
+            row = None
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return json.loads(row[1]) if row is not None else None
+
+    def count(self, kind, level, language, objective=None):
+        # Items get() could still serve for this key, ignoring sessions
+        return self._db().execute(
+            "SELECT COUNT(*) FROM content WHERE kind = ? AND level = ? AND language = ?"
+            " AND objective_hash = ? AND created_at >= ?",
+            (kind, str(level), (language or "").lower(), objective_bucket(objective),
+             time.time() - self.max_age_seconds),
+        ).fetchone()[0]
+
+    def fallback(self, kind, level, language, limit=1):
+        # Any stored items for this level and language, whatever their
+        # objective, age or serve policy. Used when Amazon Q is unavailable.
+        rows = self._db().execute(
+            "SELECT payload FROM content WHERE kind = ? AND level = ? AND language = ?"
+            " ORDER BY RANDOM() LIMIT ?",
+            (kind, str(level), (language or "").lower(), limit),
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def mark_seen(self, session_id, item_id):
+        if not session_id or not item_id:
+            return
+        with self._connect() as db:
+            db.execute("INSERT OR IGNORE INTO seen (session_id, content_id, seen_at) VALUES (?, ?, ?)",
+                       (session_id, item_id, time.time()))
+
+    def maintain(self):
+        # Expire by TTL, then evict least recently used items over the size cap
+        now = time.time()
+        with self._connect() as db:
+            expired = db.execute("DELETE FROM content WHERE created_at < ?", (now - self.ttl_seconds,)).rowcount
+            db.execute("DELETE FROM seen WHERE seen_at < ?", (now - self.seen_ttl_seconds,))
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM content").fetchone()[0]
+            evicted = 0
+            if total > self.max_bytes:
+                # Trim to 90% of the cap so eviction doesn't run on every put
+                target = total - int(self.max_bytes * 0.9)
+                freed = 0
+                doomed = []
+                for item_id, size in db.execute("SELECT id, size FROM content ORDER BY last_used"):
+                    doomed.append((item_id,))
+                    freed += size
+                    if freed >= target:
+                        break
+                db.executemany("DELETE FROM content WHERE id = ?", doomed)
+                evicted = len(doomed)
+        with self._lock:
+            self.evicted += expired + evicted
+
+    def stats(self):
+        rows = self._db().execute(
+            "SELECT kind, level, language, COUNT(*), COALESCE(SUM(size), 0) FROM content"
+            " GROUP BY kind, level, language"
+        ).fetchall()
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "path": self.path,
+                "policy": self.policy,
+                "items": sum(row[3] for row in rows),
+                "bytes": sum(row[4] for row in rows),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evicted": self.evicted,
+                "groups": [
+                    {"kind": row[0], "level": row[1], "language": row[2], "items": row[3], "bytes": row[4]}
+                    for row in rows
+                ],
+            }
+
+
+class _Transaction:
+    # Runs a block in a single write transaction on an autocommit connection
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
@@ -0,0 +1,208 @@
+# Near-duplicate detection for generated challenges.
+#
+# Amazon Q often answers "generate a new and unique question" with a
+# challenge that differs from an earlier one only in a number or a variable
+# name. Each challenge's question, code and template are reduced to token
+# shingles (numbers, strings and code identifiers normalized) and summarized
+# by a MinHash signature. Locality-sensitive hashing over bands of the
+# signature then finds earlier challenges with a similar shingle set; a
+# check takes well under a millisecond.
+#
+# Memory is fixed up front: signatures live in a ring buffer of `capacity`
+# entries and each band table is a flat array of slot numbers, so the
+# oldest challenges are forgotten once the buffer wraps. The index also
+# remembers, per player session, the signatures of the challenges that
+# session was served, so a near-copy of something a player already solved
+# is not shown to them again.
+import builtins
+import keyword
+import random
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+_MASK64 = (1 << 64) - 1
+_MASK32 = 0xFFFFFFFF
+_TOKEN = re.compile(r"\"(?:[^\"\\]|\\.)*\"|'(?:[^'\\]|\\.)*'|\d+(?:\.\d+)?|\w+|[^\w\s]")
+
+# Names that carry meaning in code; every other identifier is renamed by
+# order of appearance, so `x = 5` and `count = 7` look the same
+_KNOWN_NAMES = set(keyword.kwlist) | set(dir(builtins)) | {
+    "var", "let", "const", "function", "console", "log", "length", "push", "pop", "map", "filter",
+    "reduce", "foreach", "math", "string", "array", "object", "typeof", "undefined", "null", "this",
+}
+
+
+def _tokens(text, code):
+    tokens = []
+    names = {}
+    for token in _TOKEN.findall(text):
+        if token[0] in "\"'":
+            token = "<str>"
+        elif token[0].isdigit():
+            token = "<num>"
+        else:
+            token = token.lower()
+            if code and (token[0].isalpha() or token[0] == "_") and token not in _KNOWN_NAMES:
+                token = names.setdefault(token, f"<id{len(names)}>")
+        tokens.append(token)
+    return tokens
+
+
+def shingles(challenge, size=3):
+    result = set()
+    for field, code in (("question", False), ("code", True), ("template", True)):
+        tokens = _tokens(str(challenge.get(field) or ""), code)
+        if tokens and len(tokens) < size:
+            result.add(" ".join(tokens))
+        result.update(" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1))
+    return result or {""}
+
+
+class NearDuplicateIndex:
+    def __init__(self, capacity=200000, threshold=0.7, num_perm=32, bands=8,
+                 session_items=500, max_sessions=10000, seed=1):
+        self.capacity = max(1, capacity)
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.session_items = session_items
+        self.max_sessions = max_sessions
+
+        rng = random.Random(seed)
+        # XOR masks stand in for hash permutations; min() over map() stays in C
+        self._masks = [rng.getrandbits(64) for _ in range(num_perm)]
+        # Ring buffer of signatures, num_perm 32-bit values per slot
+        self._signatures = array("I", bytes(4 * self.capacity * num_perm))
+        # One flat table per band: bucket -> slot + 1 (0 means empty)
+        self._table_size = 1 << (self.capacity - 1).bit_length()
+        self._tables = [array("I", bytes(4 * self._table_size)) for _ in range(bands)]
+        self._next = 0
+        self._size = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.checks = 0
+        self.duplicates = 0
+        self._check_seconds = 0.0
+
+    def signature(self, challenge):
+        hashes = [hash(shingle) & _MASK64 for shingle in shingles(challenge)]
+        return [min(map(mask.__xor__, hashes)) & _MASK32 for mask in self._masks]
+
+    def _band_keys(self, signature):
+        rows = self.rows
+        return [hash((band, tuple(signature[band * rows:(band + 1) * rows])))
+                for band in range(self.bands)]
+
+    def _similarity(self, slot, signature):
+        base = slot * self.num_perm
+        stored = self._signatures[base:base + self.num_perm]
+        return sum(1 for x, y in zip(stored, signature) if x == y) / self.num_perm
+
+    def _best_match(self, signature, keys):
+        # Caller holds the lock
+        best = 0.0
+        mask = self._table_size - 1
+        checked = set()
+        for table, key in zip(self._tables, keys):
+            slot = table[key & mask] - 1
+            if slot < 0 or slot in checked:
+                continue
+            checked.add(slot)
+            best = max(best, self._similarity(slot, signature))
+        return best
+
+    def check(self, challenge, add=True):
+        # Returns (is_duplicate, similarity to the closest indexed challenge).
+        # New challenges are added to the index unless add is False.
+        started = time.perf_counter()
+        signature = self.signature(challenge)
+        keys = self._band_keys(signature)
+        with self._lock:
+            similarity = self._best_match(signature, keys)
+            duplicate = similarity >= self.threshold
+            if add and not duplicate:
+                self._add(signature, keys)
+            self.checks += 1
+            if duplicate:
+                self.duplicates += 1
+            self._check_seconds += time.perf_counter() - started
+        return duplicate, similarity
+
+    def _add(self, signature, keys):
+        # Caller holds the lock. Overwrites the oldest slot once full; stale
+        # band entries pointing at a reused slot fail the similarity check.
+        slot = self._next
+        self._next = (slot + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+        base = slot * self.num_perm
+        self._signatures[base:base + self.num_perm] = array("I", signature)
+        mask = self._table_size - 1
+        for table, key in zip(self._tables, keys):
+            table[key & mask] = slot + 1
+
+    def seen_by(self, session_id, challenge):
+        # True if this session was already served a near-copy of the
+        # challenge: a band match only picks the candidates, and their
+        # similarity has to reach the threshold as in check()
+        if not session_id:
+            return False
+        signature = self.signature(challenge)
+        keys = self._band_keys(signature)
+        with self._lock:
+            seen = self._sessions.get(session_id)
+            if seen is None:
+                return False
+            bands, history = seen
+            candidates = set()
+            for key in keys:
+                candidates.update(bands.get(key, ()))
+            return any(self._session_similarity(history[entry], signature) >= self.threshold
+                       for entry in candidates)
+
+    def _session_similarity(self, stored, signature):
+        return sum(1 for x, y in zip(stored, signature) if x == y) / self.num_perm
+
+    def mark_seen(self, session_id, challenge):
+        if not session_id:
+            return
+        signature = self.signature(challenge)
+        keys = self._band_keys(signature)
+        with self._lock:
+            seen = self._sessions.get(session_id)
+            if seen is None:
+                seen = self._sessions[session_id] = ({}, OrderedDict())
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session_id)
+            # Band key -> entries that have it; entry -> signature, oldest first
+            bands, history = seen
+            entry = next(reversed(history)) + 1 if history else 0
+            history[entry] = array("I", signature)
+            for key in keys:
+                bands.setdefault(key, set()).add(entry)
+            while len(history) > self.session_items:
+                old_entry, old_signature = history.popitem(last=False)
+                for key in self._band_keys(list(old_signature)):
+                    entries = bands.get(key)
+                    if entries is not None:
+                        entries.discard(old_entry)
+                        if not entries:
+                            del bands[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": self._size,
+                "capacity": self.capacity,
+                "threshold": self.threshold,
+                "sessions": len(self._sessions),
+                "checks": self.checks,
+                "duplicates": self.duplicates,
+                "avg_check_us": round(self._check_seconds / self.checks * 1e6, 1) if self.checks else None,
+            }
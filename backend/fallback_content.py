@@ -0,0 +1,169 @@
+# Built-in stories and challenges for degraded mode.
+#
+# Served only when Amazon Q is unavailable and neither the content cache,
+# the challenge pool nor a challenge bank has anything for the request, so
+# a game can still be played end to end.
+import copy
+import random
+
+STORIES = {
+    1: {
+        "title": "Level 1 Lost Lantern Lane",
+        "story": "The lanterns of Byte Village have gone dark and the night crawlers are closing in. The old keeper left instructions written in code, but the pages are scrambled. Only someone who can read them can relight the square before dawn.",
+        "objective": "Solve the keeper's coding puzzles to relight the lanterns of Byte Village.",
+    },
+    2: {
+        "title": "Level 2 Crumbling Compiler Caves",
+        "story": "Beyond the village lie the Compiler Caves, where every tunnel collapses unless its supports are built correctly. Echoes of broken loops and stray variables fill the air as you step inside.",
+        "objective": "Fix the cave's broken code to shore up the tunnels and reach the far exit.",
+    },
+    3: {
+        "title": "Level 3 Tangled Tower Throne",
+        "story": "At the top of the Tangled Tower the Bug King guards the source of all errors. His throne is protected by the hardest puzzles in the realm, and only flawless code will break the spell.",
+        "objective": "Defeat the Bug King by solving the tower's final coding challenges.",
+    },
+}
+
+CHALLENGES = {
+    ("python", 1): [
+        {
+            "question": "What does this code print?",
+            "type": "multiple-choice",
+            "code": "lanterns = 3\nlanterns = lanterns + 2\nprint(lanterns)",
+            "options": ["3", "5", "32", "Error"],
+            "answer": "5",
+            "hint": "The variable is updated before it is printed.",
+            "explanation": "lanterns starts at 3 and is increased by 2, so 5 is printed.",
+        },
+        {
+            "question": "What does this code print?",
+            "type": "multiple-choice",
+            "code": "for number in range(1, 4):\n    print(number, end=\" \")",
+            "options": ["1 2 3", "1 2 3 4", "0 1 2 3", "2 3 4"],
+            "answer": "1 2 3",
+            "hint": "range stops before its second argument.",
+            "explanation": "range(1, 4) yields 1, 2 and 3.",
+        },
+    ],
+    ("python", 2): [
+        {
+            "question": "Complete the code so it adds up every support in the list.",
+            "type": "fill-in-blank",
+            "template": "supports = [2, 4, 6]\ntotal = 0\n_____ s in supports:\n    total _____ s\nprint(total)",
+            "answer": "for, +=",
+            "hint": "Loop over the list and add each item to the total.",
+            "explanation": "for s in supports visits each item and total += s adds it, giving 12.",
+        },
+        {
+            "question": "Complete the function so it returns True for even numbers.",
+            "type": "fill-in-blank",
+            "template": "_____ is_even(n):\n    return n _____ 2 == 0",
+            "answer": "def, %",
+            "hint": "Define the function, then use the remainder of a division.",
+            "explanation": "def starts a function definition and n % 2 is 0 exactly when n is even.",
+        },
+    ],
+    ("python", 3): [
+        {
+            "question": "What does this code print?",
+            "type": "multiple-choice",
+            "code": "def power(base, exp):\n    if exp == 0:\n        return 1\n    return base * power(base, exp - 1)\n\nprint(power(2, 4))",
+            "options": ["8", "16", "6", "32"],
+            "answer": "16",
+            "hint": "Each call multiplies by the base once more.",
+            "explanation": "power(2, 4) computes 2 * 2 * 2 * 2 = 16.",
+        },
+        {
+            "question": "Complete the list comprehension that keeps only the bugs with more than 10 health.",
+            "type": "fill-in-blank",
+            "template": "strong = [bug _____ bug in bugs _____ bug.health > 10]",
+            "answer": "for, if",
+            "hint": "A comprehension loops over the items, then filters them with a condition keyword.",
+            "explanation": "for bug in bugs visits each bug and the if clause keeps the strong ones.",
+        },
+    ],
+    ("javascript", 1): [
+        {
+            "question": "What does this code print?",
+            "type": "multiple-choice",
+            "code": "let lanterns = 3;\nlanterns = lanterns + 2;\nconsole.log(lanterns);",
+            "options": ["3", "5", "32", "undefined"],
+            "answer": "5",
+            "hint": "The variable is updated before it is logged.",
+            "explanation": "lanterns starts at 3 and is increased by 2, so 5 is logged.",
+        },
+        {
+            "question": "How many times does this loop log a lantern number?",
+            "type": "multiple-choice",
+            "code": "for (let i = 1; i <= 3; i++) {\n  console.log(i);\n}",
+            "options": ["2", "3", "4", "Forever"],
+            "answer": "3",
+            "hint": "The loop includes 3 itself.",
+            "explanation": "i <= 3 keeps the loop running for 1, 2 and 3.",
+        },
+    ],
+    ("javascript", 2): [
+        {
+            "question": "Complete the code so it adds up every support in the array.",
+            "type": "fill-in-blank",
+            "template": "const supports = [2, 4, 6];\nconst total = supports._____((sum, s) => sum _____ s, 0);\nconsole.log(total);",
+            "answer": "reduce, +",
+            "hint": "Which array method combines every item into one value?",
+            "explanation": "reduce adds 2, 4 and 6 to the starting value 0, giving 12.",
+        },
+        {
+            "question": "Complete the function so it returns true for even numbers.",
+            "type": "fill-in-blank",
+            "template": "_____ isEven(n) {\n  return n _____ 2 === 0;\n}",
+            "answer": "function, %",
+            "hint": "Declare the function, then use the remainder of a division.",
+            "explanation": "function declares isEven and n % 2 is 0 exactly when n is even.",
+        },
+    ],
+    ("javascript", 3): [
+        {
+            "question": "What does this code print?",
+            "type": "multiple-choice",
+            "code": "function power(base, exp) {\n  if (exp === 0) return 1;\n  return base * power(base, exp - 1);\n}\nconsole.log(power(2, 4));",
+            "options": ["8", "16", "6", "32"],
+            "answer": "16",
+            "hint": "Each call multiplies by the base once more.",
+            "explanation": "power(2, 4) computes 2 * 2 * 2 * 2 = 16.",
+        },
+        {
+            "question": "Complete the code that keeps only the bugs with more than 10 health.",
+            "type": "fill-in-blank",
+            "template": "const strong = bugs._____(bug => bug.health _____ 10);",
+            "answer": "filter, >",
+            "hint": "Which array method keeps the items a test accepts, and which comparison means more than?",
+            "explanation": "filter returns a new array of the items for which bug.health > 10 is true.",
+        },
+    ],
+}
+
+
+def _level(level):
+    try:
+        return min(max(int(level), 1), 3)
+    except (TypeError, ValueError):
+        return 1
+
+
+def fallback_story(level):
+    return copy.deepcopy(STORIES[_level(level)])
+
+
+def fallback_challenges(level, language, pick_type, count=1):
+    # Up to count different challenges, each of the question type
+    # pick_type(level) chooses for it, as for generated challenges
+    level = _level(level)
+    choices = list(CHALLENGES.get(((language or "python").lower(), level), CHALLENGES[("python", level)]))
+    random.shuffle(choices)
+    picked = []
+    for _ in range(count):
+        question_type = pick_type(str(level))
+        challenge = next((choice for choice in choices if choice["type"] == question_type), None)
+        if challenge is not None:
+            choices.remove(challenge)
+            picked.append(challenge)
+    return copy.deepcopy(picked)
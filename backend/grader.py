@@ -0,0 +1,165 @@
+# Local answer grading for /api/feedback.
+#
+# Answers are checked without a round-trip to Amazon Q. Text is normalized
+# (whitespace, typographic quotes), multi-blank answers are split on ", " the
+# way challenges are generated, and each blank is compared as code: Python
+# through its AST, JavaScript through its token stream. Anything that does
+# not parse falls back to the same forgiving text comparison the frontend
+# used before. The expected side of each challenge is normalized once and
+# cached by challenge id together with the answer and template it was built
+# from, so a request carrying a different answer can't change it for others.
+import ast
+import functools
+import re
+import threading
+from collections import OrderedDict
+
+_QUOTES = str.maketrans({
+    "‘": "'", "’": "'", "‚": "'", "′": "'",
+    "“": '"', "”": '"', "„": '"', "″": '"',
+    " ": " ",
+})
+_WHITESPACE = re.compile(r"\s+")
+_BLANK_SEPARATOR = re.compile(r"\s*,\s*")
+# Longer answers are only compared as text; ast.parse on deeply nested input
+# can exhaust the stack
+_MAX_CODE_LENGTH = 1000
+
+# Just enough of JavaScript's lexical grammar to compare short fragments
+_JS_TOKEN = re.compile(r"""
+    (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|`(?:[^`\\]|\\.)*`)
+  | (?P<number>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|\.\d+)
+  | (?P<name>[A-Za-z_$][\w$]*)
+  | (?P<op>===|!==|\*\*=|<<=|>>>=|>>=|=>|==|!=|<=|>=|&&|\|\||\?\?|\+\+|--|[-+*/%&|^]=|<<|>>>|>>|\S)
+""", re.VERBOSE | re.DOTALL)
+
+
+def normalize_text(text):
+    return _WHITESPACE.sub(" ", str(text or "").translate(_QUOTES)).strip()
+
+
+def _loose(text):
+    # The frontend's original rule: ignore whitespace, semicolons and case
+    return _WHITESPACE.sub("", text).replace(";", "").lower()
+
+
+@functools.lru_cache(maxsize=8192)
+def python_form(text):
+    # Canonical AST dump, or None if the fragment isn't a Python expression
+    # or statement on its own (e.g. a lone keyword)
+    if len(text) > _MAX_CODE_LENGTH:
+        return None
+    for mode in ("eval", "exec"):
+        try:
+            return ast.dump(ast.parse(text.strip(), mode=mode))
+        except (SyntaxError, ValueError):
+            continue
+        except (RecursionError, MemoryError):
+            return None
+    return None
+
+
+@functools.lru_cache(maxsize=8192)
+def javascript_form(text):
+    tokens = []
+    for match in _JS_TOKEN.finditer(text):
+        kind = match.lastgroup
+        token = match.group(kind)
+        if kind == "string":
+            # 'a' and "a" are the same string
+            token = '"' + token[1:-1].replace('\\"', '"').replace("\\'", "'") + '"'
+        elif kind == "number":
+            try:
+                token = repr(float(token))
+            except ValueError:
+                pass
+        elif token == ";":
+            # Semicolons are optional in the fragments players type
+            continue
+        tokens.append(token)
+    return tuple(tokens)
+
+
+def code_form(text, language):
+    if (language or "").lower() == "javascript":
+        return "js", javascript_form(text)
+    form = python_form(text)
+    if form is None:
+        return "text", _loose(text)
+    return "py", form
+
+
+def blank_equal(expected, answer, language):
+    if expected == answer:
+        return True
+    if code_form(expected, language) == code_form(answer, language):
+        return True
+    return _loose(expected) == _loose(answer)
+
+
+class _Expected:
+    def __init__(self, answer, question_type, blank_count):
+        self.answer = normalize_text(answer)
+        self.question_type = question_type
+        self.parts = [self.answer]
+        if question_type == "fill-in-blank" and blank_count != 1:
+            parts = [part for part in _BLANK_SEPARATOR.split(self.answer) if part]
+            # Only trust the split when it matches the blanks in the template
+            if len(parts) > 1 and (not blank_count or len(parts) == blank_count):
+                self.parts = parts
+
+
+class Grader:
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._expected = OrderedDict()
+        self._lock = threading.Lock()
+        self.graded = 0
+        self.correct = 0
+        self.cache_hits = 0
+
+    def grade(self, answer, correct_answer, question_type="fill-in-blank", language="python",
+              template=None, challenge_id=None):
+        expected = self._expected_for(correct_answer, question_type, template, challenge_id)
+        submitted = normalize_text(answer)
+        if question_type == "multiple-choice":
+            correct = submitted == expected.answer
+        else:
+            correct = self._fill_in_correct(expected, submitted, language)
+        with self._lock:
+            self.graded += 1
+            if correct:
+                self.correct += 1
+        return correct
+
+    def _fill_in_correct(self, expected, submitted, language):
+        if len(expected.parts) > 1:
+            parts = _BLANK_SEPARATOR.split(submitted)
+            if len(parts) == len(expected.parts):
+                return all(blank_equal(e, a, language) for e, a in zip(expected.parts, parts))
+        return blank_equal(expected.answer, submitted, language)
+
+    def _expected_for(self, correct_answer, question_type, template, challenge_id):
+        key = (challenge_id, correct_answer, question_type, template)
+        with self._lock:
+            expected = self._expected.get(key)
+            if expected is not None:
+                self._expected.move_to_end(key)
+                self.cache_hits += 1
+                return expected
+        blank_count = template.count("_____") if template else 0
+        expected = _Expected(correct_answer, question_type, blank_count)
+        with self._lock:
+            self._expected[key] = expected
+            while len(self._expected) > self.max_entries:
+                self._expected.popitem(last=False)
+        return expected
+
+    def stats(self):
+        with self._lock:
+            return {
+                "graded": self.graded,
+                "correct": self.correct,
+                "cached_challenges": len(self._expected),
+                "cache_hits": self.cache_hits,
+            }
@@ -0,0 +1,30 @@
+# Production server settings: `gunicorn -c gunicorn.conf.py wsgi:app`
+#
+# Several worker processes, each with a pool of threads, since requests
+# spend most of their time waiting on Amazon Q or holding a stream open.
+# Workers share generated content, in-flight generations, rate limits,
+# lookahead levels and the challenge pool through SQLite (CACHE_PATH and
+# SHARED_STATE_PATH), so no sticky sessions are needed, and each worker reports
+# healthy once the startup warmup has filled the cache.
+import os
+
+cpus = os.cpu_count() or 1
+
+bind = os.environ.get("BIND", f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+workers = int(os.environ.get("WEB_CONCURRENCY", min(4, cpus)))
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 16))
+# Longer than REQUEST_DEADLINE_SECONDS, so slow generations aren't killed
+timeout = int(os.environ.get("WORKER_TIMEOUT", 120))
+graceful_timeout = 30
+accesslog = "-"
+
+# Every worker has its own executor; split the Amazon Q process budget
+# between them instead of giving each one a slot per core
+os.environ.setdefault("Q_MAX_CONCURRENCY", str(max(1, cpus // workers)))
+os.environ.setdefault("WARMUP_ENABLED", "true")
+
+
+def post_worker_init(worker):
+    from wsgi import start_warmup
+    start_warmup()
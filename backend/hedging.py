@@ -0,0 +1,136 @@
+# Hedged Amazon Q generation: first valid response wins.
+#
+# A malformed or slow answer from Amazon Q otherwise costs a whole extra
+# sequential attempt. In "parallel" mode several generations start at once;
+# in "delayed" mode a backup starts only when the first has not produced a
+# valid object within the observed latency percentile. Whichever response
+# passes validation first is used and the other processes are killed.
+import queue
+import threading
+import time
+from collections import deque
+
+from q_executor import QueueFullError
+
+HEDGE_OFF = "off"
+HEDGE_PARALLEL = "parallel"
+HEDGE_DELAYED = "delayed"
+
+
+class LatencyTracker:
+    # Rolling window of successful generation latencies, used to pick the hedge delay
+    def __init__(self, percentile=0.9, window=200, default_delay=8.0, min_delay=0.5, max_delay=30.0, min_samples=10):
+        self.percentile = percentile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def delay(self):
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < self.min_samples:
+            return self.default_delay
+        index = min(len(samples) - 1, int(len(samples) * self.percentile))
+        return max(self.min_delay, min(self.max_delay, samples[index]))
+
+
+class Hedger:
+    def __init__(self, executor, mode=HEDGE_OFF, fanout=2, tracker=None):
+        self.executor = executor
+        self.mode = mode
+        # Maximum number of concurrent generations for one request
+        self.fanout = max(1, fanout)
+        self.tracker = tracker or LatencyTracker()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedges_launched = 0
+        self.hedge_wins = 0
+        self.losers_cancelled = 0
+
+    def run(self, prompt, validate, priority, timeout):
+        # validate(result) -> (parsed, error), where result is the executor output.
+        # Returns (parsed, error) for the first job whose output validates.
+        with self._lock:
+            self.requests += 1
+        started = time.time()
+        deadline = started + timeout
+        finished = queue.Queue()
+        jobs = []
+        error = "Request to Amazon Q timed out"
+
+        def launch():
+            job = self.executor.submit(prompt, priority=priority, timeout=max(0.1, deadline - time.time()))
+            job.add_done_callback(finished.put)
+            jobs.append(job)
+            if len(jobs) > 1:
+                with self._lock:
+                    self.hedges_launched += 1
+            return job
+
+        launch()
+        initial = self.fanout if self.mode == HEDGE_PARALLEL else 1
+        for _ in range(initial - 1):
+            if not self._try_launch(launch):
+                break
+        next_hedge = started + self.tracker.delay() if self.mode == HEDGE_DELAYED else None
+
+        try:
+            pending = len(jobs)
+            while pending and time.time() < deadline:
+                wait_until = deadline if next_hedge is None else min(deadline, next_hedge)
+                try:
+                    job = finished.get(timeout=max(0.01, wait_until - time.time()))
+                except queue.Empty:
+                    if next_hedge is not None and time.time() >= next_hedge:
+                        # The primary is slow: start a backup
+                        if len(jobs) < self.fanout and self._try_launch(launch):
+                            pending += 1
+                        next_hedge = None if len(jobs) >= self.fanout else time.time() + self.tracker.delay()
+                    continue
+
+                pending -= 1
+                parsed, error = validate(job.result)
+                if parsed is not None:
+                    self.tracker.record(time.time() - started)
+                    if job is not jobs[0]:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return parsed, None
+
+                # Invalid answer: hedge right away instead of waiting for the timer
+                if len(jobs) < self.fanout and self._try_launch(launch):
+                    pending += 1
+            return None, error
+        finally:
+            for job in jobs:
+                if not job.done():
+                    job.cancel()
+                    with self._lock:
+                        self.losers_cancelled += 1
+
+    def _try_launch(self, launch):
+        # Hedges are optional; a full queue just means no backup this time
+        try:
+            launch()
+            return True
+        except QueueFullError:
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "fanout": self.fanout,
+                "hedge_delay_seconds": round(self.tracker.delay(), 3),
+                "requests": self.requests,
+                "hedges_launched": self.hedges_launched,
+                "hedge_wins": self.hedge_wins,
+                "losers_cancelled": self.losers_cancelled,
+            }
@@ -0,0 +1,361 @@
+# Lenient single-pass JSON parser for Amazon Q responses.
+#
+# Amazon Q often wraps its JSON in prose or markdown fences and gets the
+# details wrong: unquoted keys, single quotes, stray backslashes in code,
+# unescaped quotes inside strings, missing or trailing commas, Python
+# literals, or output cut off before the closing brace. Instead of trying a
+# cascade of regex rewrites and re-parsing after each one, this parser
+# repairs those problems while it scans the text once, and reports which
+# repairs it had to make.
+
+import json
+import re
+
+_WHITESPACE = " \t\r\n"
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_BARE_WORDS = {
+    "true": True, "false": False, "null": None,
+    "True": True, "False": False, "None": None,
+}
+_NUMBER_START = set("0123456789+-.")
+_NUMBER_CHARS = set("0123456789+-.eE")
+_KEY_TERMINATORS = set(":,{}[]\"'") | set(_WHITESPACE)
+_WHITESPACE_RUN = re.compile(r"[ \t\r\n]*")
+_STRING_SPECIAL = {
+    '"': re.compile(r'["\\\x00-\x1f]'),
+    "'": re.compile(r"['\\\x00-\x1f]"),
+}
+_DECODER = json.JSONDecoder()
+
+
+class LenientJSONError(ValueError):
+    def __init__(self, message, position):
+        super().__init__(f"{message} at position {position}")
+        self.position = position
+
+
+def find_json_start(text, start=0):
+    # Index of the first '{' or '[' at or after start, or -1
+    brace = text.find("{", start)
+    bracket = text.find("[", start)
+    if brace < 0:
+        return bracket
+    if bracket < 0:
+        return brace
+    return min(brace, bracket)
+
+
+def parse_lenient(text, start=None):
+    """Parse the first JSON object or array in text.
+
+    Returns (value, repairs) where repairs lists the fixes that were applied.
+    Raises LenientJSONError if no value can be recovered.
+    """
+    if start is None:
+        start = find_json_start(text)
+        if start < 0:
+            raise LenientJSONError("No JSON object found", 0)
+        if text.rfind("```", 0, start) >= 0:
+            # Everything before the first brace is skipped anyway
+            parser_repairs = ["markdown_fence"]
+        else:
+            parser_repairs = []
+    else:
+        parser_repairs = []
+    # Well-formed output is the common case; let the C decoder take it
+    try:
+        return _DECODER.raw_decode(text, start)[0], parser_repairs
+    except ValueError:
+        pass
+    parser = _Parser(text, start, parser_repairs)
+    value = parser.parse_value()
+    return value, parser.repairs
+
+
+class _Parser:
+    def __init__(self, text, position, repairs):
+        self.text = text
+        self.length = len(text)
+        self.pos = position
+        self.repairs = repairs
+
+    def repair(self, name):
+        if name not in self.repairs:
+            self.repairs.append(name)
+
+    def skip_whitespace(self):
+        text = self.text
+        pos = _WHITESPACE_RUN.match(text, self.pos).end()
+        while pos < self.length and text[pos] in "`/":
+            if text.startswith("```", pos):
+                # Markdown fence (optionally ```json) in the middle of the value
+                pos += 3
+                while pos < self.length and text[pos].isalpha():
+                    pos += 1
+                self.repair("markdown_fence")
+            elif text.startswith("//", pos):
+                end = text.find("\n", pos)
+                pos = self.length if end < 0 else end + 1
+                self.repair("comment")
+            else:
+                break
+            pos = _WHITESPACE_RUN.match(text, pos).end()
+        self.pos = pos
+
+    def peek(self):
+        self.skip_whitespace()
+        return self.text[self.pos] if self.pos < self.length else ""
+
+    def parse_value(self):
+        char = self.peek()
+        if char == "{":
+            return self.parse_object()
+        if char == "[":
+            return self.parse_array()
+        if char == '"' or char == "'":
+            return self.parse_string(char)
+        if char == "":
+            raise LenientJSONError("Unexpected end of input", self.pos)
+        if char in _NUMBER_START:
+            return self.parse_number()
+        return self.parse_bare_word()
+
+    def parse_object(self):
+        self.pos += 1
+        result = {}
+        while True:
+            char = self.peek()
+            if char == "}":
+                self.pos += 1
+                return result
+            if char == "":
+                self.repair("truncated")
+                return result
+            if char == ",":
+                # Leading or doubled comma
+                self.pos += 1
+                self.repair("extra_comma")
+                continue
+
+            if char == '"' or char == "'":
+                key = self.parse_string(char, is_key=True)
+            else:
+                key = self.parse_unquoted_key()
+
+            if self.peek() == ":":
+                self.pos += 1
+            else:
+                self.repair("missing_colon")
+
+            if self.peek() in ("", "}"):
+                self.repair("truncated")
+                result[key] = None
+            else:
+                result[key] = self.parse_value()
+
+            char = self.peek()
+            if char == ",":
+                self.pos += 1
+                if self.peek() == "}":
+                    self.repair("trailing_comma")
+            elif char == "}" or char == "":
+                continue
+            elif char == "]":
+                # Mismatched bracket, treat as the end of the object
+                self.pos += 1
+                self.repair("mismatched_bracket")
+                return result
+            else:
+                self.repair("missing_comma")
+
+    def parse_array(self):
+        self.pos += 1
+        result = []
+        while True:
+            char = self.peek()
+            if char == "]":
+                self.pos += 1
+                return result
+            if char == "":
+                self.repair("truncated")
+                return result
+            if char == ",":
+                self.pos += 1
+                self.repair("extra_comma")
+                continue
+
+            result.append(self.parse_value())
+
+            char = self.peek()
+            if char == ",":
+                self.pos += 1
+                if self.peek() == "]":
+                    self.repair("trailing_comma")
+            elif char == "]" or char == "":
+                continue
+            elif char == "}":
+                self.pos += 1
+                self.repair("mismatched_bracket")
+                return result
+            else:
+                self.repair("missing_comma")
+
+    def parse_unquoted_key(self):
+        start = self.pos
+        text = self.text
+        while self.pos < self.length and text[self.pos] not in _KEY_TERMINATORS:
+            self.pos += 1
+        if self.pos == start:
+            raise LenientJSONError(f"Unexpected character {text[start]!r}", start)
+        self.repair("unquoted_key")
+        return text[start:self.pos]
+
+    def parse_string(self, quote, is_key=False):
+        if quote == "'":
+            self.repair("single_quotes")
+        text = self.text
+        special = _STRING_SPECIAL[quote]
+        pos = self.pos + 1
+        chunks = []
+        chunk_start = pos
+        while True:
+            # Jump straight to the next quote, backslash or control character
+            match = special.search(text, pos)
+            if match is None:
+                chunks.append(text[chunk_start:])
+                self.pos = self.length
+                self.repair("truncated")
+                return "".join(chunks)
+            pos = match.start()
+            char = text[pos]
+            if char == quote:
+                if self._closes_string(pos + 1, is_key):
+                    chunks.append(text[chunk_start:pos])
+                    self.pos = pos + 1
+                    return "".join(chunks)
+                # A quote inside the value that should have been escaped
+                self.repair("unescaped_quote")
+                pos += 1
+            elif char == "\\":
+                chunks.append(text[chunk_start:pos])
+                pos = self._parse_escape(pos, chunks, quote)
+                chunk_start = pos
+            else:
+                # Raw newlines and tabs are kept as-is
+                self.repair("control_character")
+                pos += 1
+
+    def _closes_string(self, pos, is_key):
+        # A quote ends a value only if what follows can follow a value
+        if is_key:
+            return True
+        text = self.text
+        while pos < self.length and text[pos] in _WHITESPACE:
+            pos += 1
+        if pos >= self.length:
+            return True
+        follower = text[pos]
+        if follower in ",}]:":
+            return True
+        # `"a" "b": ...` style missing comma between properties
+        return follower == '"' and self._looks_like_key(pos)
+
+    def _looks_like_key(self, pos):
+        end = self.text.find('"', pos + 1)
+        if end < 0:
+            return False
+        after = end + 1
+        while after < self.length and self.text[after] in _WHITESPACE:
+            after += 1
+        return after < self.length and self.text[after] == ":"
+
+    def _parse_escape(self, pos, chunks, quote):
+        text = self.text
+        if pos + 1 >= self.length:
+            self.repair("stray_backslash")
+            return pos + 1
+        char = text[pos + 1]
+        if char in _ESCAPES:
+            chunks.append(_ESCAPES[char])
+            return pos + 2
+        if char == "u":
+            digits = text[pos + 2:pos + 6]
+            if len(digits) == 4 and all(c in "0123456789abcdefABCDEF" for c in digits):
+                chunks.append(chr(int(digits, 16)))
+                return pos + 6
+        if char == "'" or char == "_":
+            # \' from single-quoted output and \_ from markdown escaping
+            self.repair("stray_backslash")
+            chunks.append(char)
+            return pos + 2
+        # Keep the backslash as a literal character (e.g. regexes in code)
+        self.repair("stray_backslash")
+        chunks.append("\\")
+        return pos + 1
+
+    def parse_number(self):
+        start = self.pos
+        text = self.text
+        while self.pos < self.length and text[self.pos] in _NUMBER_CHARS:
+            self.pos += 1
+        literal = text[start:self.pos]
+        try:
+            if any(c in literal for c in ".eE"):
+                return float(literal)
+            return int(literal)
+        except ValueError:
+            raise LenientJSONError(f"Invalid number {literal!r}", start)
+
+    def parse_bare_word(self):
+        start = self.pos
+        text = self.text
+        while self.pos < self.length and text[self.pos] not in _KEY_TERMINATORS:
+            self.pos += 1
+        word = text[start:self.pos]
+        if word in _BARE_WORDS:
+            if word[0].isupper():
+                self.repair("python_literal")
+            return _BARE_WORDS[word]
+        if not word:
+            raise LenientJSONError(f"Unexpected character {text[start]!r}", start)
+        # Unquoted string value; keep it rather than fail the whole response
+        self.repair("unquoted_value")
+        return word
+
+
+class ObjectEndScanner:
+    # Watches streamed text for the end of the first top-level JSON object.
+    # feed() returns the offset just past its closing brace once it has been
+    # seen, or -1. Only tracks double-quoted strings; if the output is too
+    # malformed for that, the caller still has the full text at the end.
+    def __init__(self):
+        self.offset = 0
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, text):
+        for index, char in enumerate(text):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == "{":
+                self.started = True
+                self.depth += 1
+            elif not self.started:
+                continue
+            elif char == '"':
+                self.in_string = True
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    end = self.offset + index + 1
+                    self.offset += len(text)
+                    return end
+        self.offset += len(text)
+        return -1
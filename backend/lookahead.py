@@ -0,0 +1,189 @@
+# Speculative generation of the levels a player has not reached yet.
+#
+# When a game session starts, the story and first challenges of every later
+# level are queued for background generation under a random session token.
+# By the time the player finishes a level, the next one is usually ready and
+# the client claims it with the token instead of waiting for fresh Amazon Q
+# calls. A claim for a level that is still being generated waits for that
+# generation rather than starting another. Unclaimed sessions expire.
+#
+# Slots live in memory by default. Given the shared state (shared_state.py),
+# they live in its SQLite file instead, so a level can be claimed from any
+# server process, not only the one that is generating it.
+import queue
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemorySlots:
+    # In-process slot store with the same interface as SharedState's
+    # lookahead methods
+    def __init__(self):
+        # token -> (created, {level: (ready, bundle, error)})
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def open_lookahead(self, token, levels, max_sessions):
+        # Returns how many old sessions were dropped to stay under max_sessions
+        with self._lock:
+            self._sessions[token] = (time.time(), {str(level): (False, None, None) for level in levels})
+            dropped = 0
+            while len(self._sessions) > max_sessions:
+                self._sessions.popitem(last=False)
+                dropped += 1
+            return dropped
+
+    def lookahead_pending(self, token, level):
+        with self._lock:
+            session = self._sessions.get(token)
+            slot = session[1].get(level) if session else None
+            return slot is not None and not slot[0]
+
+    def fill_lookahead(self, token, level, bundle, error):
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is not None and level in session[1]:
+                session[1][level] = (True, bundle, error)
+
+    def claim_lookahead(self, token, level):
+        # (bundle, status) without waiting; a ready slot is removed
+        with self._lock:
+            session = self._sessions.get(token)
+            slot = session[1].get(level) if session else None
+            if slot is None:
+                return None, "unknown"
+            if not slot[0]:
+                return None, "pending"
+            del session[1][level]
+            if not session[1]:
+                del self._sessions[token]
+        return (slot[1], "ready") if slot[1] is not None else (None, "failed")
+
+    def expire_lookahead(self, cutoff):
+        # Sessions are kept in creation order
+        with self._lock:
+            expired = 0
+            while self._sessions:
+                token, (created, _) = next(iter(self._sessions.items()))
+                if created >= cutoff:
+                    break
+                del self._sessions[token]
+                expired += 1
+            return expired
+
+    def lookahead_counts(self):
+        # (sessions, pending levels)
+        with self._lock:
+            pending = sum(1 for _, slots in self._sessions.values() for slot in slots.values() if not slot[0])
+            return len(self._sessions), pending
+
+
+class LookaheadSessions:
+    def __init__(self, generate_fn, workers=2, ttl_seconds=3600, max_sessions=1000, slots=None,
+                 poll_interval=0.05):
+        # generate_fn(level, language, session_id) -> (bundle, error)
+        self._generate = generate_fn
+        self.worker_count = workers
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.poll_interval = poll_interval
+        self._slots = slots if slots is not None else MemorySlots()
+
+        self._lock = threading.Lock()
+        # Wakes claims waiting on a level this process finished generating;
+        # levels generated by another process are picked up by polling
+        self._filled = threading.Condition(self._lock)
+        self._queue = queue.Queue()
+        self._started = False
+
+        self.opened = 0
+        self.generated = 0
+        self.failed = 0
+        self.claimed = 0
+        self.claims_waited = 0
+        self.claims_missed = 0
+        self.expired = 0
+
+    def start(self):
+        # Started lazily, like the challenge pool, so the Flask reloader
+        # parent process does not spawn generation threads
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for i in range(self.worker_count):
+            threading.Thread(target=self._worker_loop, name=f"lookahead-{i}", daemon=True).start()
+
+    def open(self, language, levels, session_id=None):
+        # Returns the token the client later claims each level with
+        self.start()
+        token = secrets.token_urlsafe(16)
+        expired = self._slots.expire_lookahead(time.time() - self.ttl_seconds)
+        expired += self._slots.open_lookahead(token, levels, self.max_sessions)
+        with self._lock:
+            self.expired += expired
+            self.opened += 1
+        for level in levels:
+            self._queue.put((token, str(level), language, session_id))
+        return token
+
+    def claim(self, token, level, wait=0):
+        # Returns (bundle, status): "ready", "pending" if the level is still
+        # being generated after `wait` seconds, "failed", or "unknown"
+        level = str(level)
+        deadline = time.time() + wait
+        bundle, status = self._slots.claim_lookahead(token, level)
+        if status == "pending":
+            with self._lock:
+                self.claims_waited += 1
+        while status == "pending":
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None, "pending"
+            with self._filled:
+                self._filled.wait(min(remaining, self.poll_interval))
+            bundle, status = self._slots.claim_lookahead(token, level)
+        with self._lock:
+            if bundle is None:
+                self.claims_missed += 1
+            else:
+                self.claimed += 1
+        return bundle, status
+
+    def _worker_loop(self):
+        while True:
+            token, level, language, session_id = self._queue.get()
+            # Expired or already abandoned
+            if not self._slots.lookahead_pending(token, level):
+                continue
+            try:
+                bundle, error = self._generate(level, language, session_id)
+            except Exception as e:
+                bundle, error = None, str(e)
+            if bundle is None:
+                print(f"Lookahead generation for level {level} failed: {error}")
+            self._slots.fill_lookahead(token, level, bundle, error)
+            with self._filled:
+                if bundle is None:
+                    self.failed += 1
+                else:
+                    self.generated += 1
+                self._filled.notify_all()
+
+    def stats(self):
+        sessions, pending = self._slots.lookahead_counts()
+        with self._lock:
+            return {
+                "workers": self.worker_count,
+                "sessions": sessions,
+                "pending_levels": pending,
+                "opened": self.opened,
+                "generated": self.generated,
+                "failed": self.failed,
+                "claimed": self.claimed,
+                "claims_waited": self.claims_waited,
+                "claims_missed": self.claims_missed,
+                "expired": self.expired,
+            }
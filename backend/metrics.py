@@ -0,0 +1,242 @@
+# In-process metrics in the Prometheus text format, plus a sampling profiler.
+#
+# Counters and histograms are created once at import time by the module that
+# records them and kept in a shared registry. Components that already keep
+# their own counters (executor, pool, cache, ...) are exported by registering
+# their stats() function; every numeric value becomes a gauge at scrape time.
+#
+# The profiler samples one thread's stack with sys._current_frames() at a
+# fixed interval and returns collapsed stacks ("outer;inner count") that
+# flame graph tools understand.
+import sys
+import threading
+import time
+from collections import Counter as _Tally, deque
+
+PREFIX = "codequest_"
+
+# Default histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 90)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class CounterMetric:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_label_text(self.labels, key)} {_number(value)}" for key, value in values]
+
+
+class HistogramMetric:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # label values -> [bucket counts..., sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+                    break
+            row[-2] += value
+            row[-1] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        with self._lock:
+            values = sorted((key, list(row)) for key, row in self._values.items())
+        lines = []
+        for key, row in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                le = [("le", _number(float(bound)))]
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {_number(round(row[-2], 6))}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, key)} {row[-1]}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._stats = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text, labels=()):
+        metric = CounterMetric(name, help_text, labels)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        metric = HistogramMetric(name, help_text, labels, buckets)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, component, stats_fn):
+        # stats_fn() -> dict; numeric values (also one level deep) become gauges
+        with self._lock:
+            self._stats = [(name, fn) for name, fn in self._stats if name != component]
+            self._stats.append((component, stats_fn))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+            stats = list(self._stats)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        for component, stats_fn in stats:
+            try:
+                values = stats_fn()
+            except Exception as e:
+                print(f"Could not collect {component} stats for metrics: {str(e)}")
+                continue
+            for key, value in _flatten(values):
+                name = f"{PREFIX}{component}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _flatten(values, prefix=""):
+    for key, value in values.items():
+        if isinstance(value, bool):
+            yield prefix + key, int(value)
+        elif isinstance(value, (int, float)):
+            yield prefix + key, value
+        elif isinstance(value, dict) and not prefix:
+            yield from _flatten(value, prefix=f"{key}_")
+
+
+registry = Registry()
+
+
+class SamplingProfiler:
+    # Samples the stack of one thread until stopped
+    def __init__(self, thread_id, interval=0.005, max_depth=64):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self._stacks = _Tally()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self.started = time.time()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.time() - self.started
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                frame = frame.f_back
+            self._stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self._stacks.most_common())
+
+
+class ProfileStore:
+    # Keeps the most recent request profiles for /api/profiles
+    def __init__(self, limit=20):
+        self._profiles = deque(maxlen=limit)
+        self._lock = threading.Lock()
+        self._ids = iter(range(1, sys.maxsize))
+
+    def add(self, path, profiler):
+        with self._lock:
+            profile_id = str(next(self._ids))
+            self._profiles.append({
+                "id": profile_id,
+                "path": path,
+                "duration_seconds": round(profiler.duration, 4),
+                "samples": profiler.samples,
+                "collapsed": profiler.collapsed(),
+            })
+        return profile_id
+
+    def get(self, profile_id):
+        with self._lock:
+            return next((p for p in self._profiles if p["id"] == profile_id), None)
+
+    def list(self):
+        with self._lock:
+            return [{key: value for key, value in p.items() if key != "collapsed"} for p in self._profiles]
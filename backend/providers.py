@@ -0,0 +1,641 @@
+# LLM backends used by the executor.
+#
+# A provider turns a prompt into text. generate() returns the whole output
+# and stream() calls emit(text) as output arrives. Both return
+# {"returncode", "stdout", "stderr"} on completion or {"error": ...} on
+# failure, the same shape the rest of the backend expects from the Amazon Q
+# CLI. Cancellation goes through the job: a provider registers how to stop
+# its work with job.set_cancel_hook(), and job.cancel() runs it.
+#
+# CLIProvider runs the real `q` binary once per prompt. WarmCLIProvider keeps
+# long-lived interactive `q chat` processes and feeds them prompts over
+# stdin, so a generation costs a pipe write instead of a cold start.
+# LocalProvider replays recorded or synthetic outputs (including malformed
+# ones) with a configurable latency distribution, so the server can be
+# load-tested without Amazon Q.
+import abc
+import codecs
+import json
+import os
+import queue
+import random
+import re
+import subprocess
+import threading
+import time
+import uuid
+
+TIMEOUT_ERROR = "Request to Amazon Q timed out"
+CANCELLED_ERROR = "Request to Amazon Q was cancelled"
+
+
+class LLMProvider(abc.ABC):
+    name = "base"
+
+    @abc.abstractmethod
+    def generate(self, prompt, job):
+        pass
+
+    def stream(self, prompt, job, emit):
+        # Providers that can't stream just emit the whole output at once
+        result = self.generate(prompt, job)
+        if "stdout" in result and result["stdout"]:
+            emit(result["stdout"])
+        return result
+
+    def stats(self):
+        return {"provider": self.name}
+
+
+class CLIProvider(LLMProvider):
+    name = "cli"
+
+    def __init__(self, binary="q"):
+        self.binary = binary
+
+    def command(self, prompt):
+        return [self.binary, "chat", "--no-interactive", prompt]
+
+    def generate(self, prompt, job):
+        process = subprocess.Popen(self.command(prompt), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        job.set_cancel_hook(process.kill)
+        try:
+            stdout, stderr = process.communicate(timeout=max(0, job.deadline - time.time()))
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            return {"error": TIMEOUT_ERROR}
+        if job.cancelled:
+            return {"error": CANCELLED_ERROR}
+        return {"returncode": process.returncode, "stdout": stdout, "stderr": stderr}
+
+    def stream(self, prompt, job, emit):
+        process = subprocess.Popen(self.command(prompt), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        job.set_cancel_hook(process.kill)
+        # Kill the child at the deadline even if it stops producing output
+        timer = threading.Timer(max(0, job.deadline - time.time()), process.kill)
+        timer.daemon = True
+        timer.start()
+        output = []
+        # Incremental decoding so multi-byte characters split across reads survive
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        try:
+            fd = process.stdout.fileno()
+            while True:
+                data = os.read(fd, 4096)
+                text = decoder.decode(data, final=not data)
+                if text:
+                    output.append(text)
+                    emit(text)
+                if not data:
+                    break
+            process.wait()
+            stderr = process.stderr.read().decode("utf-8", errors="replace")
+        finally:
+            timer.cancel()
+            process.stdout.close()
+            process.stderr.close()
+
+        if job.cancelled:
+            return {"error": CANCELLED_ERROR}
+        if time.time() >= job.deadline:
+            return {"error": TIMEOUT_ERROR}
+        return {"returncode": process.returncode, "stdout": "".join(output), "stderr": stderr}
+
+
+_ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+
+
+def _rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class _WarmProcess:
+    # One interactive `q chat` child; a reader thread queues its stdout
+    def __init__(self, binary):
+        self.process = subprocess.Popen([binary, "chat"], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL)
+        self.output = queue.Queue()
+        self.prompts = 0
+        self.baseline_rss_kb = None
+        self.killed = False
+        reader = threading.Thread(target=self._read, name=f"q-warm-{self.process.pid}", daemon=True)
+        reader.start()
+
+    def _read(self):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        fd = self.process.stdout.fileno()
+        while True:
+            try:
+                data = os.read(fd, 4096)
+            except OSError:
+                data = b""
+            text = decoder.decode(data, final=not data)
+            if text:
+                self.output.put(text)
+            if not data:
+                self.output.put(None)
+                return
+
+    def alive(self):
+        return not self.killed and self.process.poll() is None
+
+    def drain(self):
+        # Drop the startup banner or anything printed after the last marker.
+        # Returns False if the process has exited.
+        while True:
+            try:
+                chunk = self.output.get_nowait()
+            except queue.Empty:
+                return self.alive()
+            if chunk is None:
+                return False
+
+    def send(self, line):
+        self.process.stdin.write((line + "\n").encode("utf-8"))
+        self.process.stdin.flush()
+
+    def wait_ready(self, timeout):
+        # A marker round trip before the first real prompt, so the startup
+        # banner and first input prompt are read and dropped here instead of
+        # ending up in the first answer. Returns False if the process exits
+        # or does not answer in time.
+        marker = f"@@END-{uuid.uuid4().hex[:12]}@@"
+        deadline = time.time() + timeout
+        try:
+            self.send(f"Reply with a single line containing only {marker}")
+        except OSError:
+            return False
+        seen = ""
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            try:
+                chunk = self.output.get(timeout=remaining)
+            except queue.Empty:
+                return False
+            if chunk is None:
+                return False
+            # Keep enough to catch a marker or escape split across reads
+            seen = (seen + chunk)[-4 * len(marker):]
+            if marker in _ANSI_ESCAPE.sub("", seen):
+                return True
+
+    def reset(self, command, timeout):
+        # Clear the chat history so the next prompt does not carry every
+        # earlier answer as context, then check the process still answers
+        self.drain()
+        try:
+            self.send(command)
+        except OSError:
+            return False
+        return self.wait_ready(timeout)
+
+    def kill(self):
+        self.killed = True
+        try:
+            self.process.kill()
+        except OSError:
+            pass
+
+    def close(self):
+        self.kill()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            pass
+        for stream in (self.process.stdin, self.process.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+
+class WarmCLIProvider(LLMProvider):
+    # Each prompt is sent as one line, followed by an instruction to finish
+    # with a unique marker line; everything before the marker is the answer.
+    name = "cli-warm"
+
+    def __init__(self, binary="q", workers=4, max_prompts=50, max_rss_growth_mb=200, prewarm=True,
+                 cancel_grace_seconds=2.0, startup_timeout_seconds=60, clear_command="/clear"):
+        self.binary = binary
+        self.workers = max(1, workers)
+        # How long a new or just cleared process may take to answer its readiness check
+        self.startup_timeout_seconds = startup_timeout_seconds
+        # Sent after every prompt so a process starts each one without history;
+        # empty keeps the history
+        self.clear_command = clear_command
+        # A cancelled prompt may finish within this grace period so its
+        # process stays warm; after that the process is killed
+        self.cancel_grace_seconds = cancel_grace_seconds
+        # Recycle a process after this many prompts or this much memory growth
+        self.max_prompts = max_prompts
+        self.max_rss_growth_kb = max_rss_growth_mb * 1024
+        self._idle = []
+        self._busy = 0
+        # Processes being cleared in the background; they come back to _idle
+        self._resetting = 0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self.spawned = 0
+        self.recycled = 0
+        self.crashed = 0
+        self.prompts = 0
+        self.resets = 0
+        if prewarm:
+            threading.Thread(target=self._prewarm, name="q-warm-prewarm", daemon=True).start()
+
+    def generate(self, prompt, job):
+        return self._exchange(prompt, job, None)
+
+    def stream(self, prompt, job, emit):
+        return self._exchange(prompt, job, emit)
+
+    def _prewarm(self):
+        for _ in range(self.workers):
+            try:
+                process = self._spawn()
+            except OSError as e:
+                print(f"Could not start Amazon Q worker: {str(e)}")
+                return
+            self._release(process, reusable=True, busy=False)
+
+    def _spawn(self):
+        process = _WarmProcess(self.binary)
+        with self._lock:
+            self.spawned += 1
+        if not process.wait_ready(self.startup_timeout_seconds):
+            process.close()
+            with self._lock:
+                self.crashed += 1
+            raise OSError(f"Amazon Q worker did not become ready within {self.startup_timeout_seconds}s")
+        # Anything printed after the readiness marker, like the next input
+        # prompt, is dropped by drain() when the process is first used
+        return process
+
+    def _acquire(self):
+        while True:
+            with self._available:
+                # A process that is being cleared is back sooner than a new one starts
+                while not self._idle and self._resetting:
+                    self._available.wait()
+                process = self._idle.pop() if self._idle else None
+                self._busy += 1
+            if process is None:
+                try:
+                    return self._spawn()
+                except OSError:
+                    with self._lock:
+                        self._busy -= 1
+                    raise
+            if process.drain():
+                return process
+            # Died while idle: replace it
+            with self._lock:
+                self.crashed += 1
+                self._busy -= 1
+            process.close()
+
+    def _release(self, process, reusable, busy=True):
+        recycle = False
+        if reusable and process.alive():
+            rss = _rss_kb(process.process.pid)
+            if process.prompts >= self.max_prompts:
+                recycle = True
+            elif rss is not None and process.baseline_rss_kb is not None \
+                    and rss - process.baseline_rss_kb > self.max_rss_growth_kb:
+                recycle = True
+        with self._available:
+            if busy:
+                self._busy -= 1
+            keep = reusable and not recycle and process.alive() \
+                and len(self._idle) + self._resetting < self.workers
+            # Cleared off the request path, the answer is not held up by it
+            reset = keep and bool(self.clear_command) and process.prompts > 0
+            if reset:
+                self._resetting += 1
+            elif keep:
+                self._idle.append(process)
+                self._available.notify()
+            if recycle:
+                self.recycled += 1
+        if reset:
+            threading.Thread(target=self._reset, args=(process,), name="q-warm-reset", daemon=True).start()
+        elif not keep:
+            process.close()
+
+    def _reset(self, process):
+        ok = process.reset(self.clear_command, self.startup_timeout_seconds)
+        with self._available:
+            self._resetting -= 1
+            if ok:
+                self.resets += 1
+                self._idle.append(process)
+            else:
+                self.crashed += 1
+            self._available.notify()
+        if not ok:
+            print("Amazon Q worker did not answer after clearing its history, replacing it")
+            process.close()
+
+    def _exchange(self, prompt, job, emit):
+        process = self._acquire()
+        marker = f"@@END-{uuid.uuid4().hex[:12]}@@"
+        try:
+            process.send(" ".join(prompt.split()) + f" When you are done, print a final line containing only {marker}")
+        except OSError:
+            return self._fail(process, job)
+
+        output = []
+        pending = ""
+        cancelled_at = None
+        while True:
+            if job.cancelled and cancelled_at is None:
+                cancelled_at = time.time()
+            limit = job.deadline if cancelled_at is None else min(job.deadline, cancelled_at + self.cancel_grace_seconds)
+            remaining = limit - time.time()
+            if remaining <= 0:
+                self._release(process, reusable=False)
+                return {"error": CANCELLED_ERROR if cancelled_at is not None else TIMEOUT_ERROR}
+            try:
+                # Short waits so a cancellation is noticed promptly
+                chunk = process.output.get(timeout=min(remaining, 0.1))
+            except queue.Empty:
+                continue
+            if chunk is None:
+                return self._fail(process, job)
+            pending += _ANSI_ESCAPE.sub("", chunk)
+            end = pending.find(marker)
+            if end >= 0:
+                text, pending = pending[:end], ""
+            else:
+                # Hold back enough text to catch a marker split across reads
+                cut = max(0, len(pending) - len(marker) + 1)
+                text, pending = pending[:cut], pending[cut:]
+            if text and cancelled_at is None:
+                output.append(text)
+                if emit is not None:
+                    emit(text)
+            if end >= 0:
+                break
+
+        process.prompts += 1
+        if process.baseline_rss_kb is None:
+            process.baseline_rss_kb = _rss_kb(process.process.pid)
+        with self._lock:
+            self.prompts += 1
+        self._release(process, reusable=True)
+        if cancelled_at is not None:
+            return {"error": CANCELLED_ERROR}
+        return {"returncode": 0, "stdout": "".join(output), "stderr": ""}
+
+    def _fail(self, process, job):
+        self._release(process, reusable=False)
+        if job.cancelled:
+            return {"error": CANCELLED_ERROR}
+        with self._lock:
+            self.crashed += 1
+        return {"error": "Amazon Q worker process exited unexpectedly"}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "provider": self.name,
+                "workers": self.workers,
+                "idle": len(self._idle),
+                "busy": self._busy,
+                "resetting": self._resetting,
+                "spawned": self.spawned,
+                "prompts": self.prompts,
+                "resets": self.resets,
+                "recycled": self.recycled,
+                "crashed": self.crashed,
+            }
+
+
+def parse_latency(spec):
+    # "fixed:0.5", "uniform:0.2,2", "lognormal:0.0,0.5" (mu, sigma of ln seconds)
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v.strip()] if args else []
+    if kind == "fixed":
+        seconds = values[0] if values else 0.0
+        return lambda rng: seconds
+    if kind == "uniform":
+        low, high = (values + [0.0, 1.0][len(values):])[:2]
+        return lambda rng: rng.uniform(low, high)
+    if kind == "lognormal":
+        mu, sigma = (values + [0.0, 0.5][len(values):])[:2]
+        return lambda rng: rng.lognormvariate(mu, sigma)
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+# Building blocks for the local provider's synthetic challenges
+_VARIABLES = ["x", "y", "z", "total", "count", "step"]
+_OPERATORS = ["+", "-", "*"]
+_FUNCTIONS = ["abs({})", "max({}, {n})", "min({}, {n})", "len(str({}))", "sum([{}, {n}])", "int({} // {n})"]
+_CREATURES = ["goblin", "troll", "dragon", "wizard", "golem", "sphinx", "pirate", "robot", "ghost", "knight",
+              "witch", "gnome", "kraken", "phoenix", "ogre", "elf"]
+_PLACES = ["bridge", "tower", "cave", "forest", "castle", "harbor", "library", "mine", "swamp", "temple",
+           "market", "glacier", "volcano", "garden", "dungeon", "observatory"]
+_ASKS = ["What does this code print?", "What value is printed at the end?", "What is the output of this snippet?",
+         "Which number appears on the screen?"]
+_BLANKABLE = ["abs", "max", "min", "len", "str", "sum", "int", "if", "else", "for", "range", "print"]
+
+
+def _synthetic_program(rng, statements, keyword):
+    # A few statements over several variables. Which variables feed which
+    # is random, so programs differ in shape and not just in their numbers.
+    # With keyword set, at least one line uses a function or control flow.
+    names = [rng.choice(_VARIABLES)]
+    lines = [f"{names[0]} = {rng.randint(2, 20)}"]
+    forced = rng.randrange(statements) if keyword else -1
+    for index in range(statements):
+        source = rng.choice(names)
+        operator = rng.choice(_OPERATORS)
+        # Only multiply by small numbers, so answers stay short
+        operand = str(rng.randint(2, 9)) if operator == "*" else rng.choice(names + [str(rng.randint(2, 9))])
+        expression = f"{source} {operator} {operand}"
+        kind = rng.choice(["assign", "assign", "function", "if", "for"])
+        if index == forced and kind == "assign":
+            kind = rng.choice(["function", "if", "for"])
+        if kind == "function":
+            expression = rng.choice(_FUNCTIONS).format(expression, n=rng.randint(2, 9))
+        unused = [name for name in _VARIABLES if name not in names]
+        if kind in ("assign", "function") and unused and rng.random() < 0.5:
+            target = rng.choice(unused)
+            names.append(target)
+        else:
+            target = rng.choice(names)
+        if kind == "if":
+            lines.append(f"if {source} > {rng.randint(2, 30)}:\n    {target} = {expression}\n"
+                         f"else:\n    {target} = {target} {rng.choice(_OPERATORS)} {rng.randint(2, 9)}")
+        elif kind == "for":
+            lines.append(f"for _ in range({rng.randint(2, 4)}):\n"
+                         f"    {target} {rng.choice(_OPERATORS)}= {rng.randint(2, 3)}")
+        else:
+            lines.append(f"{target} = {expression}")
+    shown = rng.choice(names)
+    code = "\n".join(lines)
+    scope = {}
+    exec(code, {}, scope)
+    return code + f"\nprint({shown})", scope[shown]
+
+
+class LocalProvider(LLMProvider):
+    name = "local"
+
+    def __init__(self, latency="fixed:0.5", error_rate=0.0, malformed_rate=0.0, fixtures=None, seed=None):
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._counter = 0
+        # Recorded outputs: {"kind": "story" | "challenge" | "malformed", "output": "..."}
+        self._fixtures = {"story": [], "challenge": [], "malformed": []}
+        if fixtures:
+            with open(fixtures) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._fixtures.setdefault(record.get("kind", "challenge"), []).append(record["output"])
+
+    def generate(self, prompt, job):
+        output, delay, failed = self._plan(prompt)
+        job.set_cancel_hook(job.wake)
+        if job.sleep(min(delay, max(0, job.deadline - time.time()))):
+            return {"error": CANCELLED_ERROR}
+        if time.time() >= job.deadline and delay > 0:
+            return {"error": TIMEOUT_ERROR}
+        if failed:
+            return {"returncode": 1, "stdout": "", "stderr": "Simulated Amazon Q failure"}
+        return {"returncode": 0, "stdout": output, "stderr": ""}
+
+    def stream(self, prompt, job, emit):
+        output, delay, failed = self._plan(prompt)
+        job.set_cancel_hook(job.wake)
+        if failed:
+            if job.sleep(delay):
+                return {"error": CANCELLED_ERROR}
+            return {"returncode": 1, "stdout": "", "stderr": "Simulated Amazon Q failure"}
+        # Spread the output over the simulated latency in small chunks
+        pieces = [output[i:i + 64] for i in range(0, len(output), 64)] or [""]
+        step = delay / len(pieces)
+        for piece in pieces:
+            if job.sleep(step):
+                return {"error": CANCELLED_ERROR}
+            if time.time() >= job.deadline:
+                return {"error": TIMEOUT_ERROR}
+            emit(piece)
+        return {"returncode": 0, "stdout": output, "stderr": ""}
+
+    def _plan(self, prompt):
+        with self._rng_lock:
+            rng = self._rng
+            delay = max(0.0, self.latency(rng))
+            failed = rng.random() < self.error_rate
+            malformed = rng.random() < self.malformed_rate
+            self._counter += 1
+            serial = self._counter
+            pick = rng.random()
+        return self._output(prompt, malformed, serial, pick), delay, failed
+
+    def _output(self, prompt, malformed, serial, pick):
+        if malformed:
+            recorded = self._fixtures.get("malformed")
+            if recorded:
+                return recorded[int(pick * len(recorded))]
+            return "Sorry, I can't help with that request right now."
+
+        batch = re.search(r"JSON array of exactly (\d+)", prompt)
+        if batch:
+            count = int(batch.group(1))
+            types = re.search(r"question types, in order, MUST be: ([a-z, -]+)\.", prompt)
+            kinds = types.group(1).split(", ") if types else ["multiple-choice"] * count
+            items = [self._challenge(kinds[i % len(kinds)], serial * 100 + i) for i in range(count)]
+            return "```json\n" + json.dumps(items, indent=2) + "\n```"
+
+        if "story introduction" in prompt:
+            recorded = self._fixtures.get("story")
+            if recorded:
+                return recorded[int(pick * len(recorded))]
+            level = re.search(r"for level (\d+)", prompt)
+            return json.dumps({
+                "title": f"Level {level.group(1) if level else 1} Quest Number {serial}",
+                "story": f"Simulated adventure number {serial}. A goblin guards the path and only code can move it.",
+                "objective": f"Solve the goblin's puzzles to open gate {serial % 7}.",
+            })
+
+        recorded = self._fixtures.get("challenge")
+        if recorded:
+            return recorded[int(pick * len(recorded))]
+        question_type = "fill-in-blank" if "MUST be fill-in-blank" in prompt else "multiple-choice"
+        return "Here is your challenge:\n" + json.dumps(self._challenge(question_type, serial))
+
+    def _challenge(self, question_type, serial):
+        rng = random.Random(serial)
+        code, result = _synthetic_program(rng, rng.randint(4, 6), question_type == "fill-in-blank")
+        scene = f"The {rng.choice(_CREATURES)} of the {rng.choice(_PLACES)} casts this spell."
+
+        if question_type == "fill-in-blank":
+            positions = {word: re.search(rf"\b{word}\b", code) for word in _BLANKABLE}
+            words = [word for word, match in positions.items() if match]
+            chosen = sorted(rng.sample(words, 2), key=lambda word: positions[word].start())
+            template = code
+            for word in chosen:
+                template = re.sub(rf"\b{word}\b", "_____", template, count=1)
+            return {
+                "question": f"{scene} Fill in the blanks so the program prints {result}.",
+                "type": "fill-in-blank",
+                "template": template,
+                "answer": ", ".join(chosen),
+                "hint": f"One of the missing words is {chosen[0]}.",
+                "explanation": f"With {' and '.join(chosen)} in place the program prints {result}.",
+            }
+        options = [str(result)]
+        for candidate in (result + 1, result - 1, result * 2, result + 2, result - 2):
+            if len(options) < 4 and str(candidate) not in options:
+                options.append(str(candidate))
+        rng.shuffle(options)
+        return {
+            "question": f"{scene} {rng.choice(_ASKS)}",
+            "type": "multiple-choice",
+            "code": code,
+            "options": options,
+            "answer": str(result),
+            "hint": "Follow each variable one line at a time.",
+            "explanation": f"After every line has run, the printed value is {result}.",
+        }
+
+
+def create_provider(name, **options):
+    if name == "local":
+        return LocalProvider(
+            latency=options.get("latency", "fixed:0.5"),
+            error_rate=options.get("error_rate", 0.0),
+            malformed_rate=options.get("malformed_rate", 0.0),
+            fixtures=options.get("fixtures"),
+            seed=options.get("seed"),
+        )
+    if name == "cli":
+        return CLIProvider(binary=options.get("binary", "q"))
+    if name == "cli-warm":
+        return WarmCLIProvider(
+            binary=options.get("binary", "q"),
+            workers=options.get("workers", 4),
+            max_prompts=options.get("max_prompts", 50),
+            max_rss_growth_mb=options.get("max_rss_growth_mb", 200),
+            prewarm=options.get("prewarm", True),
+            cancel_grace_seconds=options.get("cancel_grace_seconds", 2.0),
+            startup_timeout_seconds=options.get("startup_timeout_seconds", 60),
+            clear_command=options.get("clear_command", "/clear"),
+        )
+    raise ValueError(f"Unknown LLM provider: {name}")
@@ -0,0 +1,287 @@
+# Bounded executor for Amazon Q generations.
+#
+# Every prompt goes through a single executor so the number of concurrent
+# generations (child processes for the CLI provider) never exceeds a global
+# cap; the work itself is done by an LLM provider, see providers.py. Work
+# waits in a priority queue (interactive requests ahead of background
+# preloading), each job carries a deadline after which the provider stops it,
+# and submissions are rejected with a retry hint once the queue is full. An
+# optional circuit breaker (see circuit_breaker.py) sees every outcome and
+# can refuse submissions while Amazon Q is failing.
+import itertools
+import math
+import queue
+import threading
+import time
+from collections import deque
+
+from metrics import registry
+from providers import CANCELLED_ERROR, TIMEOUT_ERROR
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_PRELOAD = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_PRELOAD: "preload"}
+
+Q_RUN_SECONDS = registry.histogram(
+    "q_run_seconds", "Wall time of one Amazon Q generation (process spawn to exit)", ("provider", "outcome"))
+Q_QUEUE_WAIT_SECONDS = registry.histogram(
+    "q_queue_wait_seconds", "Time a generation waited for a free executor slot", ("priority",))
+
+
+class QueueFullError(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Amazon Q executor queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Job:
+    def __init__(self, prompt, priority, deadline, stream=False):
+        self.prompt = prompt
+        self.priority = priority
+        self.deadline = deadline
+        # Streaming jobs hand stdout to the caller chunk by chunk
+        self.stream = stream
+        self.chunks = queue.Queue() if stream else None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.result = None
+        self.cancelled = False
+        # Admitted by a half-open circuit breaker as a probe
+        self.probe = False
+        # Set by streaming callers that stopped the job because its output
+        # was already good enough
+        self.accepted = False
+        self._cancel_hook = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._wakeup = threading.Event()
+        self._callbacks = []
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            return None
+        return self.result
+
+    def done(self):
+        return self._done.is_set()
+
+    def add_done_callback(self, fn):
+        # fn(job) runs on the worker thread once the job finishes, or right
+        # away if it already has
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def iter_output(self):
+        # Yields stdout text as the child produces it; ends when the job does
+        while True:
+            remaining = self.deadline + 1 - time.time()
+            try:
+                chunk = self.chunks.get(timeout=max(0.05, remaining))
+            except queue.Empty:
+                self.cancel()
+                return
+            if chunk is None:
+                return
+            yield chunk
+
+    def cancel(self):
+        # Stop the running generation; a queued job is skipped
+        with self._lock:
+            self.cancelled = True
+            hook = self._cancel_hook
+        self._wakeup.set()
+        if hook is not None:
+            hook()
+
+    def set_cancel_hook(self, hook):
+        # Providers register how to stop their work, e.g. killing a child process
+        with self._lock:
+            self._cancel_hook = hook
+            cancelled = self.cancelled
+        if cancelled:
+            hook()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def sleep(self, seconds):
+        # Waits up to seconds; returns True if the job was cancelled meanwhile
+        self._wakeup.wait(max(0, seconds))
+        return self.cancelled
+
+    def _finish(self, result):
+        with self._lock:
+            self.result = result
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception as e:
+                print(f"Job callback failed: {str(e)}")
+
+
+class QExecutor:
+    def __init__(self, provider, max_workers=4, max_queue=32, preload_queue=8, breaker=None):
+        self.provider = provider
+        self.breaker = breaker
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        # Background work may only use part of the queue so it can never
+        # push interactive requests into backpressure
+        self.preload_queue = min(preload_queue, max_queue)
+
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._queued = {PRIORITY_INTERACTIVE: 0, PRIORITY_PRELOAD: 0}
+        self._running = 0
+        self._workers = []
+        self._started = False
+        self._durations = deque(maxlen=100)
+
+        self.submitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.cancelled = 0
+        self.completed = 0
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for i in range(self.max_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"q-executor-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, prompt, priority=PRIORITY_INTERACTIVE, timeout=30, stream=False):
+        self.start()
+        with self._lock:
+            queued = sum(self._queued.values())
+            limit = self.max_queue if priority == PRIORITY_INTERACTIVE else self.preload_queue
+            if queued >= limit:
+                self.rejected += 1
+                raise QueueFullError(self._retry_after(queued))
+            probe = self.breaker.admit() if self.breaker is not None else False
+            self._queued[priority] += 1
+            self.submitted += 1
+        job = Job(prompt, priority, time.time() + timeout, stream=stream)
+        job.probe = probe
+        self._queue.put((priority, next(self._sequence), job))
+        return job
+
+    def run(self, prompt, priority=PRIORITY_INTERACTIVE, timeout=30):
+        job = self.submit(prompt, priority, timeout)
+        # The worker enforces the deadline; the extra second covers the kill
+        result = job.wait(timeout + 1)
+        if result is None:
+            job.cancel()
+            return {"error": TIMEOUT_ERROR}
+        return result
+
+    def stats(self):
+        with self._lock:
+            durations = list(self._durations)
+            return {
+                "provider": self.provider.name,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued_interactive": self._queued[PRIORITY_INTERACTIVE],
+                "queued_preload": self._queued[PRIORITY_PRELOAD],
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "cancelled": self.cancelled,
+                "avg_run_seconds": round(sum(durations) / len(durations), 3) if durations else None,
+            }
+
+    def _retry_after(self, queued):
+        # Caller holds the lock. Estimate how long until a slot frees up.
+        durations = self._durations
+        average = sum(durations) / len(durations) if durations else 5.0
+        return max(1, math.ceil(average * (queued + 1) / self.max_workers))
+
+    def _worker_loop(self):
+        while True:
+            priority, _, job = self._queue.get()
+            with self._lock:
+                self._queued[priority] -= 1
+                self._running += 1
+            try:
+                result = self._execute(job)
+            except Exception as e:
+                result = {"error": f"Error generating content: {str(e)}"}
+            try:
+                job._finish(result)
+            finally:
+                if job.stream:
+                    job.chunks.put(None)
+                with self._lock:
+                    self._running -= 1
+
+    def _check_runnable(self, job):
+        if job.cancelled:
+            with self._lock:
+                self.cancelled += 1
+            return {"error": CANCELLED_ERROR}
+        if job.deadline - time.time() <= 0:
+            # Expired while waiting in the queue, don't bother starting it
+            with self._lock:
+                self.timed_out += 1
+            return {"error": TIMEOUT_ERROR}
+        return None
+
+    def _execute(self, job):
+        failure = self._check_runnable(job)
+        if failure:
+            if self.breaker is not None:
+                self.breaker.record(None, 0, job.probe)
+            return failure
+
+        job.started_at = time.time()
+        Q_QUEUE_WAIT_SECONDS.observe(job.started_at - job.submitted_at, priority=PRIORITY_NAMES[job.priority])
+        # A provider that raises (q missing, Popen failing) still has to count
+        # as a failed run, or the breaker never sees it and a probe slot leaks
+        try:
+            if job.stream:
+                result = self.provider.stream(job.prompt, job, job.chunks.put)
+            else:
+                result = self.provider.generate(job.prompt, job)
+        except Exception as e:
+            result = {"error": f"Error generating content: {str(e)}"}
+
+        duration = time.time() - job.started_at
+        if job.cancelled:
+            outcome = "cancelled"
+        elif result.get("error") == TIMEOUT_ERROR:
+            outcome = "timeout"
+        elif "error" in result or result.get("returncode") != 0:
+            outcome = "failed"
+        else:
+            outcome = "ok"
+        Q_RUN_SECONDS.observe(duration, provider=self.provider.name, outcome=outcome)
+        if self.breaker is not None:
+            if outcome == "cancelled":
+                self.breaker.record("ok" if job.accepted else None, duration, job.probe)
+            else:
+                self.breaker.record(outcome, duration, job.probe)
+
+        with self._lock:
+            self._durations.append(duration)
+            if outcome == "cancelled":
+                self.cancelled += 1
+            elif outcome == "timeout":
+                self.timed_out += 1
+            else:
+                self.completed += 1
+
+        if job.cancelled:
+            return {"error": CANCELLED_ERROR}
+        return result
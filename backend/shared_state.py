@@ -0,0 +1,313 @@
+# State shared by all server processes on one host.
+#
+# A production server runs several worker processes, each with its own
+# memory. Anything that has to be coordinated between them lives in a small
+# SQLite database in WAL mode, next to the content cache:
+#
+# - in-flight generations: the first process to start a keyed generation
+#   holds a lease on it, and the others wait for its result instead of
+#   starting the same Amazon Q work again
+# - rate limits: one token bucket per client, whichever worker serves it
+# - lookahead slots (lookahead.py), so a session opened on one worker can
+#   claim its later levels from any of them
+# - challenge pool inventory (challenge_pool.py): ready challenges and the
+#   refills in flight for each key, so workers top up one shared pool
+#   instead of each filling its own
+#
+# Leases expire, so a worker that dies mid-generation only delays the
+# others until its lease runs out.
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from content_cache import _Transaction
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS flights (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS rate_limits (
+    client TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS lookahead (
+    token TEXT NOT NULL,
+    level TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    ready INTEGER NOT NULL DEFAULT 0,
+    bundle TEXT,
+    PRIMARY KEY (token, level)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS lookahead_created ON lookahead (created_at);
+CREATE TABLE IF NOT EXISTS pool_challenges (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    objective TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pool_challenges_key ON pool_challenges (key, id);
+CREATE TABLE IF NOT EXISTS pool_refills (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pool_refills_key ON pool_refills (key);
+"""
+
+
+class SharedState:
+    def __init__(self, path, poll_interval=0.05):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.led = 0
+        self.followed = 0
+        self.takeovers = 0
+        self.rate_limited = 0
+        self._checks_since_cleanup = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db().executescript(_SCHEMA)
+
+    def _db(self):
+        # One connection per thread, as in the content cache
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("PRAGMA busy_timeout=10000")
+            self._local.db = db
+        return db
+
+    def run(self, key, fn, lease_seconds=120):
+        # Runs fn() in at most one process at a time per key. Processes that
+        # find a generation in flight wait for it and get its (JSON
+        # round-tripped) result; if the owner fails or its lease lapses they
+        # run fn() themselves.
+        owner = f"{os.getpid()}:{threading.get_ident()}"
+        if not self._acquire(key, owner, lease_seconds):
+            with self._lock:
+                self.followed += 1
+            found, result = self._wait(key)
+            if found:
+                return result
+            with self._lock:
+                self.takeovers += 1
+            return fn()
+
+        with self._lock:
+            self.led += 1
+        try:
+            result = fn()
+        except BaseException:
+            with _Transaction(self._db()) as db:
+                db.execute("DELETE FROM flights WHERE key = ? AND owner = ?", (key, owner))
+            raise
+        with _Transaction(self._db()) as db:
+            db.execute("UPDATE flights SET done = 1, result = ?, finished_at = ? WHERE key = ? AND owner = ?",
+                       (json.dumps(result), time.time(), key, owner))
+        return result
+
+    def _acquire(self, key, owner, lease_seconds):
+        now = time.time()
+        with _Transaction(self._db()) as db:
+            # Finished flights are only kept for followers still reading them
+            db.execute("DELETE FROM flights WHERE done = 1 AND finished_at < ?", (now - 60,))
+            row = db.execute("SELECT done, expires_at FROM flights WHERE key = ?", (key,)).fetchone()
+            if row is not None and not row[0] and row[1] > now:
+                return False
+            db.execute("INSERT OR REPLACE INTO flights (key, owner, expires_at) VALUES (?, ?, ?)",
+                       (key, owner, now + lease_seconds))
+        return True
+
+    def _wait(self, key):
+        # Returns (True, result) once the owner finishes, or (False, None)
+        # if it gave up or its lease lapsed
+        db = self._db()
+        while True:
+            row = db.execute("SELECT done, result, expires_at FROM flights WHERE key = ?", (key,)).fetchone()
+            if row is None or (not row[0] and row[2] <= time.time()):
+                return False, None
+            if row[0]:
+                return True, json.loads(row[1])
+            time.sleep(self.poll_interval)
+
+    def allow(self, client, per_minute, burst):
+        # Token bucket shared by all processes. Returns (allowed, retry_after).
+        now = time.time()
+        rate = per_minute / 60.0
+        with self._lock:
+            self._checks_since_cleanup += 1
+            cleanup = self._checks_since_cleanup >= 500
+            if cleanup:
+                self._checks_since_cleanup = 0
+        with _Transaction(self._db()) as db:
+            row = db.execute("SELECT tokens, updated_at FROM rate_limits WHERE client = ?", (client,)).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+            if tokens < 1:
+                allowed = False
+            else:
+                tokens -= 1
+                allowed = True
+            db.execute("INSERT OR REPLACE INTO rate_limits (client, tokens, updated_at) VALUES (?, ?, ?)",
+                       (client, tokens, now))
+            # A full bucket carries no information, so idle clients are dropped
+            if cleanup:
+                db.execute("DELETE FROM rate_limits WHERE updated_at < ?", (now - burst / rate,))
+        if allowed:
+            return True, 0
+        with self._lock:
+            self.rate_limited += 1
+        return False, max(1, math.ceil((1 - tokens) / rate))
+
+    # Lookahead slots, see lookahead.MemorySlots for the in-process version
+
+    def open_lookahead(self, token, levels, max_sessions):
+        now = time.time()
+        with _Transaction(self._db()) as db:
+            db.executemany("INSERT OR REPLACE INTO lookahead (token, level, created_at) VALUES (?, ?, ?)",
+                           [(token, str(level), now) for level in levels])
+            # Oldest sessions beyond the limit go first
+            dropped = [row[0] for row in db.execute(
+                "SELECT token FROM lookahead GROUP BY token ORDER BY MIN(created_at) DESC LIMIT -1 OFFSET ?",
+                (max_sessions,))]
+            db.executemany("DELETE FROM lookahead WHERE token = ?", [(token,) for token in dropped])
+        return len(dropped)
+
+    def lookahead_pending(self, token, level):
+        row = self._db().execute("SELECT ready FROM lookahead WHERE token = ? AND level = ?",
+                                 (token, level)).fetchone()
+        return row is not None and not row[0]
+
+    def fill_lookahead(self, token, level, bundle, error):
+        with _Transaction(self._db()) as db:
+            db.execute("UPDATE lookahead SET ready = 1, bundle = ? WHERE token = ? AND level = ?",
+                       (None if bundle is None else json.dumps(bundle), token, level))
+
+    def claim_lookahead(self, token, level):
+        # Polled while a level is pending, so only a ready slot takes the
+        # write lock
+        db = self._db()
+        row = db.execute("SELECT ready FROM lookahead WHERE token = ? AND level = ?", (token, level)).fetchone()
+        if row is None:
+            return None, "unknown"
+        if not row[0]:
+            return None, "pending"
+        with _Transaction(db):
+            row = db.execute("DELETE FROM lookahead WHERE token = ? AND level = ? RETURNING bundle",
+                             (token, level)).fetchone()
+        if row is None:
+            # Claimed by another request in the meantime
+            return None, "unknown"
+        return (json.loads(row[0]), "ready") if row[0] is not None else (None, "failed")
+
+    def expire_lookahead(self, cutoff):
+        with _Transaction(self._db()) as db:
+            expired = db.execute("SELECT COUNT(DISTINCT token) FROM lookahead WHERE created_at < ?",
+                                 (cutoff,)).fetchone()[0]
+            if expired:
+                db.execute("DELETE FROM lookahead WHERE created_at < ?", (cutoff,))
+        return expired
+
+    def lookahead_counts(self):
+        return self._db().execute(
+            "SELECT COUNT(DISTINCT token), COALESCE(SUM(ready = 0), 0) FROM lookahead").fetchone()
+
+    # Challenge pool inventory. Keys are the pool's (level, language) joined
+    # with "|"; each challenge also records the objective bucket it was
+    # generated for.
+
+    def pool_take(self, key, objective):
+        # Oldest challenge for key, preferring one generated for objective.
+        # Returns (challenge, whether its objective matched).
+        db = self._db()
+        # Misses are the common case while a key fills up; don't lock for them
+        if db.execute("SELECT 1 FROM pool_challenges WHERE key = ? LIMIT 1", (key,)).fetchone() is None:
+            return None, False
+        with _Transaction(db):
+            row = db.execute("DELETE FROM pool_challenges WHERE id = (SELECT id FROM pool_challenges WHERE key = ?"
+                             " ORDER BY objective = ? DESC, id LIMIT 1) RETURNING payload, objective",
+                             (key, objective)).fetchone()
+        if row is None:
+            return None, False
+        return json.loads(row[0]), row[1] == objective
+
+    def pool_put(self, key, objective, payload, watermark):
+        with _Transaction(self._db()) as db:
+            if db.execute("SELECT COUNT(*) FROM pool_challenges WHERE key = ?", (key,)).fetchone()[0] >= watermark:
+                return False
+            db.execute("INSERT INTO pool_challenges (key, objective, payload) VALUES (?, ?, ?)",
+                       (key, objective, json.dumps(payload)))
+        return True
+
+    def pool_reserve(self, key, watermark, lease_seconds):
+        # Reserves the refills that bring key up to the watermark, counting
+        # the ones other processes already have in flight. Returns their ids.
+        now = time.time()
+        db = self._db()
+        depth, inflight = self._pool_depth(db, key, now)
+        if depth + inflight >= watermark:
+            return []
+        with _Transaction(db):
+            db.execute("DELETE FROM pool_refills WHERE key = ? AND expires_at <= ?", (key, now))
+            depth, inflight = self._pool_depth(db, key, now)
+            return [db.execute("INSERT INTO pool_refills (key, expires_at) VALUES (?, ?)",
+                               (key, now + lease_seconds)).lastrowid
+                    for _ in range(watermark - depth - inflight)]
+
+    def pool_fill(self, reservation, key, objective, payload, max_items):
+        # Ends a reserved refill, storing its challenge if it produced one.
+        # Returns the key's depth afterwards.
+        with _Transaction(self._db()) as db:
+            db.execute("DELETE FROM pool_refills WHERE id = ?", (reservation,))
+            if payload is not None:
+                db.execute("INSERT INTO pool_challenges (key, objective, payload) VALUES (?, ?, ?)",
+                           (key, objective, json.dumps(payload)))
+                # Bound the inventory like the in-memory pool's key limit
+                db.execute("DELETE FROM pool_challenges WHERE id <= (SELECT id FROM pool_challenges"
+                           " ORDER BY id DESC LIMIT 1 OFFSET ?)", (max_items,))
+            return db.execute("SELECT COUNT(*) FROM pool_challenges WHERE key = ?", (key,)).fetchone()[0]
+
+    def pool_depths(self):
+        # {key: (depth, refills in flight)}
+        db = self._db()
+        depths = {key: [count, 0] for key, count in
+                  db.execute("SELECT key, COUNT(*) FROM pool_challenges GROUP BY key")}
+        for key, count in db.execute("SELECT key, COUNT(*) FROM pool_refills WHERE expires_at > ? GROUP BY key",
+                                     (time.time(),)):
+            depths.setdefault(key, [0, 0])[1] = count
+        return {key: tuple(value) for key, value in depths.items()}
+
+    def _pool_depth(self, db, key, now):
+        depth = db.execute("SELECT COUNT(*) FROM pool_challenges WHERE key = ?", (key,)).fetchone()[0]
+        inflight = db.execute("SELECT COUNT(*) FROM pool_refills WHERE key = ? AND expires_at > ?",
+                              (key, now)).fetchone()[0]
+        return depth, inflight
+
+    def stats(self):
+        db = self._db()
+        inflight = db.execute("SELECT COUNT(*) FROM flights WHERE done = 0 AND expires_at > ?",
+                              (time.time(),)).fetchone()[0]
+        clients = db.execute("SELECT COUNT(*) FROM rate_limits").fetchone()[0]
+        with self._lock:
+            return {
+                "path": self.path,
+                "inflight": inflight,
+                "led": self.led,
+                "followed": self.followed,
+                "takeovers": self.takeovers,
+                "tracked_clients": clients,
+                "rate_limited": self.rate_limited,
+            }
@@ -0,0 +1,132 @@
+# Request coalescing for identical generation requests.
+#
+# When a class starts the same level together, many identical requests
+# arrive within a second. Instead of one Amazon Q call each, concurrent
+# requests with the same key share work: story requests wait on the
+# generation already in flight, and challenge requests that arrive within a
+# short window are served from one batch sized to the number of waiters, so
+# every waiter still gets a distinct challenge. Coalescing is per process
+# and safe to use from any number of request threads.
+import copy
+import threading
+import time
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.size = 1
+        # Challenge groups accept new waiters until the leader starts generating
+        self.open = True
+        self.result = None
+        self.items = []
+        self.error = None
+        self.exception = None
+
+
+class SingleFlight:
+    def __init__(self, window=0.05, max_batch=10):
+        # How long a challenge leader waits for identical requests to join
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self._lock = threading.Lock()
+        self._shared = {}
+        self._batches = {}
+        self.requests = 0
+        self.generations = 0
+        self.largest_batch = 0
+        self.shortfalls = 0
+
+    def run(self, key, fn):
+        # Every concurrent caller with the same key gets a copy of one fn() result
+        with self._lock:
+            self.requests += 1
+            flight = self._shared.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._shared[key] = flight
+                self.generations += 1
+            else:
+                flight.size += 1
+
+        if leader:
+            try:
+                flight.result = fn()
+            except Exception as e:
+                flight.exception = e
+            finally:
+                with self._lock:
+                    del self._shared[key]
+                flight.done.set()
+        else:
+            flight.done.wait()
+
+        if flight.exception is not None:
+            raise flight.exception
+        # Callers may modify what they get back (e.g. the cache adds an id)
+        return copy.deepcopy(flight.result)
+
+    def run_batch(self, key, generate_one, generate_many):
+        # generate_one() -> (item, error); generate_many(count) -> (items, error).
+        # Returns (item, error) with an item no other waiter received.
+        with self._lock:
+            self.requests += 1
+            flight = self._batches.get(key)
+            leader = flight is None or not flight.open or flight.size >= self.max_batch
+            if leader:
+                flight = _Flight()
+                self._batches[key] = flight
+                slot = 0
+            else:
+                slot = flight.size
+                flight.size += 1
+
+        if leader:
+            if self.window > 0:
+                time.sleep(self.window)
+            with self._lock:
+                flight.open = False
+                if self._batches.get(key) is flight:
+                    del self._batches[key]
+                size = flight.size
+                self.generations += 1
+                self.largest_batch = max(self.largest_batch, size)
+            try:
+                if size == 1:
+                    item, flight.error = generate_one()
+                    flight.items = [item] if item is not None else []
+                else:
+                    items, flight.error = generate_many(size)
+                    flight.items = items or []
+            except Exception as e:
+                flight.exception = e
+            finally:
+                flight.done.set()
+        else:
+            flight.done.wait()
+
+        if flight.exception is not None:
+            raise flight.exception
+        if slot < len(flight.items):
+            return flight.items[slot], None
+        if not flight.items:
+            return None, flight.error
+        # The batch came back short: generate this waiter's challenge on its own
+        with self._lock:
+            self.shortfalls += 1
+            self.generations += 1
+        return generate_one()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "window_seconds": self.window,
+                "in_flight": len(self._shared) + len(self._batches),
+                "requests": self.requests,
+                "generations": self.generations,
+                "coalesced": self.requests - self.generations,
+                "coalescing_ratio": round(self.requests / self.generations, 3) if self.generations else None,
+                "largest_batch": self.largest_batch,
+                "shortfalls": self.shortfalls,
+            }
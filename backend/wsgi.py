@@ -0,0 +1,6 @@
+# WSGI entry point for production servers:
+#
+#   gunicorn -c gunicorn.conf.py wsgi:app
+from app import app, start_warmup
+
+__all__ = ["app", "start_warmup"]
@@ -2,7 +2,7 @@ import React, { useState, useEffect } from 'react';
 import StartScreen from './components/StartScreen';
 import GameScreen from './components/GameScreen';
 import LoadingScreen from './components/LoadingScreen';
-import { getStory, getChallenge, preloadChallenges } from './services/api';
+import { getStory, getChallenge, preloadChallenges, startSession, streamStory, streamChallenge } from './services/api';
 
 const App = () => {
   const [gameState, setGameState] = useState('start'); // start, loading, game
@@ -13,20 +13,44 @@ const App = () => {
   const [loadingProgress, setLoadingProgress] = useState(0);
   const [error, setError] = useState(null);
 
+  // Move the progress bar forward while content streams in, without
+  // ever passing the end of the current loading phase
+  const trackStreamProgress = (from, to) => (type) => {
+    if (type === 'progress' || type === 'retry') {
+      setLoadingProgress(current => Math.min(to - 1, Math.max(current, from) + 2));
+    }
+  };
+
   const handleStart = async (selectedLanguage) => {
     setLanguage(selectedLanguage);
     setGameState('loading');
     setLoadingProgress(0);
     
     try {
-      // Start loading story (50% of progress)
       setLoadingProgress(5);
-      const storyData = await getStory(level);
-      setStory(storyData);
-      setLoadingProgress(50);
+      // One request for the story and first challenges; the backend also
+      // starts preparing the later levels
+      const sessionStory = await startSession(selectedLanguage).catch(() => null);
       
-      // Then load challenge (remaining 50% of progress)
-      const challengeData = await getChallenge(level, selectedLanguage);
+      let storyData;
+      let challengeData;
+      if (sessionStory) {
+        storyData = sessionStory;
+        setStory(storyData);
+        // Served from the challenges that came with the session
+        challengeData = await getChallenge(level, selectedLanguage, storyData.objective);
+      } else {
+        // Start loading story (50% of progress)
+        storyData = await streamStory(level, trackStreamProgress(5, 50))
+          // Fall back to a plain request only if streaming itself is unavailable
+          .catch(err => (err.fromServer ? Promise.reject(err) : getStory(level)));
+        setStory(storyData);
+        setLoadingProgress(50);
+        
+        // Then load challenge (remaining 50% of progress)
+        challengeData = await streamChallenge(level, selectedLanguage, storyData.objective, trackStreamProgress(50, 95))
+          .catch(err => (err.fromServer ? Promise.reject(err) : getChallenge(level, selectedLanguage)));
+      }
       setChallenge(challengeData);
       setLoadingProgress(95);
       
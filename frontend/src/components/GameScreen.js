@@ -2,7 +2,7 @@ import React, { useEffect, useState, useRef } from 'react';
 import styled from 'styled-components';
 import GameEngine from '../game/GameEngine';
 import { playerConfig, gameProgressionConfig } from '../config/gameConfig';
-import { getStory, getChallenge, submitAnswer, preloadChallenges, getCachedChallengeCount, isPreloadingChallenges, flushPreloadedChallenges, getStoredObjective } from '../services/api';
+import { getStory, getChallenge, submitAnswer, preloadChallenges, getCachedChallengeCount, isPreloadingChallenges, flushPreloadedChallenges, getStoredObjective, claimLevel } from '../services/api';
 import LoadingScreen from './LoadingScreen';
 
 const Container = styled.div`
@@ -355,6 +355,56 @@ const ErrorMessage = styled.div`
   font-family: 'Courier New', monospace;
 `;
 
+// Fallback grading in the browser, used when /api/feedback can't be reached
+const gradeLocally = (challenge, answer) => {
+  // Improved answer validation
+  let isCorrect = false;
+
+  if (challenge.type === 'multiple-choice') {
+    // For multiple choice, still use exact matching
+    isCorrect = answer === challenge.answer;
+  } else if (challenge.type === 'fill-in-blank' && answer.includes(',')) {
+    // For fill-in-blank with multiple answers
+    const userParts = answer.split(',').map(part => part.trim());
+    const correctParts = challenge.answer.split(',').map(part => part.trim());
+
+    if (userParts.length === correctParts.length) {
+      isCorrect = userParts.every((part, index) => {
+        const userClean = part.replace(/\s/g, '').toLowerCase();
+        const correctClean = correctParts[index].replace(/\s/g, '').toLowerCase();
+        return userClean === correctClean;
+      });
+    }
+  } else {
+    // For single-answer fill-in-blank
+    const userAnswerClean = answer.trim().replace(/\s+/g, ' ');
+    const correctAnswerClean = challenge.answer.trim().replace(/\s+/g, ' ');
+
+    // Check for exact match after normalization
+    if (userAnswerClean === correctAnswerClean) {
+      isCorrect = true;
+    } else {
+      // Check for semantic equivalence (ignoring whitespace, semicolons, etc.)
+      const userNoWhitespace = userAnswerClean.replace(/\s/g, '').replace(/;/g, '');
+      const correctNoWhitespace = correctAnswerClean.replace(/\s/g, '').replace(/;/g, '');
+
+      // Check for case insensitivity
+      const userLower = userNoWhitespace.toLowerCase();
+      const correctLower = correctNoWhitespace.toLowerCase();
+
+      isCorrect = userNoWhitespace === correctNoWhitespace || userLower === correctLower;
+    }
+  }
+
+  return {
+    is_correct: isCorrect,
+    feedback: isCorrect
+      ? "Correct! Great job!"
+      : `Incorrect. The correct answer is: ${challenge.answer}`,
+    next_hint: !isCorrect ? challenge.hint : null
+  };
+};
+
 const GameScreen = ({ story: initialStory = null, initialChallenge = null, level = 1, language = 'python', initialError = null }) => {
   const [challenge, setChallenge] = useState(initialChallenge || null);
   const [story, setStory] = useState(initialStory || null);
@@ -385,8 +435,9 @@ const GameScreen = ({ story: initialStory = null, initialChallenge = null, level
       // Get current level from game engine or use state
       const level = gameEngineRef.current ? gameEngineRef.current.getCurrentLevel() : currentLevel;
 
-      // Fetch story based on current level
-      const storyResponse = await getStory(level);
+      // Use the content prepared since the session started, or fetch the
+      // story based on current level
+      const storyResponse = (await claimLevel(level)) || await getStory(level);
       setStory(storyResponse);
       
       // Hide story loading indicator
@@ -689,62 +740,21 @@ const GameScreen = ({ story: initialStory = null, initialChallenge = null, level
     }
   };
 
-  const handleSubmit = () => {
+  const handleSubmit = async () => {
     if (!challenge || submitDisabled) return;
 
     // Get the user's answer
     const answer = challenge.type === 'multiple-choice' ? selectedOption : userAnswer;
+    setSubmitDisabled(true);
 
-    // Improved answer validation
-    let isCorrect = false;
-
-    if (challenge.type === 'multiple-choice') {
-      // For multiple choice, still use exact matching
-      isCorrect = answer === challenge.answer;
-    } else if (challenge.type === 'fill-in-blank' && answer.includes(',')) {
-      // For fill-in-blank with multiple answers
-      const userParts = answer.split(',').map(part => part.trim());
-      const correctParts = challenge.answer.split(',').map(part => part.trim());
-
-      if (userParts.length === correctParts.length) {
-        isCorrect = userParts.every((part, index) => {
-          const userClean = part.replace(/\s/g, '').toLowerCase();
-          const correctClean = correctParts[index].replace(/\s/g, '').toLowerCase();
-          return userClean === correctClean;
-        });
-      }
-    } else {
-      // For single-answer fill-in-blank
-      const userAnswerClean = answer.trim().replace(/\s+/g, ' ');
-      const correctAnswerClean = challenge.answer.trim().replace(/\s+/g, ' ');
-
-      // Check for exact match after normalization
-      if (userAnswerClean === correctAnswerClean) {
-        isCorrect = true;
-      } else {
-        // Check for semantic equivalence (ignoring whitespace, semicolons, etc.)
-        const userNoWhitespace = userAnswerClean.replace(/\s/g, '').replace(/;/g, '');
-        const correctNoWhitespace = correctAnswerClean.replace(/\s/g, '').replace(/;/g, '');
-
-        // Check for case insensitivity
-        const userLower = userNoWhitespace.toLowerCase();
-        const correctLower = correctNoWhitespace.toLowerCase();
-
-        isCorrect = userNoWhitespace === correctNoWhitespace || userLower === correctLower;
-      }
+    let result;
+    try {
+      result = await submitAnswer(answer, challenge, language);
+    } catch (error) {
+      result = gradeLocally(challenge, answer);
     }
 
-    // Create feedback object
-    const result = {
-      is_correct: isCorrect,
-      feedback: isCorrect
-        ? "Correct! Great job!"
-        : `Incorrect. The correct answer is: ${challenge.answer}`,
-      next_hint: !isCorrect ? challenge.hint : null
-    };
-
     setFeedback(result);
-    setSubmitDisabled(true);
 
     // Reset feedback animation state
     setFeedbackAnimation(false);
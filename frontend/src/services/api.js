@@ -2,6 +2,38 @@ import axios from 'axios';
 
 const API_URL = 'http://localhost:5000/api';
 
+// Identifies this browser session so the backend cache never serves
+// the same story or challenge to a player twice
+const SESSION_ID = (window.crypto && window.crypto.randomUUID)
+  ? window.crypto.randomUUID()
+  : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+axios.defaults.headers.common['X-Session-Id'] = SESSION_ID;
+
+// How many times to retry a request the backend rejected as busy (HTTP 429)
+const MAX_BUSY_RETRIES = 3;
+
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+/**
+ * GET request that waits and retries when the backend is busy,
+ * honouring the Retry-After header sent with HTTP 429 responses
+ */
+const getWithBusyRetry = async (url, config) => {
+  for (let attempt = 0; ; attempt++) {
+    try {
+      return await axios.get(url, config);
+    } catch (error) {
+      const status = error.response && error.response.status;
+      if (status !== 429 || attempt >= MAX_BUSY_RETRIES) {
+        throw error;
+      }
+      const retryAfter = parseInt(error.response.headers['retry-after']) || 1;
+      console.log(`Backend busy, retrying in ${retryAfter}s`);
+      await sleep(retryAfter * 1000);
+    }
+  }
+};
+
 // Cache for storing preloaded challenges by level
 const challengeCache = {
   items: {
@@ -15,7 +47,7 @@ const challengeCache = {
 
 export const getStory = async (level) => {
   try {
-    const response = await axios.get(`${API_URL}/story`, {
+    const response = await getWithBusyRetry(`${API_URL}/story`, {
       params: { level }
     });
     
@@ -32,6 +64,112 @@ export const getStory = async (level) => {
   }
 };
 
+// Token for claiming the levels the backend prepares ahead of the player
+let sessionToken = null;
+
+/**
+ * Puts a level's story objective and challenges where getStory and
+ * getChallenge would have put them
+ */
+const storeLevelBundle = (bundle) => {
+  const level = bundle.level;
+  levelObjectives[level] = bundle.story.objective;
+  challengeCache.items[level] = [...(challengeCache.items[level] || []), ...bundle.challenges];
+  return bundle.story;
+};
+
+/**
+ * Starts a game session: returns the level 1 story in one request, with its
+ * first challenges queued for getChallenge. The backend starts preparing
+ * the later levels at the same time.
+ */
+export const startSession = async (language) => {
+  try {
+    const response = await axios.post(`${API_URL}/session`, { language });
+    sessionToken = response.data.token;
+    return storeLevelBundle(response.data);
+  } catch (error) {
+    console.error('Error starting session:', error);
+    throw error;
+  }
+};
+
+/**
+ * Claims the story and challenges the backend prepared for a later level.
+ * Resolves with the story, or null if nothing was prepared.
+ */
+export const claimLevel = async (level) => {
+  if (!sessionToken) return null;
+  try {
+    const response = await axios.get(`${API_URL}/session/${sessionToken}/level/${level}`);
+    if (response.status !== 200) {
+      return null;
+    }
+    console.log(`Claimed prepared content for level ${level}`);
+    return storeLevelBundle(response.data);
+  } catch (error) {
+    console.log(`No prepared content for level ${level}, generating it now`);
+    return null;
+  }
+};
+
+/**
+ * Opens a Server-Sent Events stream and resolves with the generated payload.
+ * onEvent receives the 'status', 'progress' and 'retry' events sent while
+ * Amazon Q is still generating.
+ */
+const streamFromServer = (path, params, onEvent) => new Promise((resolve, reject) => {
+  const query = new URLSearchParams({ session: SESSION_ID });
+  Object.entries(params).forEach(([key, value]) => {
+    if (value !== undefined && value !== null) {
+      query.append(key, value);
+    }
+  });
+  
+  const source = new EventSource(`${API_URL}${path}?${query}`);
+  ['status', 'progress', 'retry'].forEach(type => {
+    source.addEventListener(type, (event) => {
+      if (onEvent) {
+        onEvent(type, JSON.parse(event.data));
+      }
+    });
+  });
+  source.addEventListener('result', (event) => {
+    source.close();
+    resolve(JSON.parse(event.data));
+  });
+  // Fired both for server 'error' events and for connection failures
+  source.addEventListener('error', (event) => {
+    source.close();
+    if (event.data) {
+      const error = new Error(JSON.parse(event.data).error);
+      error.fromServer = true;
+      reject(error);
+    } else {
+      reject(new Error('Stream connection failed'));
+    }
+  });
+});
+
+export const streamStory = async (level, onEvent) => {
+  const story = await streamFromServer('/story/stream', { level }, onEvent);
+  
+  // Store the objective for this level when we get a story
+  if (story && story.objective) {
+    levelObjectives[level] = story.objective;
+  }
+  return story;
+};
+
+export const streamChallenge = (level, language, objective, onEvent) => {
+  const validLevel = Math.min(Math.max(parseInt(level) || 1, 1), 3);
+  return streamFromServer('/challenge/stream', {
+    level: validLevel,
+    language,
+    objective: objective || levelObjectives[validLevel]
+  }, onEvent);
+};
+
 // Store objectives by level to maintain consistency
 const levelObjectives = {
   1: null,
@@ -81,7 +219,7 @@ export const getChallenge = async (level, language, objective) => {
     challengeCache.activeRequests.push(cancelTokenSource);
     
     console.log(`Requesting challenge with objective: ${objective}`);
-    const response = await axios.get(`${API_URL}/challenge`, {
+    const response = await getWithBusyRetry(`${API_URL}/challenge`, {
       params: { level: validLevel, language, objective },
       cancelToken: cancelTokenSource.token
     });
@@ -137,29 +275,26 @@ export const preloadChallenges = async (level, language, count = 2, objective) =
       challengeCache.items[validLevel] = [];
     }
     
-    // Preload challenges one by one to avoid overwhelming the server
-    for (let i = 0; i < count; i++) {
-      // Create a cancel token for this request
-      const cancelTokenSource = axios.CancelToken.source();
-      
-      // Add this token to our active requests array
-      challengeCache.activeRequests.push(cancelTokenSource);
+    // Fetch all preloaded challenges in a single batch request
+    const cancelTokenSource = axios.CancelToken.source();
+    
+    // Add this token to our active requests array
+    challengeCache.activeRequests.push(cancelTokenSource);
+    
+    try {
+      console.log(`Preloading ${count} challenges with objective: ${objective}`);
+      const response = await getWithBusyRetry(`${API_URL}/challenges/batch`, {
+        params: { level: validLevel, language, objective, count },
+        cancelToken: cancelTokenSource.token
+      });
       
-      try {
-        console.log(`Preloading challenge ${i+1} with objective: ${objective}`);
-        const response = await axios.get(`${API_URL}/challenge`, {
-          params: { level: validLevel, language, objective },
-          cancelToken: cancelTokenSource.token
-        });
-        
-        challengeCache.items[validLevel].push(response.data);
-        console.log(`Preloaded challenge ${i + 1}/${count} for level ${validLevel}`);
-      } finally {
-        // Remove this token from active requests once completed or failed
-        const index = challengeCache.activeRequests.indexOf(cancelTokenSource);
-        if (index > -1) {
-          challengeCache.activeRequests.splice(index, 1);
-        }
+      challengeCache.items[validLevel].push(...response.data.challenges);
+      console.log(`Preloaded ${response.data.challenges.length}/${count} challenges for level ${validLevel}`);
+    } finally {
+      // Remove this token from active requests once completed or failed
+      const index = challengeCache.activeRequests.indexOf(cancelTokenSource);
+      if (index > -1) {
+        challengeCache.activeRequests.splice(index, 1);
       }
     }
   } catch (error) {
@@ -230,12 +365,18 @@ export const flushPreloadedChallenges = (level = null) => {
   }
 };
 
-export const submitAnswer = async (answer, correct_answer, question) => {
+export const submitAnswer = async (answer, challenge, language = 'python') => {
   try {
+    // Graded on the server without an Amazon Q round-trip
     const response = await axios.post(`${API_URL}/feedback`, {
       answer,
-      correct_answer,
-      question
+      correct_answer: challenge.answer,
+      question: challenge.question,
+      type: challenge.type,
+      template: challenge.template,
+      hint: challenge.hint,
+      challenge_id: challenge.id,
+      language
     });
     return response.data;
   } catch (error) {